@@ -17,7 +17,7 @@ def dump_tsv():
         cur.row_factory = dict_factory
 
         print(f"publication_ids\ttitle\tabstract\tlanguage\torganization_ids\tssif_codes")
-        for row in cur.execute(f"SELECT data FROM finalized", []):
+        for row in cur.execute(f"SELECT decompress(data) AS data FROM finalized", []):
             if row.get("data"):
                 finalized = orjson.loads(row["data"])
                 publication = Publication(finalized)
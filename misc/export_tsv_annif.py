@@ -25,7 +25,7 @@ def dump_tsv(target_language="en", number_of_records=10000, min_level=1, max_lev
         # dump everything (number_of_records = 0) with create_tsv_sets.sh, which will
         # run `shuf` after everything has been written. Then you can just get whatever
         # number of lines you need.
-        for row in cur.execute(f"SELECT data FROM converted {limit_sql}", []):
+        for row in cur.execute(f"SELECT decompress(data) AS data FROM converted {limit_sql}", []):
             if row.get("data"):
                 finalized = orjson.loads(row["data"])
                 publication = Publication(finalized)
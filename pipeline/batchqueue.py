@@ -0,0 +1,198 @@
+import threading
+import time
+from collections import defaultdict, deque
+
+# All sources feed their record batches to one shared pool of record processing workers. The
+# batches themselves go straight from the sources to the workers, through a plain multiprocessing
+# queue; what's kept in a BatchQueue, which lives in the harvest Manager (see
+# pipeline.harvestmanager), is only the accounting, so that the records aren't sent through the
+# Manager process (twice).
+#
+# Each producer (a source set being harvested) is admitted to the queue in turn, so a source with
+# a lot of records doesn't make other sources wait for all of its batches to be processed: at most
+# `max_queued` batches wait for a worker at once, and when there's room, it goes to the producer that
+# has waited the longest. A producer may have at most `max_in_flight` batches queued or being
+# processed; put() blocks beyond that, so that a fast source can't fill memory with batches the
+# workers haven't gotten to yet.
+#
+# Batches are numbered per producer. Workers finish them in any order, but completed() tells
+# how many of a producer's batches have been processed without gaps, which is what a producer
+# can safely checkpoint (see harvest checkpoints in pipeline.harvest).
+#
+# If the workers can't go on (e.g. one of them died), the queue is failed: batches in flight will
+# never be done, so instead of waiting for them, put() and join() raise BatchesLost. A single batch
+# that couldn't be handled or stored is lost the same way, but only for its own producer.
+
+
+class BatchesLost(Exception):
+    pass
+
+
+class BatchQueue:
+    def __init__(self, max_in_flight, max_queued=1):
+        self.max_in_flight = max(max_in_flight, 1)
+        self.max_queued = max(max_queued, 1)
+        self._in_flight = defaultdict(int)
+        self._queued = 0
+        self._next_seq = defaultdict(int)
+        # Per producer: the number of batches processed without gaps, and the numbers of the
+        # batches processed after a gap
+        self._completed = defaultdict(int)
+        self._done = defaultdict(set)
+        # Producers waiting to put a batch, in the order they'll be admitted
+        self._turns = deque()
+        self._failed = None
+        # Producers that lost batches (e.g. in flight when the queue failed), with the reason
+        self._lost = {}
+        self._condition = threading.Condition()
+
+    # Make room for a batch from producer `key`, blocking until it's the producer's turn and it
+    # doesn't have too many batches in flight. The batch is then to be sent to the workers as
+    # (key, seq, batch). Returns (seq, the number of batches in flight for `key`, including this one).
+    def put(self, key):
+        with self._condition:
+            self._turns.append(key)
+            try:
+                while not self._admits(key):
+                    self._condition.wait()
+            finally:
+                self._turns.remove(key)
+                self._condition.notify_all()
+            seq = self._next_seq[key]
+            self._next_seq[key] += 1
+            self._in_flight[key] += 1
+            self._queued += 1
+            return seq, self._in_flight[key]
+
+    def _admits(self, key):
+        if self._failed:
+            raise BatchesLost(self._failed)
+        if key in self._lost:
+            raise BatchesLost(self._lost[key])
+        if self._queued >= self.max_queued:
+            return False
+        for waiting in self._turns:
+            if self._in_flight.get(waiting, 0) < self.max_in_flight:
+                return waiting == key
+        return False
+
+    # Called by a worker when it takes a batch from `key`, making room for another one
+    def started(self, key):
+        with self._condition:
+            self._queued = max(self._queued - 1, 0)
+            self._condition.notify_all()
+
+    # Called when batch `seq` from `key` has been processed (and stored)
+    def done(self, key, seq):
+        with self._condition:
+            if not self._in_flight.get(key):
+                # (Forgotten when the queue failed)
+                return
+            self._in_flight[key] -= 1
+            if not self._in_flight[key]:
+                del self._in_flight[key]
+            done = self._done[key]
+            done.add(seq)
+            while self._completed[key] in done:
+                done.remove(self._completed[key])
+                self._completed[key] += 1
+            self._condition.notify_all()
+
+    # Batch `seq` from `key` won't be processed after all (e.g. it couldn't be stored). It's never
+    # counted as completed, so the producer's checkpoints stop before it, and the producer gets
+    # BatchesLost, now or later; other producers go on.
+    def lose(self, key, seq, reason):
+        with self._condition:
+            if not self._in_flight.get(key):
+                # (Forgotten when the queue failed)
+                return
+            self._in_flight[key] -= 1
+            if not self._in_flight[key]:
+                del self._in_flight[key]
+            self._lost.setdefault(key, reason)
+            self._condition.notify_all()
+
+    # Number of batches from `key` that have been processed, counting from the first one up to
+    # the first batch that's still waiting or being processed
+    def completed(self, key):
+        with self._condition:
+            return self._completed.get(key, 0)
+
+    # Block until all batches from `key` have been processed, then forget about `key`
+    def join(self, key):
+        with self._condition:
+            while self._in_flight.get(key):
+                self._condition.wait()
+            for counts in (self._next_seq, self._completed, self._done):
+                counts.pop(key, None)
+            if key in self._lost:
+                raise BatchesLost(self._lost.pop(key))
+
+    # The batches in flight are lost (and no more will be processed): the producers waiting for
+    # them, now or later, get BatchesLost
+    def fail(self, reason):
+        with self._condition:
+            if self._failed:
+                return
+            self._failed = reason
+            self._lost.update(dict.fromkeys(self._in_flight, reason))
+            self._in_flight.clear()
+            self._queued = 0
+            self._condition.notify_all()
+
+
+# The producer side of a BatchQueue for one source set, sending its batches to the workers through
+# `payloads` and keeping track of how many batches were in flight: if the producer mostly had to
+# wait for the workers, processing is the bottleneck; if its batches were mostly alone in the
+# queue, the workers were waiting for the producer (e.g. for the network).
+#
+# A checkpoint can be given with each batch (whatever is needed to continue producing after
+# that batch); completed_checkpoint() returns the latest one whose batch, and all batches
+# before it, have been processed.
+class BatchProducer:
+    def __init__(self, batch_queue, payloads, key, max_in_flight):
+        self.batch_queue = batch_queue
+        self.payloads = payloads
+        self.key = key
+        self.max_in_flight = max_in_flight
+        self.submitted = 0
+        self.max_depth = 0
+        self._depth_sum = 0
+        self.wait_time = 0.0
+        self._checkpoints = deque()
+
+    def put(self, batch, checkpoint=None):
+        start = time.monotonic()
+        seq, depth = self.batch_queue.put(self.key)
+        self.wait_time += time.monotonic() - start
+        self.payloads.put((self.key, seq, batch))
+        self.submitted += 1
+        self._depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+        if checkpoint is not None:
+            self._checkpoints.append((self.submitted, checkpoint))
+
+    # The latest checkpoint reached since the last call, or None if there's no new one
+    def completed_checkpoint(self):
+        if not self._checkpoints:
+            return None
+        completed = self.batch_queue.completed(self.key)
+        checkpoint = None
+        while self._checkpoints and self._checkpoints[0][0] <= completed:
+            checkpoint = self._checkpoints.popleft()[1]
+        return checkpoint
+
+    def join(self):
+        start = time.monotonic()
+        self.batch_queue.join(self.key)
+        self.wait_time += time.monotonic() - start
+
+    @property
+    def average_depth(self):
+        return self._depth_sum / self.submitted if self.submitted else 0
+
+    def summary(self):
+        return (
+            f"{self.submitted} batches, on average {round(self.average_depth, 1)} (max {self.max_depth}) "
+            f"of at most {self.max_in_flight} in flight, {round(self.wait_time, 2)} seconds waiting for workers"
+        )
@@ -0,0 +1,141 @@
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import closing
+from functools import partial
+from os import getenv
+
+import zstandard
+
+from pipeline.swepublog import logger as log
+
+# With --compress (SWEPUB_COMPRESS), the bulky columns - original.data, converted.data,
+# converted.events and finalized.data - are stored zstd compressed, as BLOBs. Each kind of data
+# (xml, json, events) has its own dictionary, trained on the first values of that kind written,
+# which are stored as they are meanwhile. Uncompressed values remain valid, so a database can
+# contain both, and compression can be turned on for an existing database.
+#
+# The columns are read through the decompress() SQL function (registered on all connections, see
+# register_decompress), which returns the text of both compressed and uncompressed values.
+# A compressed value names the dictionary it needs (zstd frames contain the dictionary ID).
+COMPRESSION_DICTIONARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS compression_dictionary (
+    dict_id INTEGER PRIMARY KEY, -- the zstd dictionary ID
+    kind TEXT, -- xml (original.data), json (converted.data, finalized.data) or events (converted.events)
+    data BLOB
+)
+"""
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+COMPRESSION_LEVEL = 3
+DICTIONARY_SIZE = 112640
+# Number of values of a kind to train its dictionary on
+TRAINING_SAMPLES = 1000
+
+
+def compression_enabled():
+    return bool(getenv("SWEPUB_COMPRESS"))
+
+
+# Per process: the dictionaries (and their compressors) to compress each kind of data with, the
+# samples collected for kinds that don't have one yet, and the databases known to have all of the
+# dictionaries (a process may write to several, see storage.consolidate_shards)
+_dictionaries = {}
+_compressors = {}
+_samples = defaultdict(list)
+_saved_to = set()
+
+
+# Compress `value` (text, or UTF-8 as from orjson.dumps) if compression is enabled and there is a
+# dictionary for `kind`; otherwise returns the value as it is
+def compress(kind, value):
+    if value is None or not compression_enabled():
+        return value
+    data = value.encode("utf-8") if isinstance(value, str) else value
+    compressor = _compressors.get(kind)
+    if compressor is None:
+        if len(_samples[kind]) < TRAINING_SAMPLES:
+            _samples[kind].append(data)
+        return value
+    return compressor.compress(data)
+
+
+# Load the database's dictionaries (saving ours to it, if it lacks any), and train (and save)
+# dictionaries for the kinds that have enough samples. Compression only uses dictionaries that are in the database, so this must be called by
+# anything writing compressed data, in the transaction it is written in but outside any savepoint
+# that may be rolled back.
+def prepare_compression(connection):
+    global _saved_to
+    if not compression_enabled():
+        return
+    path = connection.execute("PRAGMA database_list").fetchone()[2]
+    if path not in _saved_to:
+        connection.execute(COMPRESSION_DICTIONARY_SCHEMA)
+        for dict_id, kind, data in connection.execute("SELECT dict_id, kind, data FROM compression_dictionary"):
+            if kind not in _dictionaries:
+                _use_dictionary(kind, zstandard.ZstdCompressionDict(data))
+        connection.executemany(
+            "INSERT OR IGNORE INTO compression_dictionary(dict_id, kind, data) VALUES (?, ?, ?)",
+            [(dictionary.dict_id(), kind, dictionary.as_bytes()) for kind, dictionary in _dictionaries.items()],
+        )
+        _saved_to.add(path)
+    for kind, samples in list(_samples.items()):
+        if kind in _compressors or len(samples) < TRAINING_SAMPLES:
+            continue
+        del _samples[kind]
+        try:
+            dictionary = zstandard.train_dictionary(DICTIONARY_SIZE, samples, level=COMPRESSION_LEVEL)
+        except zstandard.ZstdError as e:
+            log.warning(f"Could not train a compression dictionary for {kind}: {e}")
+            continue
+        connection.execute(
+            "INSERT INTO compression_dictionary(dict_id, kind, data) VALUES (?, ?, ?)",
+            (dictionary.dict_id(), kind, dictionary.as_bytes()),
+        )
+        _use_dictionary(kind, dictionary)
+        # Only this database has it so far
+        _saved_to = {path}
+        log.info(f"Trained a compression dictionary for {kind} on {len(samples)} samples")
+
+
+# To be called when a transaction in which prepare_compression() may have saved dictionaries is
+# rolled back
+def reset_compression():
+    _dictionaries.clear()
+    _compressors.clear()
+    _saved_to.clear()
+
+
+def _use_dictionary(kind, dictionary):
+    _dictionaries[kind] = dictionary
+    _compressors[kind] = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dictionary)
+
+
+# Decompressors by (database, dictionary ID), shared by the connections of a process
+_decompressors = {}
+_decompressors_lock = threading.Lock()
+
+
+def _decompressor(path, dict_id):
+    with _decompressors_lock:
+        if (path, dict_id) not in _decompressors:
+            # Any compressed value we can read was committed together with its dictionary
+            with closing(sqlite3.connect(path)) as connection:
+                row = connection.execute(
+                    "SELECT data FROM compression_dictionary WHERE dict_id = ?", (dict_id,)
+                ).fetchone()
+            if row is None:
+                raise ValueError(f"Compression dictionary {dict_id} is missing from {path}")
+            _decompressors[(path, dict_id)] = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(row[0]))
+        return _decompressors[(path, dict_id)]
+
+
+def decompress(path, value):
+    if not isinstance(value, bytes) or not value.startswith(ZSTD_MAGIC):
+        return value
+    dict_id = zstandard.get_frame_parameters(value).dict_id
+    return _decompressor(path, dict_id).decompress(value).decode("utf-8")
+
+
+# Make decompress(value) available in SQL on `connection` to the database at `path`
+def register_decompress(connection, path):
+    connection.create_function("decompress", 1, partial(decompress, path), deterministic=True)
@@ -2,7 +2,7 @@ import re
 from io import StringIO
 from os import path
 
-from lxml.etree import parse, XSLT, fromstring, LxmlError, XMLSyntaxError
+from lxml.etree import parse, XSLT, LxmlError, XMLSyntaxError
 
 
 class ModsParser(object):
@@ -27,7 +27,10 @@ class ModsParser(object):
     def _components(self, xml, encode_ampsersand=False):
         myid = None
         mods = None
-        if encode_ampsersand:
+        if not isinstance(xml, str):
+            # Already parsed (an ElementTree or the root element)
+            elems = xml.getroot() if hasattr(xml, "getroot") else xml
+        elif encode_ampsersand:
             elems = parse(StringIO(self.match.sub("&amp;", xml))).getroot()
         else:
             elems = parse(StringIO(xml)).getroot()
@@ -50,7 +53,7 @@ class ModsParser(object):
             myid, elem = self._components(xml, encode_ampersand)
 
             if elem is not None and len(elem):
-                doc = self._xjson(fromstring(str(self._convert(elem))))
+                doc = self._xjson(self._convert(elem).getroot())
             else:
                 doc = {}
 
@@ -73,5 +76,6 @@ class ModsParser(object):
         return node
 
 
+# body is either the record XML as text or an already parsed tree (see pipeline.oai.Record.tree)
 def convert(body):
     return ModsParser().parse_mods(body)
@@ -120,26 +120,30 @@ def is_considered_similar_enough(a, b):
 
 
 # Are publications 'a' and 'b' similar enough to justify clustering them?
-# 'a' and 'b' are row IDs into the 'converted' table.
-def _is_close_enough(a_rowid, b_rowid):
-    with get_connection() as connection:
-        cursor = connection.cursor()
-        cursor.execute(
-            """
+# 'a' and 'b' are row IDs into the 'converted' table, and `documents` their decoded data by row ID.
+def _is_close_enough(documents, a_rowid, b_rowid):
+    # Compared in row ID order
+    a, b = sorted((a_rowid, b_rowid), key=int)
+    return is_considered_similar_enough(documents[a], documents[b])
+
+
+# The decoded data of the candidates, by row ID. Every candidate is compared to all the others, so
+# it's read and decoded once for the group rather than for each comparison.
+def _get_candidate_documents(candidate_list, cursor):
+    return {
+        str(rowid): json.loads(data)
+        for rowid, data in cursor.execute(
+            f"""
         SELECT
-            data
+            id, decompress(data)
         FROM
             converted
         WHERE
-            rowid = ? OR rowid = ?;
+            id IN ({",".join("?" * len(candidate_list))});
         """,
-            (a_rowid, b_rowid),
+            candidate_list,
         )
-        candidate_rows = cursor.fetchall()  # Will give exactly 2 rows, per definition
-        a = json.loads(candidate_rows[0][0])
-        b = json.loads(candidate_rows[1][0])
-
-        return is_considered_similar_enough(a, b)
+    }
 
 
 # Generate clusters of publications, based on some shared piece of data
@@ -210,11 +214,14 @@ def _generate_clusters():
 
 def _check_candidate_groups(batch):
     pairs = []
-    for candidate_list in batch:
-        for a in candidate_list:
-            for b in candidate_list:
-                if a != b and _is_close_enough(a, b):
-                    pairs.append((a, b))
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        for candidate_list in batch:
+            documents = _get_candidate_documents(candidate_list, cursor)
+            for a in candidate_list:
+                for b in candidate_list:
+                    if a != b and _is_close_enough(documents, a, b):
+                        pairs.append((a, b))
     return pairs
 
 
@@ -1,7 +1,7 @@
 import unicodedata
 import sys
 
-from pipeline.util import update_at_path, make_event, Enrichment
+from pipeline.util import make_event, Enrichment
 
 # See DOI validator in validator service for more info on these.
 INVALID_DOI_UNICODE_CATEGORIES = {"Cc", "Cf", "Zl", "Zp", "Zs"}
@@ -24,15 +24,14 @@ DOI_START = "10."
 VALID_STARTS = (DOI_START, "https://doi.org/10.", "http://doi.org/10.")
 
 
-def recover_doi(body, field, cached_paths={}):
+def recover_doi(body, field):
     doi = field.value
-    path = field.path
 
     initial = doi
     translated = doi.translate(TRANSLATE_DICT)
     if translated != doi:
         doi = translated
-        update_at_path(body, path, doi, cached_paths)
+        field.update(body, doi)
         field.events.append(
             make_event(
                 event_type="enrichment",
@@ -52,7 +51,7 @@ def recover_doi(body, field, cached_paths={}):
         if hit != -1:
             if field.enrichment_status == Enrichment.ENRICHED:
                 initial = field.value
-            update_at_path(body, path, doi[hit:], cached_paths)
+            field.update(body, doi[hit:])
             field.events.append(
                 make_event(
                     event_type="enrichment",
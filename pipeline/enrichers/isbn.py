@@ -2,7 +2,7 @@ import re
 
 from stdnum.isbn import compact
 
-from pipeline.util import update_at_path, add_sibling_at_path, make_event, FieldMeta, Enrichment, unicode_translate
+from pipeline.util import make_event, Enrichment, unicode_translate
 
 # flake8: noqa W504
 isbn_regex = re.compile(
@@ -14,16 +14,15 @@ isbn_regex = re.compile(
 )
 
 
-def recover_isbn(body, field, cached_paths={}):
+def recover_isbn(body, field):
     original = field.value
     isbn = field.value
-    path = field.path
     created_fields = []
 
     translated = unicode_translate(isbn)
     if translated != isbn:
         isbn = translated
-        update_at_path(body, path, isbn, cached_paths)
+        field.update(body, isbn)
         field.events.append(
             make_event(
                 event_type="enrichment",
@@ -48,7 +47,7 @@ def recover_isbn(body, field, cached_paths={}):
 
     if len(res) > 0:
         if res[0] != isbn:
-            update_at_path(body, path, res[0], cached_paths)
+            field.update(body, res[0])
             field.value = res[0]
             field.enrichment_status = Enrichment.ENRICHED
             field.events.append(
@@ -72,10 +71,7 @@ def recover_isbn(body, field, cached_paths={}):
                         result="enriched",
                     )
                 )
-                new_path = add_sibling_at_path(body, path, type="ISBN", value=found_value, cached_paths=cached_paths)
-                created_fields.append(
-                    FieldMeta(path=new_path, id_type=field.id_type, value=found_value)
-                )
+                created_fields.append(field.append_identifier(body, 2, type="ISBN", value=found_value))
 
     if field.enrichment_status != Enrichment.ENRICHED:
         field.enrichment_status = Enrichment.UNSUCCESSFUL
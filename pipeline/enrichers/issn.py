@@ -1,10 +1,7 @@
 import re
 from pipeline.util import (
-    update_at_path,
-    add_sibling_at_path,
     unicode_translate,
     make_event,
-    FieldMeta,
     Enrichment
 )
 
@@ -23,16 +20,15 @@ issn_regex = re.compile(
 )
 
 
-def recover_issn(body, field, cached_paths={}):
+def recover_issn(body, field):
     issn = field.value
-    path = field.path
     created_fields = []
 
     translated = unicode_translate(issn)
     if translated != issn:
         initial = issn
         issn = translated
-        update_at_path(body, path, issn, cached_paths)
+        field.update(body, issn)
         field.events.append(
             make_event(
                 event_type="enrichment",
@@ -60,7 +56,7 @@ def recover_issn(body, field, cached_paths={}):
                     result="enriched",
                 )
             )
-            update_at_path(body, path, recovered[0], cached_paths)
+            field.update(body, recovered[0])
             field.enrichment_status = Enrichment.ENRICHED
             field.value = recovered[0]
 
@@ -75,10 +71,7 @@ def recover_issn(body, field, cached_paths={}):
                         result="enriched",
                     )
                 )
-                new_path = add_sibling_at_path(body, path, type="ISSN", value=found_value, cached_paths=cached_paths)
-                created_fields.append(
-                    FieldMeta(path=new_path, id_type=field.id_type, value=found_value)
-                )
+                created_fields.append(field.append_identifier(body, 2, type="ISSN", value=found_value))
 
     if field.enrichment_status != Enrichment.ENRICHED:
         field.enrichment_status = Enrichment.UNSUCCESSFUL
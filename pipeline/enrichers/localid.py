@@ -1,13 +1,10 @@
 from pipeline.storage import dict_factory
-from pipeline.util import FieldMeta, Enrichment, Validation, get_at_path, append_at_path, get_localid_cache_key, make_event
-from jsonpath_rw import parse
+from pipeline.util import Enrichment, Validation, get_localid_cache_key, make_event
 
 
-def recover_orcid_from_localid(body, field, harvest_cache, source, cached_paths={}, read_only_cursor=None):
+def recover_orcid_from_localid(body, field, harvest_cache, source, read_only_cursor=None):
     created_fields = []
-    parent_path = field.path.rsplit(".", 1)[0]
-
-    all_ids_for_agent = get_at_path(body, parent_path, cached_paths)
+    all_ids_for_agent = field.get_parent(body)
 
     for id_value in all_ids_for_agent:
         if id_value.get("@type") == "ORCID":
@@ -17,8 +14,7 @@ def recover_orcid_from_localid(body, field, harvest_cache, source, cached_paths=
     if not isinstance(field.value, dict) or not field.value.get("source", {}).get("code") or not field.value.get("value"):
         return
 
-    parent_path_2 = field.path.rsplit(".", 3)[0]
-    parent_path_2_value = get_at_path(body, parent_path_2, cached_paths)
+    parent_path_2_value = field.get_parent(body, 3)
     person_name = f"{parent_path_2_value.get('agent', {}).get('familyName', '')}{parent_path_2_value.get('agent', {}).get('givenName', '')}".strip()
     if not person_name or len(person_name) < 4:
         return
@@ -32,7 +28,8 @@ def recover_orcid_from_localid(body, field, harvest_cache, source, cached_paths=
             orcid = result["orcid"]
             source_oai_id = result["source_oai_id"]
             #print(f"LocalID MATCH! source {source_oai_id}, enriched {body['@id']}, {person_name}")
-            new_path = append_at_path(body, parent_path, type="ORCID", new_value=orcid, cached_paths=cached_paths)
+            new_field = field.append_identifier(body, 1, type="ORCID", value=orcid)
+            new_field.validation_status = Validation.VALID
             field.events.append(
                 make_event(
                     event_type="enrichment",
@@ -42,21 +39,13 @@ def recover_orcid_from_localid(body, field, harvest_cache, source, cached_paths=
                     result="enriched",
                 )
             )
-            created_fields.append(
-                FieldMeta(path=new_path, id_type=field.id_type, value=orcid, validation_status=Validation.VALID)
-            )
+            created_fields.append(new_field)
             field.enrichment_status = Enrichment.ENRICHED
-            source_oai_ids = harvest_cache["enriched_from_other_record"].get(body["@id"], [])
-            source_oai_ids.append(source_oai_id)
-            harvest_cache["enriched_from_other_record"][body["@id"]] = list(set(source_oai_ids))
+            source_oai_ids = harvest_cache["enriched_from_other_record"].setdefault(body["@id"], [])
+            if source_oai_id not in source_oai_ids:
+                source_oai_ids.append(source_oai_id)
             return created_fields
         # If no result, add it to the list of records with localID but no ORCID
         else:
-            # Normally we'd use a dict or a list to keep track of the OAI IDs, but 
-            # harvest_cache["localid_without_orcid"] is handled by multiprocessing.Manager
-            # and I believe we'd had to create an additional managed dict/list for each cache
-            # key, which feels a bit unwieldy. So just append the OAI ID to a string that we'll
-            # split later on.
-            if not harvest_cache["localid_without_orcid"].get(cache_key):
-                harvest_cache["localid_without_orcid"][cache_key] = ""
-            harvest_cache["localid_without_orcid"][cache_key] += body["@id"] + " "
+            # (Kept in this process until it's handed over to the LearnedStore, see pipeline.learnedstore)
+            harvest_cache["localid_without_orcid"].setdefault(cache_key, []).append(body["@id"])
@@ -1,5 +1,5 @@
 import re
-from pipeline.util import update_at_path, unicode_translate, make_event, Enrichment
+from pipeline.util import unicode_translate, make_event, Enrichment
 
 # flake8: noqa W504
 orcid_regex = re.compile("(0000-?)" + "(000[1-3]-?)" + "([0-9]{4}-?)" + "([0-9]{3}-?[0-9xX])")
@@ -7,15 +7,14 @@ orcid_regex = re.compile("(0000-?)" + "(000[1-3]-?)" + "([0-9]{4}-?)" + "([0-9]{
 orcid_extend_regex = re.compile("000-?000[1-3]")
 
 
-def recover_orcid(body, field, cached_paths={}):
-    path = field.path
+def recover_orcid(body, field):
     orcid = field.value
 
     translated = unicode_translate(orcid)
     if translated != orcid:
         initial = orcid
         orcid = translated
-        update_at_path(body, path, orcid, cached_paths)
+        field.update(body, orcid)
         field.events.append(
             make_event(
                 event_type="enrichment",
@@ -31,7 +30,7 @@ def recover_orcid(body, field, cached_paths={}):
     if orcid_extend_regex.match(orcid):
         initial = orcid
         orcid = "0" + orcid
-        update_at_path(body, path, orcid, cached_paths)
+        field.update(body, orcid)
         field.events.append(
             make_event(
                 event_type="enrichment",
@@ -57,7 +56,7 @@ def recover_orcid(body, field, cached_paths={}):
                     result="enriched",
                 )
             )
-            update_at_path(body, path, orcid_list[0], cached_paths)
+            field.update(body, orcid_list[0])
             field.enrichment_status = Enrichment.ENRICHED
             field.value = orcid_list[0]
 
@@ -31,7 +31,7 @@ def dump_deduplicated(year=None):
 
         for row in cur.execute(f"""
             SELECT
-                finalized.data AS finalized_data, group_concat(converted.data, "\n") AS converted_data
+                decompress(finalized.data) AS finalized_data, group_concat(decompress(converted.data), "\n") AS converted_data
             FROM
                 cluster
             LEFT JOIN
@@ -77,7 +77,7 @@ def dump_duplicated(year=None):
             where_sql = " AND date = ? "
             params = [year]
 
-        for row in cur.execute(f"SELECT data FROM converted WHERE deleted = 0 {where_sql}", params):
+        for row in cur.execute(f"SELECT decompress(data) AS data FROM converted WHERE deleted = 0 {where_sql}", params):
             # TODO: should be able to simply print row["data"].decode("utf-8");
             # however, the type is sometimes str, sometimes bytes -- investigare why.
             if row.get("data"):
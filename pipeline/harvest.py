@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
+import gc
 import re
 import time
-from concurrent.futures import ProcessPoolExecutor
-from multiprocessing import Lock, Manager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import BoundedSemaphore, Lock, Process, Queue
+from queue import Empty
+from threading import Lock as ThreadLock
 import sys
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 import uuid
-from functools import partial
 import psutil
 from json import load
 from os import getenv, path, environ
+import zlib
 from contextlib import closing
 import codecs
 import csv
@@ -26,22 +29,57 @@ from pipeline.convert import convert
 from pipeline.deduplicate import deduplicate
 from pipeline.storage import (
     clean_and_init_storage,
+    create_deferred_indexes,
+    connect,
     store_original,
     store_converted,
+    ConvertedDetailRows,
     get_connection,
     storage_exists,
     get_sqlite_path, dict_factory,
+    init_harvest_checkpoints,
+    init_content_hashes,
+    init_converted_flags,
+    init_new_shard,
+    connect_new_shard,
+    replace_shard,
+    save_to_shard,
+    discard_new_shard,
+    get_shard_path,
+    get_shard_paths,
+    consolidate_shards,
+    get_content_hashes,
+    save_harvest_checkpoint,
+    get_harvest_checkpoints,
+    delete_harvest_checkpoints,
+    load_harvested_ids,
+    delete_records_not_harvested,
+    drop_harvested_ids,
 )
 from pipeline.index import generate_search_tables
 from pipeline.stats import generate_processing_stats
-from pipeline.oai import RecordIterator
-from pipeline.validate import validate, should_be_rejected
+from pipeline.oai import RecordIterator, date_windows
+from pipeline.oaiarchive import OAIArchiveReader, OAIArchiveWriter, ARCHIVE_SUFFIX
+from pipeline.hostscheduler import interleave_by_host, DEFAULT_MAX_LIMIT
+from pipeline.harvestmanager import HarvestManager
+from pipeline.batchqueue import BatchProducer
+from pipeline.validate import (
+    REMOTE_VERIFICATION_HOSTS,
+    REMOTE_VERIFICATION_WORKERS,
+    validate,
+    should_be_rejected,
+    verify_remotely,
+)
+from pipeline.compression import prepare_compression, reset_compression
+from pipeline.walcheckpointer import WalCheckpointer
+from pipeline.idcache import get_id_cache, prepare_id_cache
+from pipeline.learnedstore import new_learned, take_learned
 from pipeline.audit import audit
 from pipeline.legacy_sync import legacy_sync
 
 # To change log level, set SWEPUB_LOG_LEVEL environment variable to DEBUG, INFO, ..
 from pipeline.swepublog import logger as log
-from pipeline.util import chunker, get_common_json_paths, RandomisedRetry
+from pipeline.util import HostLimitedAdapter, RandomisedRetry
 
 
 # TODO: Move configuration (some of which is shared with service/swepub.py) to a separate file
@@ -83,7 +121,23 @@ TABLES_DELETED_ON_INCREMENTAL_OR_PURGE = [
 
 SWEPUB_USER_AGENT = getenv("SWEPUB_USER_AGENT", "https://github.com/libris")
 
-cached_paths = get_common_json_paths()
+# Number of ListRecords pages fetched in the background while the current page is processed
+DEFAULT_OAI_PREFETCH = 2
+# Number of record batches per source set that may be queued for/processed by the record
+# workers before we stop fetching more records
+DEFAULT_MAX_BATCHES_IN_FLIGHT = 8
+# Number of processes converting/validating/auditing records, shared by all sources
+DEFAULT_RECORD_WORKERS = psutil.cpu_count(logical=True)
+# Number of requests made at the same time to each of the servers DOIs and ISSNs are verified with,
+# by all record workers together (each has REMOTE_VERIFICATION_WORKERS threads verifying them)
+DEFAULT_REMOTE_REQUESTS_PER_HOST = 8
+# The records are stored by one writer process, in transactions of this many records (or fewer,
+# if no more records have arrived within STORAGE_WRITE_INTERVAL seconds)
+DEFAULT_STORAGE_BATCH_SIZE = 1000
+STORAGE_WRITE_INTERVAL = 0.5
+# With --shard-dir, the records of each source are stored in a database (shard) of their own, and
+# the shards are written by this many writer processes, each taking a share of the sources
+DEFAULT_SHARD_WRITERS = 4
 
 
 # Wrap the harvest function just to easily log errors from subprocesses
@@ -132,10 +186,29 @@ def harvest(source):
 
     start_time = time.time()
     harvest_id = str(uuid.uuid4())
-    harvest_cache["meta"][harvest_id] = [0, 0, 0]  # for keeping track of records accepted/rejected/deleted
+    harvest_cache["meta"][harvest_id] = [0, 0, 0, 0]  # for keeping track of records accepted/rejected/deleted/unchanged
     harvest_succeeded = True
-
+    harvest_start = datetime.now(timezone.utc)
+    # A replayed harvest (--replay) gets its records from an archive of an earlier harvest instead of
+    # from the server, and is recorded as that harvest.
+    replay = source.get("replay")
+    if replay:
+        harvest_start = replay.harvest_start
+        fromtime = replay.harvest_from
+
+    # While a source is harvested we keep, for each set, a checkpoint: the resumptionToken of the
+    # first page whose records haven't all been stored yet. With --resume, a harvest that was
+    # interrupted continues from there. It's still recorded as starting when the interrupted
+    # harvest did, so that records changed in the meantime are picked up by the next update.
+    checkpoints = {}
     with get_connection() as con:
+        if getenv("SWEPUB_RESUME"):
+            checkpoints = get_harvest_checkpoints(source["code"], con)
+        if checkpoints:
+            interrupted = next(iter(checkpoints.values()))[0]
+            harvest_start = interrupted["harvest_start"]
+            fromtime = interrupted["harvest_from"]
+            log.info(f'Resuming harvest of {source["code"]} started {harvest_start}')
         cur = con.cursor()
         lock.acquire()
         try:
@@ -143,117 +216,132 @@ def harvest(source):
                 "INSERT INTO harvest_history(id, source, harvest_start) VALUES (?, ?, ?)",
                 (harvest_id, source["code"], datetime.now(timezone.utc).isoformat()),
             )
+            if not checkpoints:
+                # Checkpoints from an earlier interrupted harvest are superseded by this one
+                delete_harvest_checkpoints(source["code"], con)
             con.commit()
         finally:
             lock.release()
 
-    harvest_start = datetime.now(timezone.utc)
+    # With --archive-dir, the raw pages of the harvest are archived so that it can be replayed
+    archive = None
+    if getenv("SWEPUB_OAI_ARCHIVE_DIR") and not replay:
+        archive_path = path.join(
+            getenv("SWEPUB_OAI_ARCHIVE_DIR"),
+            f'{source["code"]}-{datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")}-{harvest_id[:8]}{ARCHIVE_SUFFIX}',
+        )
+        archive = OAIArchiveWriter(archive_path, source["code"], harvest_start, fromtime)
+        log.info(f'Archiving OAI-PMH responses from {source["code"]} to {archive_path}')
+
     record_count = 0
     num_deleted_without_persistent = 0
     num_failed = 0
 
     for source_set in source["sets"]:
-        if environ.get("SWEPUB_LOCAL_SERVER"):
+        if environ.get("SWEPUB_LOCAL_SERVER") and not replay:
             if "diva" in source_set["url"]:
                 source_set["url"] = f"{environ.get('SWEPUB_LOCAL_SERVER')}/diva/{source['code']}"
             else:
                 source_set["url"] = f"{environ.get('SWEPUB_LOCAL_SERVER')}/foo/{source['code']}"
-        record_iterator = RecordIterator(source["code"], source_set, fromtime, None, SWEPUB_USER_AGENT)
-        # For each set we put records into batches and let a number of workers handle these batches.
+        set_checkpoints = {
+            checkpoint["window_from"]: checkpoint for checkpoint in checkpoints.get(source_set.get("subset", ""), [])
+        }
+        # A full harvest of a set can be split into datestamp windows that are harvested at the same
+        # time, each window being a resumptionToken chain of its own. A resumed harvest keeps the
+        # windows of the interrupted one, and a replayed harvest the windows that were archived.
+        if replay:
+            windows = replay.windows(source_set)
+        elif set_checkpoints:
+            windows = [(checkpoint["window_from"], checkpoint["window_until"]) for checkpoint in set_checkpoints.values()]
+        elif not fromtime and int(getenv("SWEPUB_DATE_WINDOWS", 1)) > 1:
+            windows = _get_date_windows(source_set, int(getenv("SWEPUB_DATE_WINDOWS")))
+        else:
+            windows = [(None, None)]
+
+        pending_windows = []
+        for window in windows:
+            checkpoint = set_checkpoints.get(window[0])
+            if checkpoint and checkpoint["completed"]:
+                log.info(f"{_set_label(source, source_set, window)}: harvested before the interruption, skipping")
+                continue
+            if not checkpoint:
+                _save_checkpoint(source, source_set, window, harvest_start, fromtime, None, None)
+            pending_windows.append((window, checkpoint))
+        if not pending_windows:
+            continue
+
         try:
-            with ProcessPoolExecutor(
-                max_workers=4,
-                initializer=init,
-                initargs=(
-                    lock,
-                    harvest_cache,
-                    added_converted_rowids,
-                    log,
-                    incremental,
-                ),
-            ) as executor:
-                # fromtime = "2020-05-05T00:00:00Z"  # Only while debugging, use to force FROM date to get some incremental test data.
-                batch = []
-                try:
-                    for record in record_iterator:
-                        if record.is_successful():
-                            batch.append(record)
-                            if len(batch) >= 128:
-                                # Partial to add additional arguments to threaded_handle_harvested.
-                                # Note: `batch` will appear as the _last_ argument.
-                                func = partial(
-                                    threaded_handle_harvested,
-                                    source["code"],
-                                    source_set.get("subset", ""),
-                                    harvest_id,
-                                    cached_paths,
-                                )
-                                executor.submit(func, batch)
-                                batch = []
-                            record_count += 1
-                        else:
-                            num_failed += 1
-                except Exception as e:
-                    num_failed += 1
-                    raise e
-                func = partial(
-                    threaded_handle_harvested, source["code"], source_set.get("subset", ""), harvest_id, cached_paths
-                )
-                executor.submit(func, batch)
-                executor.shutdown(wait=True)
+            if len(pending_windows) == 1:
+                window_counts = [
+                    _harvest_window(
+                        source, source_set, harvest_id, harvest_start, fromtime, *pending_windows[0], archive, replay
+                    )
+                ]
+            else:
+                # The windows' records all go to the record workers; fetching them is what we do in parallel,
+                # as far as the host scheduler allows.
+                log.info(f'{source["code"]} {source_set.get("subset", "")}: harvesting {len(pending_windows)} date windows')
+                with ThreadPoolExecutor(max_workers=len(pending_windows)) as executor:
+                    futures = [
+                        executor.submit(
+                            _harvest_window,
+                            source,
+                            source_set,
+                            harvest_id,
+                            harvest_start,
+                            fromtime,
+                            window,
+                            checkpoint,
+                            archive,
+                            replay,
+                        )
+                        for window, checkpoint in pending_windows
+                    ]
+                window_counts = [future.result() for future in futures]
+            for window_record_count, window_num_failed in window_counts:
+                record_count += window_record_count
+                num_failed += window_num_failed
 
             # If we're doing incremental updating: Check if the source uses <deletedRecord>persistent</deletedRecord>.
             # If it does not, we need to "ListIdentifiers" all of their records to figure out if any were deleted.
-            if incremental and fromtime and not _get_has_persistent_deletes(source_set):
-                all_source_ids = _get_source_ids(source_set)
-                obsolete_ids = []
+            # (Only ListRecords responses are archived, so a replayed harvest can't do this.)
+            if incremental and fromtime and not replay and not _get_has_persistent_deletes(source_set):
                 with get_connection() as con:
-                    cur = con.cursor()
-                    for original_id_row in cur.execute(
-                        "SELECT oai_id FROM original WHERE source = ?", (source["code"],)
-                    ):
-                        existing_oai_id = original_id_row[0]
-                        if existing_oai_id not in all_source_ids:
-                            obsolete_ids.append(existing_oai_id)
-                    if obsolete_ids:
-                        lock.acquire()
-                        # We can't do `WHERE oai_id IN ({','.join('?'*len(obsolete_ids))})` because len(obsolete_ids)
-                        # could be > SQLITE_MAX_VARIABLE_NUMBER ("defaults to 999 for SQLite versions prior to 3.32.0
-                        # (2020-05-22) or 32766 for SQLite versions after 3.32.0."). So, we do it by chunks.
-                        try:
-                            for group in chunker(obsolete_ids, 100):
-                                # Keep track of number of actually deleted records for stat purposes
-                                num_deleted_without_persistent += cur.execute(
-                                    f"""
-                                SELECT COUNT(*) AS total FROM original
-                                WHERE oai_id IN ({','.join('?'*len(group))})
-                                """,
-                                    group,
-                                ).fetchone()[0]
-
-                                cur.execute(
-                                    f"""
-                                DELETE FROM
-                                    original
-                                WHERE oai_id IN ({','.join('?'*len(group))});
-                                """,
-                                    group,
-                                )
-                            log.info(
-                                f"Deleted {len(obsolete_ids)} obsolete records from {source['code']}, after checking their ID list."
-                            )
-                            con.commit()
-                        finally:
-                            lock.release()
+                    # The ID list is streamed into a temporary table first, which doesn't lock the
+                    # database; only the delete itself (one statement, one transaction) needs the lock.
+                    load_harvested_ids(_get_source_ids(source_set), con)
+                    lock.acquire()
+                    try:
+                        num_deleted_obsolete = delete_records_not_harvested(source["code"], con)
+                        con.commit()
+                    finally:
+                        lock.release()
+                    drop_harvested_ids(con)
+                # Keep track of number of actually deleted records for stat purposes
+                num_deleted_without_persistent += num_deleted_obsolete
+                if num_deleted_obsolete:
+                    log.info(
+                        f"Deleted {num_deleted_obsolete} obsolete records from {source['code']}, after checking their ID list."
+                    )
+
+            # A resumed harvest skips the set
+            for window, _ in pending_windows:
+                _save_checkpoint(source, source_set, window, harvest_start, fromtime, None, None, completed=True)
         except Exception as e:
+            num_failed += 1
             log.warning(f'[FAILED]\t{source["code"]}. Error: {e}')
             log.warning(traceback.format_exc())
             harvest_cache["meta"]["sources_in_progress"].remove(source["code"])
             harvest_cache["meta"]["sources_failed"].append(source["code"])
             harvest_succeeded = False
 
-    num_accepted, num_rejected, num_deleted = harvest_cache["meta"][harvest_id]
+    if archive:
+        archive.close()
+
+    num_accepted, num_rejected, num_deleted, num_unchanged = harvest_cache["meta"][harvest_id]
     num_deleted += num_deleted_without_persistent
+    if num_unchanged:
+        log.info(f'{source["code"]}: {num_unchanged} records were unchanged since they were last harvested, skipped them')
     with get_connection() as con:
         cur = con.cursor()
         lock.acquire()
@@ -265,6 +353,7 @@ def harvest(source):
                 ON CONFLICT(source) DO UPDATE SET last_successful_harvest = ?;""",
                     (source["code"], harvest_start, harvest_start),
                 )
+                delete_harvest_checkpoints(source["code"], con)
 
             cur.execute(
                 """
@@ -301,42 +390,324 @@ def harvest(source):
     return harvest_succeeded
 
 
-def threaded_handle_harvested(source, source_subset, harvest_id, cached_paths, batch):
-    converted_rowids = []
+# Harvest one datestamp window of a set (or the whole set, if it isn't split), resuming from
+# `checkpoint` if there is one. The pages are archived to `archive` (an OAIArchiveWriter), if given,
+# or taken from `replay` (an OAIArchiveReader) instead of the server.
+# Returns the number of records harvested and the number of failed ones.
+def _harvest_window(source, source_set, harvest_id, harvest_start, fromtime, window, checkpoint, archive=None, replay=None):
+    window_from, window_until = window
+    label = _set_label(source, source_set, window)
+    record_count = 0
+    num_failed = 0
+    resumption_token = checkpoint["resumption_token"] if checkpoint else None
+    # The latest datestamp stored is only a safe place to continue from if the records come in
+    # datestamp order; otherwise the whole window is harvested again if the token has expired.
+    last_datestamp = checkpoint["datestamp"] if checkpoint else None
+    in_datestamp_order = not resumption_token or last_datestamp is not None
+    record_iterator = RecordIterator(
+        source["code"],
+        source_set,
+        window_from or fromtime,
+        window_until,
+        SWEPUB_USER_AGENT,
+        prefetch=int(getenv("SWEPUB_OAI_PREFETCH", DEFAULT_OAI_PREFETCH)),
+        stream=bool(getenv("SWEPUB_OAI_STREAM")),
+        scheduler=harvest_cache["host_scheduler"],
+        resumption_token=resumption_token,
+        fallback_from=last_datestamp or window_from or fromtime,
+        archive=archive.chain(source_set, window) if archive else None,
+        replay=replay.pages(source_set, window) if replay else None,
+    )
+    if resumption_token:
+        log.info(f"{label}: resuming from resumptionToken {resumption_token}")
+    # We put records into batches and hand them over to the shared record workers.
+    # Once this many batches are waiting for/being handled by the workers, put() blocks and
+    # we stop fetching records until one of them is done, to keep memory use in check.
+    producer = BatchProducer(
+        harvest_cache["batch_queue"],
+        harvest_cache["batch_payloads"],
+        f'{harvest_id}:{source_set.get("subset", "")}:{window_from or ""}',
+        int(getenv("SWEPUB_MAX_BATCHES_IN_FLIGHT", DEFAULT_MAX_BATCHES_IN_FLIGHT)),
+    )
+    # fromtime = "2020-05-05T00:00:00Z"  # Only while debugging, use to force FROM date to get some incremental test data.
+    batch = []
+    page_token = resumption_token
+    try:
+        for record in record_iterator:
+            if record.is_successful():
+                batch.append(record)
+                page_token = record.page_token
+                if in_datestamp_order and record.datestamp:
+                    if last_datestamp and record.datestamp < last_datestamp:
+                        in_datestamp_order = False
+                        last_datestamp = None
+                    else:
+                        last_datestamp = record.datestamp
+                if len(batch) >= 128:
+                    producer.put(
+                        (source["code"], source_set.get("subset", ""), harvest_id, batch),
+                        checkpoint=(record.page_token, last_datestamp),
+                    )
+                    batch = []
+                    reached = producer.completed_checkpoint()
+                    if reached:
+                        _save_checkpoint(source, source_set, window, harvest_start, fromtime, *reached)
+                record_count += 1
+            else:
+                num_failed += 1
+        if record_iterator.token_expired:
+            log.info(f"{label}: resumptionToken expired, harvested from {record_iterator.harvest_from} instead")
+        producer.put((source["code"], source_set.get("subset", ""), harvest_id, batch))
+    finally:
+        record_iterator.close()
+        # Wait for the workers to finish this window's batches
+        producer.join()
+        # Mostly full => processing is the bottleneck; mostly empty => fetching is
+        log.info(f"{label}: {producer.summary()}")
+    # Everything is stored; if the rest of the harvest is interrupted, only the last page is fetched again
+    _save_checkpoint(source, source_set, window, harvest_start, fromtime, page_token, last_datestamp)
+    return record_count, num_failed
+
+
+def _get_date_windows(source_set, count):
+    sickle_client = sickle.Sickle(
+        source_set["url"],
+        max_retries=8,
+        timeout=90,
+        headers={"User-Agent": SWEPUB_USER_AGENT},
+        scheduler=harvest_cache["host_scheduler"],
+    )
+    try:
+        earliest = date.fromisoformat(sickle_client.Identify().earliestDatestamp[:10])
+    except Exception as e:
+        log.warning(f'Could not get earliest datestamp for {source_set["url"]}, not splitting into date windows: {e}')
+        return [(None, None)]
+    return date_windows(earliest, date.today(), count)
+
+
+def _set_label(source, source_set, window):
+    label = f'{source["code"]} {source_set.get("subset", "")}'
+    if window != (None, None):
+        label += f' [{window[0] or ""}..{window[1] or ""}]'
+    return label
+
+
+def _save_checkpoint(source, source_set, window, harvest_start, harvest_from, resumption_token, datestamp, completed=False):
+    with get_connection() as con:
+        lock.acquire()
+        try:
+            save_harvest_checkpoint(
+                source["code"],
+                source_set.get("subset", ""),
+                window[0],
+                window[1],
+                harvest_start,
+                harvest_from,
+                resumption_token,
+                datestamp,
+                completed,
+                con,
+            )
+        finally:
+            lock.release()
+
+
+# Runs in each of the shared record workers, handling batches from all sources until the queue is closed.
+# The handled records go to the storage writer, which marks the batch as done once they're stored.
+def record_worker():
+    batch_queue = harvest_cache["batch_queue"]
+    batch_payloads = harvest_cache["batch_payloads"]
+    while True:
+        item = batch_payloads.get()
+        if item is None:
+            return
+        key, seq, (source, source_subset, harvest_id, batch) = item
+        batch_queue.started(key)
+        try:
+            handled = handle_harvested(source, batch)
+            _flush_learned()
+        except Exception:
+            # Without the batch, the source fails rather than going on as if it had been stored
+            log.warning(traceback.format_exc())
+            batch_queue.lose(key, seq, f"a batch of records from {source} could not be handled")
+            continue
+        _storage_queue_for(source).put((key, seq, source, source_subset, harvest_id, handled))
+
+
+# What the validators and enrichers learn (see pipeline.learnedstore) is kept in this process's own
+# harvest_cache until it's handed over to the LearnedStore, for each batch (or source, when reprocessing)
+def _flush_learned():
+    learned = take_learned(harvest_cache)
+    if learned:
+        harvest_cache["learned"].merge(learned)
+
+
+# Called in the main process when a record worker is done. It should only be done once the sources are,
+# so if it failed (typically because a worker process died, which breaks the whole pool), the batches
+# in flight will never be handled, and the sources waiting for them fail instead of waiting forever.
+def _record_worker_done(future):
+    if future.cancelled() or future.exception() is None:
+        return
+    log.error(f"Record worker failed, failing the sources being harvested: {future.exception()!r}")
+    harvest_cache["batch_queue"].fail(f"record worker failed: {future.exception()!r}")
+
+
+# With shards there is one storage queue per writer, and all records of a source go to the same writer
+def _storage_queue_for(source):
+    if isinstance(storage_queue, list):
+        return storage_queue[zlib.crc32(source.encode("utf-8")) % len(storage_queue)]
+    return storage_queue
+
+
+# Convert, validate and audit a batch of records. Returns what's to be stored for each record, as
+# (record, accepted, min_level_errors, converted, content_hash), where converted is None for records
+# that aren't accepted, together with the number of accepted, rejected and unchanged records.
+def handle_harvested(source, batch):
+    handled = []
     num_accepted = 0
     num_rejected = 0
-    num_deleted = 0
+    num_unchanged = 0
 
     with requests.Session() as session:
-        adapter = requests.adapters.HTTPAdapter(max_retries=RandomisedRetry(total=4, backoff_factor=2))
+        # (Retrying, after a while, when asked to slow down)
+        adapter = HostLimitedAdapter(
+            harvest_cache["remote_slots"],
+            max_retries=RandomisedRetry(total=4, backoff_factor=2, status_forcelist=[429]),
+            pool_maxsize=REMOTE_VERIFICATION_WORKERS,
+        )
         session.mount('http://', adapter)
         session.mount('https://', adapter)
         with get_connection() as read_only_connection:
             read_only_cursor = read_only_connection.cursor()
+            # Sources often send records again that haven't changed. Those we already have as they are,
+            # so there's nothing to do for them.
+            stored_hashes = {}
+            if incremental:
+                stored_hashes = get_content_hashes(
+                    (record.oai_id for record in batch if not record.deleted), source, read_only_cursor
+                )
+            to_validate = []
             for record in batch:
-                xml = record.xml
-                rejected, min_level_errors = should_be_rejected(xml)
-                accepted = not rejected
-
+                # (A record that can't even be parsed only fails itself)
                 try:
+                    content_hash = None
+                    if not record.deleted:
+                        content_hash = record.content_hash
+                        if stored_hashes.get(record.oai_id) == content_hash:
+                            num_unchanged += 1
+                            continue
+                    rejected, min_level_errors = should_be_rejected(record.tree)
+                    accepted = not rejected
+                    converted = None
+
                     if accepted:
                         num_accepted += 1
-                        converted = convert(xml)
-                        (field_events, record_info) = validate(converted, harvest_cache, session, source, cached_paths, read_only_cursor)
-                        (audited, audit_events) = audit(converted, harvest_cache, session)
+                        converted = convert(record.tree)
                     elif not record.deleted:
                         num_rejected += 1
                 except Exception:
                     log.warning(traceback.format_exc())
                     continue
 
-                lock.acquire()
+                to_validate.append((record, accepted, min_level_errors, converted, content_hash))
+
+            # The DOIs and ISSNs of the whole batch are verified together, before validating the records
+            verified = {}
+            try:
+                verified = verify_remotely(
+                    (converted for _, accepted, _, converted, _ in to_validate if accepted), session, harvest_cache
+                )
+            except Exception:
+                log.warning(traceback.format_exc())
+
+            for record, accepted, min_level_errors, converted, content_hash in to_validate:
                 try:
-                    with get_connection() as connection:
+                    if accepted:
+                        (field_events, record_info) = validate(converted, harvest_cache, session, source, read_only_cursor, verified)
+                        (audited, audit_events) = audit(converted, harvest_cache, session)
+                        converted = (audited.body, audit_events.data, field_events, record_info)
+                except Exception:
+                    log.warning(traceback.format_exc())
+                    continue
+
+                handled.append((record, accepted, min_level_errors, converted, content_hash))
+
+    # What was verified remotely is written to the ID cache for each batch
+    get_id_cache().flush()
+    return handled, num_accepted, num_rejected, num_unchanged
+
+
+# Runs in its own process, storing the records handled by the record workers. Records are written in
+# large transactions, so that the workers never wait for the database (or each other), and the
+# database isn't committed to (and the lock handed over) for every single record.
+# With a shard_dir, the records are stored in the new shards of their sources instead (see
+# storage.init_new_shard), which no one else uses, so they don't need the (database) lock.
+def storage_writer(batch_size, shard_dir=None):
+    pending = []
+    num_pending_records = 0
+    deadline = None
+    stopped = False
+    # Its own connection(s), for its long transactions
+    connection = None if shard_dir else connect()
+    shard_connections = {}
+    shard_lock = ThreadLock()
+    while not stopped:
+        try:
+            item = storage_queue.get(timeout=max(deadline - time.monotonic(), 0) if pending else None)
+            if item is None:
+                stopped = True
+            else:
+                if not pending:
+                    deadline = time.monotonic() + STORAGE_WRITE_INTERVAL
+                pending.append(item)
+                num_pending_records += len(item[-1][0])
+        except Empty:
+            pass
+        if pending and (stopped or num_pending_records >= batch_size or time.monotonic() >= deadline):
+            if shard_dir:
+                by_source = {}
+                for item in pending:
+                    by_source.setdefault(item[2], []).append(item)
+                for source, source_pending in by_source.items():
+                    if source not in shard_connections:
+                        shard_connections[source] = connect_new_shard(shard_dir, source)
+                    _store_handled(source_pending, shard_connections[source], shard_lock)
+            else:
+                _store_handled(pending, connection)
+            pending = []
+            num_pending_records = 0
+    for shard_connection in shard_connections.values():
+        shard_connection.close()
+    if connection:
+        connection.close()
+
+
+def _store_handled(pending, connection, connection_lock=None):
+    connection_lock = connection_lock or lock
+    counts = {}
+    converted_rowids = []
+    # The detail rows of all records in the transaction are inserted together, at the end
+    detail_rows = ConvertedDetailRows()
+    cursor = connection.cursor()
+    try:
+        connection_lock.acquire()
+        try:
+            # Explicitly, as releasing the outermost savepoint would otherwise commit
+            cursor.execute("BEGIN")
+            prepare_compression(connection)
+            for _, _, source, source_subset, harvest_id, (handled, num_accepted, num_rejected, num_unchanged) in pending:
+                num_deleted = 0
+                for record, accepted, min_level_errors, converted, content_hash in handled:
+                    # Storing a record again replaces its details
+                    if record.oai_id in detail_rows.oai_ids:
+                        detail_rows.write(connection)
+                    # A record that can't be stored shouldn't take the rest of the transaction with it
+                    cursor.execute("SAVEPOINT record")
+                    try:
                         original_rowid, deleted_from_db = store_original(
                             record.oai_id,
                             record.deleted,
-                            xml,
+                            record.xml,
                             source,
                             source_subset,
                             accepted,
@@ -344,38 +715,86 @@ def threaded_handle_harvested(source, source_subset, harvest_id, cached_paths, b
                             incremental,
                             min_level_errors,
                             harvest_id,
+                            commit=False,
+                            content_hash=content_hash,
                         )
                         if deleted_from_db:
                             num_deleted += 1
                         if accepted and original_rowid:
-                            converted_rowid = store_converted(
-                                original_rowid,
-                                audited.body,
-                                audit_events.data,
-                                field_events,
-                                record_info,
-                                connection,
+                            converted_rowids.append(
+                                store_converted(
+                                    original_rowid, *converted, connection, commit=False, detail_rows=detail_rows
+                                )
                             )
-                            converted_rowids.append(converted_rowid)
-                except Exception:
-                    log.warning(traceback.format_exc())
-                finally:
-                    lock.release()
-
-    if incremental:
-        for rowid in converted_rowids:
-            added_converted_rowids[rowid] = None
+                    except Exception:
+                        log.warning(traceback.format_exc())
+                        cursor.execute("ROLLBACK TO record")
+                    cursor.execute("RELEASE record")
+                harvest_counts = counts.setdefault(harvest_id, [0, 0, 0, 0])
+                harvest_counts[0] += num_accepted
+                harvest_counts[1] += num_rejected
+                harvest_counts[2] += num_deleted
+                harvest_counts[3] += num_unchanged
+            detail_rows.write(connection)
+            connection.commit()
+        finally:
+            connection_lock.release()
+    except Exception:
+        log.warning(traceback.format_exc())
+        # None of the batches were stored, so their sources fail rather than going on as if they were
+        # (and checkpointing past them, see pipeline.batchqueue)
+        for key, seq, *_ in pending:
+            harvest_cache["batch_queue"].lose(key, seq, "a batch of records could not be stored")
+        connection.rollback()
+        reset_compression()
+        return
 
-    harvest_cache["meta"][harvest_id] = [
-        harvest_cache["meta"][harvest_id][0] + num_accepted,
-        harvest_cache["meta"][harvest_id][1] + num_rejected,
-        harvest_cache["meta"][harvest_id][2] + num_deleted,
-    ]
+    try:
+        if incremental and converted_rowids:
+            added_converted_rowids.update(dict.fromkeys(converted_rowids))
+        # This is the only process updating the counts (of these sources' harvests), so there's no race
+        # between reading and writing them
+        for harvest_id, harvest_counts in counts.items():
+            harvest_cache["meta"][harvest_id] = [
+                total + count for total, count in zip(harvest_cache["meta"][harvest_id], harvest_counts)
+            ]
+    except Exception:
+        log.warning(traceback.format_exc())
+    finally:
+        # The batches are stored, and their checkpoints may now be saved (see pipeline.batchqueue)
+        for key, seq, *_ in pending:
+            harvest_cache["batch_queue"].done(key, seq)
+
+
+def _run_storage_writer(initargs, batch_size, shard_dir=None):
+    init(*initargs)
+    storage_writer(batch_size, shard_dir)
+
+
+# The new shards of the sources replace their old ones; except when a source failed, in which case
+# its old shard (if there is one) is kept, rather than replaced by a partial one
+# Returns the codes of the sources whose shards were replaced
+def _replace_shards(shard_dir, codes, sources_succeeded):
+    replaced = []
+    for code in codes:
+        if code not in sources_succeeded and path.exists(get_shard_path(shard_dir, code)):
+            log.warning(f"Harvesting {code} failed, keeping its previous shard")
+            discard_new_shard(shard_dir, code)
+        else:
+            replace_shard(shard_dir, code)
+            replaced.append(code)
+    return replaced
 
 
+# Yields the OAI IDs of all records in the set, as they are listed
 def _get_source_ids(source_set):
-    source_ids = set()
-    sickle_client = sickle.Sickle(source_set["url"], max_retries=8, timeout=90, headers={"User-Agent": SWEPUB_USER_AGENT})
+    sickle_client = sickle.Sickle(
+        source_set["url"],
+        max_retries=8,
+        timeout=90,
+        headers={"User-Agent": SWEPUB_USER_AGENT},
+        scheduler=harvest_cache["host_scheduler"],
+    )
     list_ids_params = {
         "metadataPrefix": source_set["metadata_prefix"],
         "ignore_deleted": False,
@@ -384,12 +803,17 @@ def _get_source_ids(source_set):
         list_ids_params["set"] = source_set["subset"]
     headers = sickle_client.ListIdentifiers(**list_ids_params)
     for header in headers:
-        source_ids.add(header.identifier)
-    return source_ids
+        yield header.identifier
 
 
 def _get_has_persistent_deletes(source_set):
-    sickle_client = sickle.Sickle(source_set["url"], max_retries=8, timeout=90, headers={"User-Agent": SWEPUB_USER_AGENT})
+    sickle_client = sickle.Sickle(
+        source_set["url"],
+        max_retries=8,
+        timeout=90,
+        headers={"User-Agent": SWEPUB_USER_AGENT},
+        scheduler=harvest_cache["host_scheduler"],
+    )
     identify = sickle_client.Identify()
     return identify.deletedRecord == "persistent" or identify.deletedRecord == "transient"
 
@@ -429,76 +853,52 @@ def _load_doab():
     return doab_data
 
 
-def _get_harvest_cache_manager(manager):
+def _get_harvest_cache(manager):
     # We check if ISSN and DOI numbers really exist through HTTP requests to external servers,
-    # so we cache the results to avoid unnecessary requests. Such requests were previously
-    # cached in Redis. We don't care about the whole response, just whether the ISSN/DOI
-    # was found or not, so all we need to store is the ISSN/DOI itself.
-    # (This can't be a set because that's not supported by multiprocessing.Manager, and anyway
-    # both set and dict lookups are O(1).)
-    # After harvesting we save the cache to disk so that we can use it again next time, greatly
-    # improving harvesting speed. This is all optional: harvesting will work fine even if the
-    # cache file is missing/corrupt/whatever.
-    previously_validated_ids = {"doi": {}, "issn": {}}
+    # and keep the outcomes in a cache of their own (see pipeline.idcache), which the workers read
+    # directly. Before it, the IDs found were kept in the JSON file ID_CACHE_FILE, which it's
+    # populated from the first time.
+    # This is all optional: harvesting will work fine even if the cache is missing/corrupt/whatever.
     try:
-        with open(ID_CACHE_FILE, "rb") as f:
-            previously_validated_ids = json.loads(f.read())
-        log.info(
-            f"Cache populated with {len(previously_validated_ids['doi'])+len(previously_validated_ids['issn'])} previously validated IDs from {ID_CACHE_FILE}"
-        )
-    except FileNotFoundError:
-        log.warning("ID cache file not found, starting fresh")
+        prepare_id_cache(ID_CACHE_FILE)
     except Exception as e:
-        log.warning(f"Failed loading ID cache file, starting fresh (error: {e})")
+        log.warning(f"Failed preparing ID cache: {e}")
 
-    # If we have files with known ISSN/DOI numbers, use them to populate the cache
-    known_issn = {}
-    known_doi = {}
+    # If we have files with known ISSN/DOI numbers, they're used before asking the ID cache
+    known_issn = set()
+    known_doi = set()
     try:
         with open(KNOWN_ISSN_FILE, "r") as issn, open(KNOWN_DOI_FILE, "r") as doi:
-            issn_count = 0
-            doi_count = 0
             for line in issn:
-                known_issn[line.strip()] = 1
-                issn_count += 1
+                known_issn.add(line.strip())
             for line in doi:
-                known_doi[line.strip()] = 1
-                doi_count += 1
+                known_doi.add(line.strip())
             log.info(
-                f"Cache populated with {issn_count} ISSNs from {KNOWN_ISSN_FILE}, {doi_count} DOIs from {KNOWN_DOI_FILE}"
+                f"Cache populated with {len(known_issn)} ISSNs from {KNOWN_ISSN_FILE}, {len(known_doi)} DOIs from {KNOWN_DOI_FILE}"
             )
     except Exception as e:
         log.warning(f"Failed loading ISSN/DOI files: {e}")
 
-    # Stuff seen during requests to external sources should be saved for future use,
-    # but we don't want to waste time saving ISSN/DOIs already known from the 'static' files,
-    # hence separating "stuff learned during harvest" from "stuff learned from static files".
-    doi_not_in_static = set(previously_validated_ids["doi"].keys()) - set(known_doi.keys())
-    issn_not_in_static = set(previously_validated_ids["issn"].keys()) - set(known_issn.keys())
-
-    doi_new = manager.dict(dict.fromkeys(doi_not_in_static, 1))
-    doi_static = manager.dict(known_doi)
-    issn_new = manager.dict(dict.fromkeys(issn_not_in_static, 1))
-    issn_static = manager.dict(known_issn)
-    harvest_meta = manager.dict({})
-    doab = manager.dict(_load_doab())
-    localid_to_orcid = manager.dict({})
-    localid_without_orcid = manager.dict({})
-    enriched_from_other_record = manager.dict({})
-
-    return manager.dict(
-        {
-            "doi_new": doi_new,
-            "doi_static": doi_static,
-            "issn_new": issn_new,
-            "issn_static": issn_static,
-            "meta": harvest_meta,
-            "doab": doab,
-            "localid_to_orcid": localid_to_orcid,
-            "localid_without_orcid": localid_without_orcid,
-            "enriched_from_other_record": enriched_from_other_record,
-        }
-    )
+    # harvest_cache itself is a plain dict, which the harvest processes inherit (being forked after
+    # it's been made), so that what's used for every record doesn't go through the Manager:
+    # - the static data (known ISSNs/DOIs, DOAB) is only read, so it's shared with the parent
+    #   (copy-on-write) rather than copied
+    # - what's learned is kept in each process's own dicts, and handed over to the LearnedStore in
+    #   the Manager now and then (see _flush_learned)
+    # Only what's shared between processes, and used once per batch or source at most, is managed.
+    return {
+        "doi_static": frozenset(known_doi),
+        "issn_static": frozenset(known_issn),
+        "meta": manager.dict({}),
+        "doab": _load_doab(),
+        "learned": manager.LearnedStore(),
+        **new_learned(),
+        # (Semaphores, shared by the processes as they're inherited, see util.HostLimitedAdapter)
+        "remote_slots": {
+            host: BoundedSemaphore(max(int(getenv("SWEPUB_REMOTE_REQUESTS_PER_HOST", DEFAULT_REMOTE_REQUESTS_PER_HOST)), 1))
+            for host in REMOTE_VERIFICATION_HOSTS
+        },
+    }
 
 
 def _annif_health_check():
@@ -528,14 +928,14 @@ def _calculate_oai_ids_to_reprocess():
         # At this point all records have been processed once. Now ensure that records where
         # we can add an ORCID are marked for reprocessing.
         # - localid_without_orcid is a dict where each key is a local ID, and the value is
-        #   a space-delimited list of OAI IDs where that local ID (but no ORCID) occurs.
+        #   a list of OAI IDs where that local ID (but no ORCID) occurs.
         # - localid_to_orcid is a dict where each key is a local ID and the value is a dict
         #   containing ORCID and "source OAI ID".
         # Comparing these two we'll know which OAI IDs can be enriched with ORCID.
         oai_ids_to_reprocess = set()
         for cache_key, oai_ids in harvest_cache["localid_without_orcid"].items():
             if cache_key in harvest_cache["localid_to_orcid"]:
-                oai_ids_to_reprocess.update(oai_ids.split())
+                oai_ids_to_reprocess.update(oai_ids)
         for oai_id in oai_ids_to_reprocess:
             cursor.execute("UPDATE converted SET should_be_reprocessed = 1 WHERE oai_id = ?", [oai_id])
         connection.commit()
@@ -564,7 +964,8 @@ def _reprocess_affected_records(sources_to_process):
         initializer=init,
         initargs=(
             lock,
-            harvest_cache,
+            # (Starting over with nothing learned, as everything learned so far is in the LearnedStore)
+            {**harvest_cache, **new_learned()},
             added_converted_rowids,
             log,
             incremental,
@@ -579,7 +980,7 @@ def _handle_reprocess_affected_records(source):
     with get_connection() as connection, requests.Session() as session:
         cursor = connection.cursor()
         inner_cursor = connection.cursor()
-        adapter = requests.adapters.HTTPAdapter(max_retries=2)
+        adapter = HostLimitedAdapter(harvest_cache["remote_slots"], max_retries=2)
         session.mount('http://', adapter)
         session.mount('https://', adapter)
 
@@ -590,15 +991,17 @@ def _handle_reprocess_affected_records(source):
         log.info(f"Reprocessing {len(oai_ids_to_reprocess)} records for {source['code']}")
         for oai_id in oai_ids_to_reprocess:
             try:
-                xml = cursor.execute("SELECT data FROM original WHERE oai_id = ?", [oai_id]).fetchone()["data"]
+                xml = cursor.execute("SELECT decompress(data) AS data FROM original WHERE oai_id = ?", [oai_id]).fetchone()["data"]
                 original_converted = cursor.execute("SELECT id, original_id, source FROM converted WHERE oai_id = ?", [oai_id]).fetchone()
                 converted = convert(xml)
-                (field_events, record_info) = validate(converted, harvest_cache, session, original_converted["source"], cached_paths, inner_cursor)
+                (field_events, record_info) = validate(converted, harvest_cache, session, original_converted["source"], inner_cursor)
                 (audited, audit_events) = audit(converted, harvest_cache, session)
 
                 lock.acquire()
                 try:
                     with get_connection() as inner_connection:
+                        prepare_compression(inner_connection)
+                        inner_connection.commit()
                         store_converted(original_converted["original_id"], audited.body, audit_events.data, field_events, record_info, inner_connection, clear_record_info=True, original_converted_id=original_converted["id"])
                 except Exception:
                         log.warning(traceback.format_exc())
@@ -607,20 +1010,28 @@ def _handle_reprocess_affected_records(source):
             except Exception:
                 log.warning(traceback.format_exc())
                 continue
+        get_id_cache().flush()
+        _flush_learned()
         log.info(f"Finished reprocessing records for {source['code']}")
 
 
-def init(l, c, a, lg, inc):
+def init(l, c, a, lg, inc, sq=None):
     global lock
     global harvest_cache
     global added_converted_rowids
     global log
     global incremental
+    global storage_queue
     lock = l
     harvest_cache = c
     added_converted_rowids = a
     log = lg
     incremental = inc
+    storage_queue = sq
+    # Batches put on the queue are all handled before a source is done, unless the record workers
+    # failed; then there's no one to read them, and the process shouldn't wait to flush them on exit
+    if c and c.get("batch_payloads"):
+        c["batch_payloads"].cancel_join_thread()
 
 
 def handle_args():
@@ -666,6 +1077,86 @@ def handle_args():
     parser.add_argument("--skip-unpaywall", action="store_true", help="Skip Unpaywall check")
     parser.add_argument("--skip-autoclassifier", action="store_true", help="Skip autoclassify step")
     parser.add_argument("-s", "--source-file", default=None, help="Source file to use.")
+    parser.add_argument(
+        "--oai-prefetch",
+        type=int,
+        default=None,
+        help=f"Number of OAI-PMH pages to fetch ahead while records are being processed (default {DEFAULT_OAI_PREFETCH}, 0 disables prefetching). Overrides SWEPUB_OAI_PREFETCH.",
+    )
+    parser.add_argument(
+        "--max-requests-per-host",
+        type=int,
+        default=None,
+        help=f"Upper limit for concurrent OAI-PMH requests to the same host; the actual limit adapts to how the server responds (default {DEFAULT_MAX_LIMIT}). Overrides SWEPUB_MAX_REQUESTS_PER_HOST.",
+    )
+    parser.add_argument(
+        "--max-batches-in-flight",
+        type=int,
+        default=None,
+        help=f"Number of record batches per source that may wait for processing before fetching pauses (default {DEFAULT_MAX_BATCHES_IN_FLIGHT}). Overrides SWEPUB_MAX_BATCHES_IN_FLIGHT.",
+    )
+    parser.add_argument(
+        "--record-workers",
+        type=int,
+        default=None,
+        help=f"Number of processes handling harvested records, shared by all sources (default {DEFAULT_RECORD_WORKERS}). Overrides SWEPUB_RECORD_WORKERS.",
+    )
+    parser.add_argument(
+        "--remote-requests-per-host",
+        type=int,
+        default=None,
+        help=f"Number of requests made at the same time to each of the servers DOIs and ISSNs are verified with, by all record workers together (default {DEFAULT_REMOTE_REQUESTS_PER_HOST}). Overrides SWEPUB_REMOTE_REQUESTS_PER_HOST.",
+    )
+    parser.add_argument(
+        "--storage-batch-size",
+        type=int,
+        default=None,
+        help=f"Number of harvested records stored per database transaction (default {DEFAULT_STORAGE_BATCH_SIZE}). Overrides SWEPUB_STORAGE_BATCH_SIZE.",
+    )
+    parser.add_argument(
+        "--oai-stream",
+        action="store_true",
+        help="Parse OAI-PMH responses incrementally while they are downloaded, keeping only the current record in memory",
+    )
+    parser.add_argument(
+        "--date-windows",
+        type=int,
+        default=None,
+        help="Split full harvests of each set into this many datestamp windows, harvested at the same time (default 1). Overrides SWEPUB_DATE_WINDOWS.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="With --update: continue interrupted harvests from their last checkpoint instead of starting them over",
+    )
+    parser.add_argument(
+        "--archive-dir",
+        default=None,
+        help=f"Write the raw OAI-PMH ListRecords responses of each harvested source to an archive (<source>-<time>-<harvest id>{ARCHIVE_SUFFIX}) in this directory. Overrides SWEPUB_OAI_ARCHIVE_DIR.",
+    )
+    parser.add_argument(
+        "--replay",
+        nargs="+",
+        default=None,
+        metavar="ARCHIVE",
+        help="Harvest the source(s) of the given archive(s) (see --archive-dir) from the archived responses instead of from the OAI-PMH servers",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Store original XML and converted/finalized JSON zstd compressed, with dictionaries trained on the first records stored. Overrides SWEPUB_COMPRESS.",
+    )
+    parser.add_argument(
+        "--shard-dir",
+        default=None,
+        help="Store each source's records in a database of its own (<source>.sqlite3) in this directory, which is then consolidated with the other sources' into the main database. Only for full harvests. Overrides SWEPUB_SHARD_DIR.",
+    )
+    parser.add_argument(
+        "--shard-writers",
+        type=int,
+        default=None,
+        help=f"With --shard-dir: number of processes storing records in the shards (default {DEFAULT_SHARD_WRITERS}). Overrides SWEPUB_SHARD_WRITERS.",
+    )
     parser.add_argument(
         "source",
         nargs="*",
@@ -726,6 +1217,59 @@ if __name__ == "__main__":
     if args.local_server:
         environ["SWEPUB_LOCAL_SERVER"] = args.local_server
 
+    if args.oai_prefetch is not None:
+        environ["SWEPUB_OAI_PREFETCH"] = str(args.oai_prefetch)
+
+    if args.oai_stream:
+        environ["SWEPUB_OAI_STREAM"] = "1"
+
+    if args.record_workers is not None:
+        environ["SWEPUB_RECORD_WORKERS"] = str(args.record_workers)
+
+    if args.storage_batch_size is not None:
+        environ["SWEPUB_STORAGE_BATCH_SIZE"] = str(args.storage_batch_size)
+
+    if args.max_batches_in_flight is not None:
+        environ["SWEPUB_MAX_BATCHES_IN_FLIGHT"] = str(args.max_batches_in_flight)
+
+    if args.remote_requests_per_host is not None:
+        environ["SWEPUB_REMOTE_REQUESTS_PER_HOST"] = str(args.remote_requests_per_host)
+
+    if args.max_requests_per_host is not None:
+        environ["SWEPUB_MAX_REQUESTS_PER_HOST"] = str(args.max_requests_per_host)
+
+    if args.date_windows is not None:
+        environ["SWEPUB_DATE_WINDOWS"] = str(args.date_windows)
+
+    if args.resume:
+        if not args.update:
+            log.error("--resume can only be used with --update")
+            sys.exit(1)
+        environ["SWEPUB_RESUME"] = "1"
+
+    if args.compress:
+        environ["SWEPUB_COMPRESS"] = "1"
+
+    if args.archive_dir:
+        environ["SWEPUB_OAI_ARCHIVE_DIR"] = args.archive_dir
+    if getenv("SWEPUB_OAI_ARCHIVE_DIR"):
+        Path(getenv("SWEPUB_OAI_ARCHIVE_DIR")).mkdir(parents=True, exist_ok=True)
+
+    if args.replay and (args.resume or args.purge or args.reset_harvest_time):
+        log.error("--replay can only be used with --force-new or --update")
+        sys.exit(1)
+
+    if args.shard_dir:
+        environ["SWEPUB_SHARD_DIR"] = args.shard_dir
+    if args.shard_writers is not None:
+        environ["SWEPUB_SHARD_WRITERS"] = str(args.shard_writers)
+    shard_dir = getenv("SWEPUB_SHARD_DIR")
+    if shard_dir:
+        if args.update or args.purge or args.reset_harvest_time:
+            log.error("--shard-dir can only be used with --force-new")
+            sys.exit(1)
+        Path(shard_dir).mkdir(parents=True, exist_ok=True)
+
     # Annif health check
     if getenv("SWEPUB_SKIP_AUTOCLASSIFIER"):
         log.warning("Autoclassifier manually disabled")
@@ -750,7 +1294,12 @@ if __name__ == "__main__":
             clean_and_init_storage()
 
     sources_to_process = []
-    if args.source:
+    if args.replay:
+        # The sets to harvest, and how, are what the archives recorded
+        for archive_path in args.replay:
+            replay = OAIArchiveReader(archive_path)
+            sources_to_process.append({"code": replay.source, "sets": replay.sets, "replay": replay})
+    elif args.source:
         for code in args.source:
             if code not in sources:
                 log.error(f"Source {code} does not exist in {environ['SWEPUB_SOURCE_FILE']}")
@@ -773,14 +1322,19 @@ if __name__ == "__main__":
 
     harvest_cache = None
     t1 = None
+    # The WAL is checkpointed in the background from when the database is ready until the end
+    wal_checkpointer = WalCheckpointer(get_sqlite_path())
     # If we're purging we skip the harvesting phase but do the rest.
     if args.purge:
         log.info("Purging " + " ".join([source["code"] for source in sources_to_process]))
+        wal_checkpointer.start()
         with get_connection() as connection:
             cursor = connection.cursor()
+            init_harvest_checkpoints(cursor)
             for source in sources_to_process:
                 cursor.execute("DELETE FROM original WHERE source = ?", [source["code"]])
                 cursor.execute("DELETE FROM last_harvest WHERE source = ?", [source["code"]])
+                cursor.execute("DELETE FROM harvest_checkpoint WHERE source = ?", [source["code"]])
             for table in TABLES_DELETED_ON_INCREMENTAL_OR_PURGE:
                 cursor.execute(f"DELETE FROM {table}")
     elif args.reset_harvest_time:
@@ -791,9 +1345,23 @@ if __name__ == "__main__":
                 cursor.execute("DELETE FROM last_harvest WHERE source = ?", [source["code"]])
         sys.exit(0)
     else:
-        # All harvest jobs have access to the same Manager-managed dictionaries
-        manager = Manager()
-        harvest_cache = _get_harvest_cache_manager(manager)
+        # All harvest jobs have access to the same Manager-managed objects (see _get_harvest_cache)
+        manager = HarvestManager()
+        manager.start()
+        harvest_cache = _get_harvest_cache(manager)
+        # Limits the number of concurrent OAI-PMH requests per host across all harvest processes
+        harvest_cache["host_scheduler"] = manager.HostScheduler(
+            max_limit=int(getenv("SWEPUB_MAX_REQUESTS_PER_HOST", DEFAULT_MAX_LIMIT))
+        )
+        # Record batches from all sources, waiting for the shared record workers: the batches go
+        # through a plain multiprocessing queue, while which source's turn it is, and which batches
+        # are done, is kept track of in the Manager (see pipeline.batchqueue)
+        record_workers = max(int(getenv("SWEPUB_RECORD_WORKERS", DEFAULT_RECORD_WORKERS)), 1)
+        harvest_cache["batch_queue"] = manager.BatchQueue(
+            int(getenv("SWEPUB_MAX_BATCHES_IN_FLIGHT", DEFAULT_MAX_BATCHES_IN_FLIGHT)), record_workers
+        )
+        harvest_cache["batch_payloads"] = Queue()
+        harvest_cache["batch_payloads"].cancel_join_thread()  # (see init)
         harvest_cache["meta"]["sources_to_go"] = manager.list(
             [source["code"] for source in sources_to_process]
         )
@@ -806,12 +1374,21 @@ if __name__ == "__main__":
 
         t0 = time.time()
         if incremental:
+            wal_checkpointer.start()
             with get_connection() as connection:
                 cursor = connection.cursor()
+                # Databases created before harvest checkpoints/content hashes/packed flags lack them
+                init_harvest_checkpoints(cursor)
+                init_content_hashes(cursor)
+                init_converted_flags(cursor)
+                # ...and one whose full harvest was interrupted may lack its indexes
+                create_deferred_indexes(connection)
                 for table in TABLES_DELETED_ON_INCREMENTAL_OR_PURGE:
                     cursor.execute(f"DELETE FROM {table}")
         else:
-            clean_and_init_storage()
+            # The indexes are created once everything has been harvested
+            clean_and_init_storage(defer_indexes=True)
+            wal_checkpointer.start()
 
         # Initially synchronization was left up to sqlite3's file locking to handle,
         # which was fine, except that the try/sleep is somewhat inefficient and risks
@@ -826,79 +1403,145 @@ if __name__ == "__main__":
         # network buffers full at all times, with data ready to consume for any core available.
         # Having many processes going at once is not a liability in terms of overhead.
         # Context switching is a cost paid per core, not per thread/process.
+        # The source processes only fetch records; the records are then handled by one pool of
+        # long-lived record workers, sized to the machine, which takes batches from all sources in turn.
+        # The handled records are stored by a single writer process.
         max_workers = max(psutil.cpu_count(logical=True) * 2, 8)
+        # (Or, with shards, by a few writer processes, each storing the records of some of the sources.)
+        # A plain multiprocessing queue (rather than a Manager one), so that the records go straight
+        # from the workers to the writer. Bounded, so that the workers wait if the writer falls behind.
+        storage_batch_size = max(int(getenv("SWEPUB_STORAGE_BATCH_SIZE", DEFAULT_STORAGE_BATCH_SIZE)), 1)
+        if shard_dir:
+            # (Sources may share a code, and with it a shard)
+            shard_codes = list(dict.fromkeys(source["code"] for source in sources_to_process))
+            for code in shard_codes:
+                init_new_shard(shard_dir, code)
+            shard_writers = min(
+                max(int(getenv("SWEPUB_SHARD_WRITERS", DEFAULT_SHARD_WRITERS)), 1), max(len(shard_codes), 1)
+            )
+            writer_queues = [Queue(maxsize=record_workers * 2) for _ in range(shard_writers)]
+            storage_queue = writer_queues
+        else:
+            writer_queues = [Queue(maxsize=record_workers * 2)]
+            storage_queue = writer_queues[0]
+        initargs = (
+            lock,
+            harvest_cache,
+            added_converted_rowids,
+            log,
+            incremental,
+            storage_queue,
+        )
+        # Everything the harvest processes inherit is there now. The garbage collector would write to
+        # (and thereby copy) the pages of every object it looks at, so it leaves them alone from now on.
+        gc.freeze()
+        writers = []
+        for writer_queue in writer_queues:
+            writer = Process(
+                target=_run_storage_writer,
+                args=((*initargs[:-1], writer_queue), storage_batch_size, shard_dir),
+                daemon=True,
+            )
+            writer.start()
+            writers.append(writer)
         with ProcessPoolExecutor(
-            max_workers=max_workers,
-            initializer=init,
-            initargs=(
-                lock,
-                harvest_cache,
-                added_converted_rowids,
-                log,
-                incremental,
-            ),
-        ) as executor:
-            for source in sources_to_process:
-                executor.submit(harvest_wrapper, source)
-            executor.shutdown(wait=True)
+            max_workers=record_workers, initializer=init, initargs=initargs
+        ) as record_executor:
+            for _ in range(record_workers):
+                record_executor.submit(record_worker).add_done_callback(_record_worker_done)
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=init, initargs=initargs) as executor:
+                # Sources are started in host order round-robin, so that sources on less busy hosts
+                # aren't stuck in the queue behind sources waiting for their (shared) host.
+                for source in interleave_by_host(sources_to_process):
+                    executor.submit(harvest_wrapper, source)
+                # (Forking executors start all of their processes at the first submit.) Everything
+                # has been forked, so from here on this process collects its garbage as usual.
+                gc.unfreeze()
+                executor.shutdown(wait=True)
+            # All sources have waited for their batches to be handled, so the workers are idle
+            for _ in range(record_workers):
+                harvest_cache["batch_payloads"].put(None)
+            record_executor.shutdown(wait=True)
+        # Everything has been stored, too
+        for writer_queue in writer_queues:
+            writer_queue.put(None)
+        for writer in writers:
+            writer.join()
 
         t1 = time.time()
         diff = round(t1 - t0, 2)
         log.info(f"Phase 1 (harvesting) ran for {diff} seconds")
+        wal_checkpointer.phase_done("harvesting")
+        log.info(f'Concurrent requests per host at end of harvest: {harvest_cache["host_scheduler"].limits()}')
+
+        if shard_dir:
+            t0 = t1
+            replaced_shard_codes = _replace_shards(shard_dir, shard_codes, harvest_cache["meta"]["sources_succeeded"])
+            shard_paths = get_shard_paths(shard_dir)
+            with get_connection() as connection:
+                consolidate_shards(shard_paths, connection)
+            t1 = time.time()
+            diff = round(t1 - t0, 2)
+            log.info(f"Consolidating {len(shard_paths)} shards ran for {diff} seconds")
+            wal_checkpointer.phase_done("consolidating shards")
+
+        if not incremental:
+            t0 = t1
+            with get_connection() as connection:
+                create_deferred_indexes(connection)
+            t1 = time.time()
+            diff = round(t1 - t0, 2)
+            log.info(f"Creating indexes ran for {diff} seconds")
+            wal_checkpointer.phase_done("creating indexes")
 
         t0 = t1
+        harvest_cache.update(harvest_cache["learned"].learned())
         _add_localid_orcid_to_db(harvest_cache)
         _calculate_oai_ids_to_reprocess()
         _reprocess_affected_records(sources_to_process)
+        harvest_cache.update(harvest_cache["learned"].learned())
         _add_link_between_source_and_enriched()
+        if shard_dir:
+            for code in replaced_shard_codes:
+                save_to_shard(shard_dir, code)
         t1 = time.time()
         diff = round(t1 - t0, 2)
         log.info(f"Phase 2 (reprocessing affected records) ran for {diff} seconds")
+        wal_checkpointer.phase_done("reprocessing affected records")
 
     t0 = t1 if t1 else time.time()
     deduplicate()
     t1 = time.time()
     diff = round(t1 - t0, 2)
     log.info(f"Phase 3 (deduplication) ran for {diff} seconds")
+    wal_checkpointer.phase_done("deduplication")
 
     t0 = t1
     merge()
     t1 = time.time()
     diff = round(t1 - t0, 2)
     log.info(f"Phase 4 (merging) ran for {diff} seconds")
+    wal_checkpointer.phase_done("merging")
 
     t0 = t1
     generate_search_tables()
     t1 = time.time()
     diff = round(t1 - t0, 2)
     log.info(f"Phase 5 (generate search tables) ran for {diff} seconds")
+    wal_checkpointer.phase_done("generate search tables")
 
     t0 = t1
     generate_processing_stats()
     t1 = time.time()
     diff = round(t1 - t0, 2)
     log.info(f"Phase 6 (generate processing stats) ran for {diff} seconds")
+    wal_checkpointer.phase_done("generate processing stats")
+    wal_checkpointer.stop()
 
     if harvest_cache and not args.purge:
         log.info(f'Sources harvested: {" ".join(harvest_cache["meta"]["sources_succeeded"])}')
         if harvest_cache["meta"]["sources_failed"]:
             log.warning(f'Sources failed: {" ".join(harvest_cache["meta"]["sources_failed"])}')
-        # Save ISSN/DOI cache for use next time
-        try:
-            log.info(
-                f'Saving {len(harvest_cache["issn_new"]) + len(harvest_cache["doi_new"])} cached IDs to {ID_CACHE_FILE}'
-            )
-            with open(ID_CACHE_FILE, "wb") as f:
-                f.write(
-                    json.dumps(
-                        {
-                            "doi": dict(harvest_cache["doi_new"]),
-                            "issn": dict(harvest_cache["issn_new"]),
-                        }
-                    )
-                )
-        except Exception as e:
-            log.warning(f"Failed saving harvest ID cache to {ID_CACHE_FILE}: {e}")
 
     if environ.get("SWEPUB_LEGACY_SEARCH_DATABASE"):
         t0 = t1
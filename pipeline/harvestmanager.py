@@ -0,0 +1,20 @@
+from multiprocessing.managers import SyncManager
+
+from pipeline.batchqueue import BatchQueue
+from pipeline.hostscheduler import HostScheduler
+from pipeline.learnedstore import LearnedStore
+
+
+# Shared objects live in the manager process; harvest processes use them through proxies.
+# Blocking calls (e.g. HostScheduler.acquire, BatchQueue.put) block in the manager's thread
+# serving the calling process (each process, and each thread in it, has its own connection),
+# so one waiting process doesn't block the others.
+# Every call is a round-trip to the manager process, so what's used for every record is kept out
+# of it: see _get_harvest_cache in pipeline.harvest.
+class HarvestManager(SyncManager):
+    pass
+
+
+HarvestManager.register("HostScheduler", HostScheduler)
+HarvestManager.register("BatchQueue", BatchQueue)
+HarvestManager.register("LearnedStore", LearnedStore)
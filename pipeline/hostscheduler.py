@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+
+# Most sources are harvested from the same (DiVA) server, so rather than letting every source
+# process send requests as fast as it can, requests are scheduled per host: each host has a
+# limit on the number of concurrent requests, which is adapted (AIMD: additive increase,
+# multiplicative decrease) to how the server copes. The limit grows by roughly one for every
+# `limit` successful requests and is cut when the server throttles us (429/503, which also
+# covers Retry-After), when requests time out, or when latency rises well above what's
+# normal for the host. Hosts are independent, so a throttled host doesn't slow down others.
+# The scheduler is shared by all harvest processes through the harvest Manager
+# (see pipeline.harvestmanager).
+DEFAULT_INITIAL_LIMIT = 2
+DEFAULT_MAX_LIMIT = 8
+MIN_LIMIT = 1
+DECREASE_FACTOR = 0.5
+# A request taking this many times longer than the host's average counts as congestion
+LATENCY_FACTOR = 3.0
+# Weight of the latest request in the host's average latency
+LATENCY_SMOOTHING = 0.2
+
+
+def get_host(url):
+    return urlsplit(url).netloc.lower()
+
+
+def interleave_by_host(sources):
+    # Order sources round-robin by host, so that sources on other hosts get started
+    # even when many sources (waiting for the same host) are ahead of them in the list.
+    by_host = defaultdict(deque)
+    for source in sources:
+        by_host[get_host(source["sets"][0]["url"]) if source.get("sets") else ""].append(source)
+    interleaved = []
+    while by_host:
+        for host in list(by_host):
+            interleaved.append(by_host[host].popleft())
+            if not by_host[host]:
+                del by_host[host]
+    return interleaved
+
+
+class _HostState:
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.average_latency = None
+        self.last_decrease = 0.0
+
+
+class HostScheduler:
+    def __init__(self, initial_limit=DEFAULT_INITIAL_LIMIT, max_limit=DEFAULT_MAX_LIMIT):
+        self.max_limit = max(max_limit, MIN_LIMIT)
+        self.initial_limit = min(max(initial_limit, MIN_LIMIT), self.max_limit)
+        self._hosts = {}
+        self._condition = threading.Condition()
+
+    def _state(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(self.initial_limit)
+        return self._hosts[host]
+
+    # Block until a request to `host` may be sent
+    def acquire(self, host):
+        with self._condition:
+            state = self._state(host)
+            while state.in_flight >= int(state.limit):
+                self._condition.wait()
+            state.in_flight += 1
+
+    # Called when a request to `host` is done. `latency` is the time in seconds it took,
+    # `throttled` whether the server asked us to back off (or didn't answer in time).
+    def release(self, host, latency, throttled=False):
+        with self._condition:
+            state = self._state(host)
+            state.in_flight = max(state.in_flight - 1, 0)
+            slow = state.average_latency is not None and latency > state.average_latency * LATENCY_FACTOR
+            if throttled or slow:
+                # Requests that were already in flight when we backed off will report the
+                # same congestion; only cut the limit once per (average) round trip.
+                now = time.monotonic()
+                if now - state.last_decrease >= (state.average_latency or 0):
+                    state.limit = max(state.limit * DECREASE_FACTOR, MIN_LIMIT)
+                    state.last_decrease = now
+            else:
+                state.limit = min(state.limit + 1 / state.limit, self.max_limit)
+            if not throttled:
+                if state.average_latency is None:
+                    state.average_latency = latency
+                else:
+                    state.average_latency += LATENCY_SMOOTHING * (latency - state.average_latency)
+            self._condition.notify_all()
+
+    def limits(self):
+        with self._condition:
+            return {host: int(state.limit) for host, state in self._hosts.items()}
+
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+import time
+
+import orjson as json
+from stdnum.issn import format as issn_format
+
+from pipeline.swepublog import logger as log
+
+FILE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# We check if ISSN and DOI numbers really exist through HTTP requests to external servers (see
+# validators.doi and validators.issn), and keep the outcomes here, in a database of their own that's
+# kept from one harvest to the next. Both found and not found are kept, the latter for a shorter
+# time, as it may have been a temporary failure (or the DOI not registered yet).
+ID_CACHE_VALID_TTL = 365 * 24 * 3600
+ID_CACHE_INVALID_TTL = 7 * 24 * 3600
+# Outcomes are written in transactions of (up to) this many, and whenever flush() is called
+ID_CACHE_WRITE_BATCH = 100
+
+ID_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS verified_id (
+    id_type TEXT,
+    id TEXT, -- normalized, see _normalize
+    valid INTEGER, -- (fake boolean 1/0)
+    verified_at INTEGER, -- unix time
+    PRIMARY KEY (id_type, id)
+) WITHOUT ROWID
+"""
+
+
+def get_id_cache_path():
+    return os.getenv("SWEPUB_ID_CACHE", os.path.join(FILE_PATH, "../cache/id_cache.sqlite3"))
+
+
+# DOIs are case insensitive, and ISSNs are kept formatted (as in the static list of ISSNs)
+def _normalize(id_type, id):
+    if id_type == "DOI":
+        return id.lower()
+    if id_type == "ISSN":
+        return issn_format(id)
+    return id
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=60)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.execute(ID_CACHE_SCHEMA)
+    connection.commit()
+    return connection
+
+
+class IdCache:
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._pending = {}
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = _connect(self.path)
+        return self._connection
+
+    # True/False if the ID was found or not when last verified (and that's recent enough), otherwise None
+    def get(self, id_type, id):
+        id = _normalize(id_type, id)
+        if (id_type, id) in self._pending:
+            return self._pending[(id_type, id)][0]
+        try:
+            row = (
+                self._get_connection()
+                .execute("SELECT valid, verified_at FROM verified_id WHERE id_type = ? AND id = ?", (id_type, id))
+                .fetchone()
+            )
+        except sqlite3.Error as e:
+            log.warning(f"Failed reading ID cache: {e}")
+            return None
+        if row is None:
+            return None
+        valid, verified_at = row
+        if time.time() - verified_at > (ID_CACHE_VALID_TTL if valid else ID_CACHE_INVALID_TTL):
+            return None
+        return bool(valid)
+
+    def put(self, id_type, id, valid):
+        id = _normalize(id_type, id)
+        self._pending[(id_type, id)] = (valid, int(time.time()))
+        if len(self._pending) >= ID_CACHE_WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        try:
+            with self._get_connection() as connection:
+                connection.executemany(
+                    """
+                    INSERT INTO verified_id(id_type, id, valid, verified_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(id_type, id) DO UPDATE SET valid = excluded.valid, verified_at = excluded.verified_at
+                    """,
+                    [(id_type, id, int(valid), verified_at) for (id_type, id), (valid, verified_at) in self._pending.items()],
+                )
+        except sqlite3.Error as e:
+            # Kept for the next flush
+            log.warning(f"Failed writing ID cache: {e}")
+            return
+        self._pending = {}
+
+
+# One IdCache for each process and thread (like storage.get_connection), which reads the database
+# directly; what it learns is written by flush(), or once there's enough of it
+_id_caches = threading.local()
+
+
+def get_id_cache():
+    path = get_id_cache_path()
+    if getattr(_id_caches, "pid", None) != os.getpid() or _id_caches.cache.path != path:
+        # (A cache inherited from the parent process is left alone, connection and pending writes)
+        _id_caches.pid = os.getpid()
+        _id_caches.cache = IdCache(path)
+    return _id_caches.cache
+
+
+# Remove what's too old to be used, and on the first run, bring in what was found according to the
+# JSON file the cache used to be kept in ({"doi": {doi: 1, ...}, "issn": {issn: 1, ...}})
+def prepare_id_cache(json_cache_file=None):
+    path = get_id_cache_path()
+    new = not os.path.exists(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = _connect(path)
+    try:
+        with connection:
+            now = int(time.time())
+            connection.execute(
+                "DELETE FROM verified_id WHERE verified_at < CASE WHEN valid THEN ? ELSE ? END",
+                (now - ID_CACHE_VALID_TTL, now - ID_CACHE_INVALID_TTL),
+            )
+            if new and json_cache_file and os.path.exists(json_cache_file):
+                with open(json_cache_file, "rb") as f:
+                    previously_validated_ids = json.loads(f.read())
+                rows = [
+                    (id_type, _normalize(id_type, id), 1, now)
+                    for id_type, key in [("DOI", "doi"), ("ISSN", "issn")]
+                    for id in previously_validated_ids.get(key, {})
+                ]
+                connection.executemany("INSERT OR IGNORE INTO verified_id VALUES (?, ?, ?, ?)", rows)
+                log.info(f"ID cache populated with {len(rows)} previously validated IDs from {json_cache_file}")
+        counts = dict(connection.execute("SELECT valid, count(*) FROM verified_id GROUP BY valid").fetchall())
+        log.info(f"ID cache {path} has {counts.get(1, 0)} IDs found and {counts.get(0, 0)} not found")
+    finally:
+        connection.close()
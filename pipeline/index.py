@@ -1,7 +1,8 @@
 import orjson as json
 
 from pipeline.bibframesource import BibframeSource
-from pipeline.storage import get_connection, checkpoint
+from pipeline.storage import get_connection, get_sqlite_path, checkpoint
+from pipeline.walcheckpointer import background_checkpointing
 
 OUTPUT_TYPE_PREFIX = "https://id.kb.se/term/swepub/output/"
 
@@ -16,9 +17,10 @@ def generate_search_tables():
         limit = 25000
 
         for n in range(0, total//limit + 1):
-            # Necessary for WAL file not to grow too big
-            checkpoint()
-            for row in second_cursor.execute(f"SELECT id, cluster_id, data FROM finalized LIMIT {limit} OFFSET {limit*n}"):
+            # Necessary for WAL file not to grow too big (unless it's checkpointed in the background)
+            if not background_checkpointing(get_sqlite_path()):
+                checkpoint()
+            for row in second_cursor.execute(f"SELECT id, cluster_id, decompress(data) FROM finalized LIMIT {limit} OFFSET {limit*n}"):
                 finalized_id = row[0]
                 cluster_id = row[1]
                 doc = BibframeSource(json.loads(row[2]))
@@ -0,0 +1,54 @@
+import threading
+
+# While validating and enriching records, the record workers learn things that are only needed once
+# everything has been harvested (see _add_localid_orcid_to_db and friends in pipeline.harvest):
+# - localid_to_orcid: {local ID cache key: {"orcid": ..., "oai_id": ...}}, the first one seen wins
+# - localid_without_orcid: {local ID cache key: [OAI IDs of records with that local ID but no ORCID]}
+# - enriched_from_other_record: {OAI ID: [OAI IDs of the records it was enriched with data from]}
+#
+# Each worker keeps what it learns in its own (plain dict) copy of harvest_cache, and now and then
+# hands it over to the one LearnedStore, which lives in the harvest Manager (see
+# pipeline.harvestmanager), instead of making a round-trip to the Manager for every record.
+LEARNED_KEYS = ("localid_to_orcid", "localid_without_orcid", "enriched_from_other_record")
+
+
+def new_learned():
+    return {key: {} for key in LEARNED_KEYS}
+
+
+# Takes what has been learned out of harvest_cache, leaving it empty
+def take_learned(harvest_cache):
+    learned = {}
+    for key in LEARNED_KEYS:
+        if harvest_cache.get(key):
+            learned[key] = harvest_cache[key]
+            harvest_cache[key] = {}
+    return learned
+
+
+def merge_learned(into, learned):
+    for cache_key, value in learned.get("localid_to_orcid", {}).items():
+        into["localid_to_orcid"].setdefault(cache_key, value)
+    for cache_key, oai_ids in learned.get("localid_without_orcid", {}).items():
+        into["localid_without_orcid"].setdefault(cache_key, []).extend(oai_ids)
+    for oai_id, source_oai_ids in learned.get("enriched_from_other_record", {}).items():
+        merged = into["enriched_from_other_record"].setdefault(oai_id, [])
+        merged.extend(source_oai_id for source_oai_id in source_oai_ids if source_oai_id not in merged)
+
+
+class LearnedStore:
+    def __init__(self):
+        self._learned = new_learned()
+        # (The Manager serves each process in a thread of its own)
+        self._lock = threading.Lock()
+
+    def merge(self, learned):
+        with self._lock:
+            merge_learned(self._learned, learned)
+
+    # Everything learned so far
+    def learned(self):
+        with self._lock:
+            learned = new_learned()
+            merge_learned(learned, self._learned)
+            return learned
@@ -177,7 +177,7 @@ def _update_records(hours=None):
         for row in cur.execute(
             """
         SELECT
-            converted.oai_id, converted.data AS converted_json, converted.source, converted.deleted, finalized.oai_id AS duplicateof, finalized.data AS finalized_json, original.data AS xml, original.source_subset, modified
+            converted.oai_id, decompress(converted.data) AS converted_json, converted.source, converted.deleted, finalized.oai_id AS duplicateof, decompress(finalized.data) AS finalized_json, decompress(original.data) AS xml, original.source_subset, modified
         FROM
             converted
         LEFT JOIN
@@ -6,6 +6,7 @@ import orjson as json
 from pipeline.publicationmerger import PublicationMerger
 from pipeline.publication import Publication
 from pipeline.storage import get_connection
+from pipeline.compression import compress, prepare_compression
 
 
 def merge():
@@ -22,7 +23,7 @@ def merge():
             for cluster_row in cursor.execute(
                 """
             SELECT
-                cluster_id, group_concat(converted.data, "\n")
+                cluster_id, group_concat(decompress(converted.data), "\n")
             FROM
                 cluster
             LEFT JOIN
@@ -58,6 +59,7 @@ def merge():
 
 
 def write_results(result, inner_cursor, connection):
+    prepare_compression(connection)
     for cluster in result[0]:
         cluster_id = cluster[0]
         merged_data = cluster[1]
@@ -65,7 +67,7 @@ def write_results(result, inner_cursor, connection):
             """
         INSERT INTO finalized(cluster_id, oai_id, data) VALUES(?, ?, ?);
         """,
-            (cluster_id, merged_data["@id"], json.dumps(merged_data)),
+            (cluster_id, merged_data["@id"], compress("json", json.dumps(merged_data))),
         )
     connection.commit()
 
@@ -7,42 +7,52 @@ import lxml.etree as et
 
 class ModsStylesheet:
     parsed_stylesheets = {}
+    compiled_stylesheets = {}
 
     def __init__(self, code, url):
         self.url = url
         self.code = code
         self.stylesheet = None
+        self.transform = None
 
+    # raw_xml is either the record XML as text or an already parsed element, which is
+    # transformed as is. The result is always text.
     def apply(self, raw_xml):
         return self._transform(raw_xml)
 
     def _transform(self, raw_xml):
         self.get_stylesheet()
+        is_text = isinstance(raw_xml, str)
         if not self.stylesheet:
-            return raw_xml
-        try:
-            parsed_xml = et.fromstring(raw_xml)
-        except lxml.etree.XMLSyntaxError:
-            print(
-                f'Failed to parse XML from "{self.url}" for stylesheet '
-                "transform. Continuing harvest without transform, even though "
-                "a stylesheet to be applied exists.",
-                file=sys.stderr,
-            )
-            return raw_xml
-        transform = et.XSLT(self.stylesheet)
-        transformed_xml = transform(parsed_xml)
+            return raw_xml if is_text else et.tounicode(raw_xml)
+        if is_text:
+            try:
+                parsed_xml = et.fromstring(raw_xml)
+            except lxml.etree.XMLSyntaxError:
+                print(
+                    f'Failed to parse XML from "{self.url}" for stylesheet '
+                    "transform. Continuing harvest without transform, even though "
+                    "a stylesheet to be applied exists.",
+                    file=sys.stderr,
+                )
+                return raw_xml
+        else:
+            parsed_xml = raw_xml
+        transformed_xml = self.transform(parsed_xml)
         return et.tostring(transformed_xml, encoding="unicode")
 
     def get_stylesheet(self):
         if self.parsed_stylesheets.get(self.url):
             self.stylesheet = self.parsed_stylesheets.get(self.url)
+            self.transform = self.compiled_stylesheets.get(self.url)
         else:
             self._get_parsed_xsl()
 
     def _get_parsed_xsl(self):
         xsl = self._get_xsl_file_path()
         self.stylesheet = et.parse(xsl) if xsl else None
+        # Compile once per stylesheet rather than for every record
+        self.transform = et.XSLT(self.stylesheet) if self.stylesheet else None
         self._add_to_cache()
 
     def _get_xsl_file_path(self):
@@ -68,4 +78,5 @@ class ModsStylesheet:
 
     def _add_to_cache(self):
         self.parsed_stylesheets[self.url] = self.stylesheet
+        self.compiled_stylesheets[self.url] = self.transform
         # print('Stylesheet for "{}" added to cache'.format(self.url))
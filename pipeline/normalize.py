@@ -4,16 +4,15 @@ import re
 
 from stdnum.issn import format as issn_format
 
-from pipeline.util import update_at_path, make_event, Normalization, Enrichment
+from pipeline.util import make_event, Normalization, Enrichment
 
 
-def normalize_issn(body, field, cached_paths={}):
+def normalize_issn(body, field):
     issn = field.value
-    path = field.path
 
     new_value = issn_format(issn)
     if new_value != issn:
-        update_at_path(body, path, new_value, cached_paths)
+        field.update(body, new_value)
         field.events.append(
             make_event(
                 event_type="normalization",
@@ -27,13 +26,12 @@ def normalize_issn(body, field, cached_paths={}):
         field.value = new_value
 
 
-def normalize_isbn(body, field, cached_paths={}):
+def normalize_isbn(body, field):
     isbn = field.value
-    path = field.path
 
     new_value = isbn.replace("-", "").upper()
     if new_value != isbn:
-        update_at_path(body, path, new_value, cached_paths)
+        field.update(body, new_value)
         field.events.append(
             make_event(
                 event_type="normalization",
@@ -47,13 +45,12 @@ def normalize_isbn(body, field, cached_paths={}):
         field.value = new_value
 
 
-def normalize_isi(body, field, cached_paths={}):
+def normalize_isi(body, field):
     isi = field.value
-    path = field.path
 
     new_value = isi.upper()
     if new_value != isi:
-        update_at_path(body, path, new_value, cached_paths)
+        field.update(body, new_value)
         field.events.append(
             make_event(
                 event_type="normalization",
@@ -67,11 +64,10 @@ def normalize_isi(body, field, cached_paths={}):
         field.value = new_value
 
 
-def normalize_orcid(body, field, cached_paths={}):
+def normalize_orcid(body, field):
     HTTP_PREFIX = "http://orcid.org/"
     HTTPS_PREFIX = "https://orcid.org/"
     orcid = field.value
-    path = field.path
     # normalize_orcid_prefix
     enriched_value = orcid
     code = ""
@@ -82,7 +78,7 @@ def normalize_orcid(body, field, cached_paths={}):
         code = "prefix.add"
         enriched_value = HTTPS_PREFIX + orcid
     if orcid != enriched_value:
-        update_at_path(body, path, enriched_value, cached_paths)
+        field.update(body, enriched_value)
         field.events.append(
             make_event(
                 event_type="normalization",
@@ -105,7 +101,7 @@ def normalize_orcid(body, field, cached_paths={}):
     enriched = HTTPS_PREFIX + enriched
 
     if initial != enriched:
-        update_at_path(body, path, enriched, cached_paths)
+        field.update(body, enriched)
         field.events.append(
             make_event(
                 event_type="normalization",
@@ -119,12 +115,11 @@ def normalize_orcid(body, field, cached_paths={}):
         field.value = enriched
 
 
-def normalize_doi(body, field, cached_paths={}):
+def normalize_doi(body, field):
     HTTPS_PREFIX = "https://doi.org/"
     DOI_PREFIX = "10."
     doi_prefix = re.compile(r"(https?://doi\.org/)?(10\..*)")
     doi = field.value
-    path = field.path
     # normalize_doi_prefix
     enriched_value = doi
 
@@ -132,7 +127,7 @@ def normalize_doi(body, field, cached_paths={}):
     doi_match = doi_prefix.findall(doi)
     new_value = "".join(doi_match[0]) if doi_match else doi
     if doi != new_value:
-        update_at_path(body, path, new_value, cached_paths)
+        field.update(body, new_value)
         field.events.append(
             make_event(
                 event_type="normalization",
@@ -154,7 +149,7 @@ def normalize_doi(body, field, cached_paths={}):
         code = "prefix.add"
         enriched_value = HTTPS_PREFIX + new_value
     if new_value != enriched_value:
-        update_at_path(body, path, enriched_value, cached_paths)
+        field.update(body, enriched_value)
         field.events.append(
             make_event(
                 event_type="normalization",
@@ -183,16 +178,15 @@ class MLStripper(HTMLParser):
         return "".join(self.fed)
 
 
-def normalize_free_text(body, field, cached_paths={}):
+def normalize_free_text(body, field):
     free_text = field.value
-    path = field.path
     field.enrichment_status = Enrichment.UNCHANGED
     # strip tags
     s = MLStripper()
     s.feed(unescape(free_text))
     new_value = s.get_data()
     if new_value != free_text:
-        update_at_path(body, path, new_value, cached_paths)
+        field.update(body, new_value)
         field.events.append(
             make_event(
                 event_type="normalization",
@@ -214,7 +208,7 @@ def normalize_free_text(body, field, cached_paths={}):
     translator = str.maketrans("", "", escapes)
     new_value = text.translate(translator)
     if new_value != free_text:
-        update_at_path(body, path, new_value, cached_paths)
+        field.update(body, new_value)
         field.events.append(
             make_event(
                 event_type="normalization",
@@ -1,13 +1,19 @@
+from datetime import timedelta
+from hashlib import blake2b
+from io import StringIO
+
 import requests
-import xml.etree.ElementTree as ET
+from lxml import etree
 
 import pipeline.sickle as sickle
+from pipeline.sickle.iterator import OAIItemIterator, PrefetchOAIItemIterator
 from pipeline.sickle.oaiexceptions import (
     BadArgument, BadVerb, BadResumptionToken,
     CannotDisseminateFormat, IdDoesNotExist, NoSetHierarchy,
     NoMetadataFormat, NoRecordsMatch, OAIError
 )
 from pipeline.modsstylesheet import ModsStylesheet
+from pipeline.oaiarchive import ArchivingSickle, ReplaySickle
 
 OAIExceptions = (
     BadArgument, BadVerb, BadResumptionToken,
@@ -22,8 +28,35 @@ RequestExceptions = (
 )
 
 
+# Split the days from `earliest` to `latest` (dates) into `count` consecutive datestamp windows of
+# about the same length, as (from, until) pairs of OAI-PMH datestamps (day granularity, which all
+# repositories support). The first window is open at the start and the last one at the end, so
+# that no record is missed whatever its datestamp.
+def date_windows(earliest, latest, count):
+    days = (latest - earliest).days + 1
+    count = max(min(count, days), 1)
+    windows = []
+    window_from = None
+    for i in range(1, count):
+        start = earliest + timedelta(days=days * i // count)
+        windows.append((window_from, (start - timedelta(days=1)).isoformat()))
+        window_from = start.isoformat()
+    windows.append((window_from, None))
+    return windows
+
+
 class RecordIterator:
-    def __init__(self, code, source_set, harvest_from, harvest_to, user_agent, should_transform=True):
+    # prefetch: number of ListRecords pages to fetch in the background while the current
+    # page is being processed (0 = fetch the next page only when the current one is done)
+    # stream: parse each page incrementally and hand out records as they are read, instead of
+    # parsing the whole page into a tree first
+    # scheduler: optional per-host request limiter (see pipeline.hostscheduler)
+    # resumption_token: continue an interrupted harvest of the set from this token instead of from
+    # the start; if the server no longer accepts it, the set is harvested from `fallback_from` instead
+    # archive: optional function archiving each raw page (see pipeline.oaiarchive.OAIArchiveWriter.chain)
+    # replay: optional iterator over archived pages to use instead of requesting them from the server
+    # (see pipeline.oaiarchive.OAIArchiveReader.pages)
+    def __init__(self, code, source_set, harvest_from, harvest_to, user_agent, should_transform=True, prefetch=0, stream=False, scheduler=None, resumption_token=None, fallback_from=None, archive=None, replay=None):
         self.set = source_set
         self.stylesheet = ModsStylesheet(code, self.set["url"])
         self.records = None
@@ -32,6 +65,15 @@ class RecordIterator:
         self.harvest_to = harvest_to
         self.user_agent = user_agent
         self.should_transform = should_transform
+        self.prefetch = prefetch
+        self.stream = stream
+        self.scheduler = scheduler
+        self.resumption_token = resumption_token
+        self.fallback_from = fallback_from
+        self.token_expired = False
+        self._resumed = False
+        self.archive = archive
+        self.replay = replay
 
     def __iter__(self):
         return self
@@ -40,7 +82,19 @@ class RecordIterator:
         try:
             if not self._has_records():
                 self._get_records()
-            return self._get_next_record()
+            record = self._get_next_record()
+            self._resumed = True
+            return record
+        except BadResumptionToken as e:
+            # The token we were to resume from has expired; anything else is a failed harvest
+            if not self.resumption_token or self._resumed:
+                raise HarvestFailed(str(e))
+            self.close()
+            self.records = None
+            self.resumption_token = None
+            self.harvest_from = self.fallback_from
+            self.token_expired = True
+            return self.__next__()
         except NoRecordsMatch:
             #logger.info("OAI-PMH query returned no matches.")
             raise StopIteration
@@ -54,11 +108,35 @@ class RecordIterator:
             else:
                 raise HarvestFailed(str(e))
 
+    def close(self):
+        if self.records is not None and hasattr(self.records, "close"):
+            self.records.close()
+
     def _has_records(self):
         return self.records is not None
 
     def _get_records(self):
-        sickle_client = sickle.Sickle(self.set["url"], max_retries=8, timeout=90, headers={"User-Agent": self.user_agent})
+        sickle_args = dict(
+            iterator=PrefetchOAIItemIterator if self.prefetch else OAIItemIterator,
+            prefetch=self.prefetch,
+            stream=self.stream,
+            scheduler=self.scheduler,
+            max_retries=8,
+            timeout=90,
+            headers={"User-Agent": self.user_agent},
+        )
+        if self.replay is not None:
+            sickle_client = ReplaySickle(self.set["url"], self.replay, **sickle_args)
+        elif self.archive is not None:
+            sickle_client = ArchivingSickle(self.set["url"], self.archive, **sickle_args)
+        else:
+            sickle_client = sickle.Sickle(self.set["url"], **sickle_args)
+        if self.resumption_token:
+            # The token stands for all the other arguments of the interrupted harvest
+            self.records = sickle_client.ListRecords(
+                ignore_broken=True, ignore_deleted=False, resumptionToken=self.resumption_token
+            )
+            return
         list_record_params = {
             "metadataPrefix": self.set["metadata_prefix"],
             "ignore_deleted": False
@@ -74,23 +152,55 @@ class RecordIterator:
     def _get_next_record(self):
         record = next(self.records)
         #print(f"next record: {record.header.identifier}") # status="deleted"
-        root = ET.fromstring(record.header.raw)
-        deleted = "status" in root.attrib and root.attrib["status"] == "deleted"
+        deleted = record.header.deleted
         if self.should_transform:
-            return Record(record.header.identifier, deleted, self.stylesheet.apply(record.raw))
+            # The stylesheet is applied to the already parsed record element
+            xml = self.stylesheet.apply(record.xml)
         else:
-            return Record(record.header.identifier, deleted, record.raw)
+            xml = record.raw
+        # The token the record's page was requested with; the first page of a resumed harvest
+        # was requested with the token we resumed from
+        page_token = self.records.page_token.token if self.records.page_token else self.resumption_token
+        return Record(record.header.identifier, deleted, xml, record.header.datestamp, page_token)
 
 
 class Record:
-    def __init__(self, oai_id=None, deleted=None, xml=''):
+    # page_token: the resumptionToken that returns the page the record is on (None for the first page)
+    def __init__(self, oai_id=None, deleted=None, xml='', datestamp=None, page_token=None):
         self.xml = xml
         self.deleted = deleted
         self.oai_id = oai_id
+        self.datestamp = datestamp
+        self.page_token = page_token
+        self._tree = None
 
     def is_successful(self):
         return bool(self.xml)
 
+    @property
+    def tree(self):
+        # Parsed on first access, then shared by everything that needs the record as a tree
+        # (minimum level filter, MODS conversion) so that it's only parsed once per process.
+        if self._tree is None:
+            self._tree = etree.parse(StringIO(self.xml))
+        return self._tree
+
+    @property
+    def content_hash(self):
+        # Identifies the record's content, apart from its header (a new datestamp or set doesn't
+        # make it a different record), so that a record that's harvested again unchanged can be
+        # recognized. Computed from the transformed record, so a new stylesheet changes it.
+        metadata = self.tree.getroot().find("{http://www.openarchives.org/OAI/2.0/}metadata")
+        if metadata is None:
+            metadata = self.tree.getroot()
+        return blake2b(etree.tostring(metadata), digest_size=16).hexdigest()
+
+    def __getstate__(self):
+        # Only the text is sent to the worker processes; lxml trees can't be pickled
+        state = self.__dict__.copy()
+        state["_tree"] = None
+        return state
+
 
 class Source:
     def __init__(self, source_dict):
@@ -0,0 +1,218 @@
+import gzip
+import json
+import threading
+import zlib
+from collections import defaultdict
+from itertools import islice
+
+import pipeline.sickle as sickle
+from pipeline.sickle.response import OAIResponse
+
+# With --archive-dir, every raw ListRecords page a harvest receives is also written to an archive,
+# one per source and run. With --replay, the archived pages are fed through the same pipeline
+# instead of being requested from the server, e.g. to rebuild a database or to benchmark and
+# debug record processing without network access (or with the exact data a run got).
+#
+# An archive is a gzip file of frames, each frame a JSON header line followed by `length` bytes
+# of page content. The first frame describes the harvest; the others are pages, in the order they
+# were received. Pages belong to a chain: the resumptionToken chain of one set (and datestamp
+# window, see pipeline.harvest), which is replayed as a whole. The frames of concurrently
+# harvested windows are interleaved, but each chain's pages are in order.
+#
+# Each frame is a gzip member of its own (which the first frame says, as `frame_members`), so that
+# a chain can be replayed by seeking to its frames, rather than by reading the whole archive for
+# every chain. Archives written before that are one gzip member, and are still read as a whole.
+ARCHIVE_SUFFIX = ".oai.gz"
+COMPRESS_LEVEL = 6
+READ_SIZE = 64 * 1024
+SET_KEYS = ("url", "metadata_prefix", "subset")
+
+
+def _chain_key(source_set, window):
+    return json.dumps([{key: source_set[key] for key in SET_KEYS if key in source_set}, list(window)], sort_keys=True)
+
+
+def _read_frames(fp):
+    # An archive of an interrupted run ends with an incomplete frame; everything before it is fine
+    try:
+        while True:
+            line = fp.readline()
+            if not line:
+                return
+            header = json.loads(line)
+            content = fp.read(header["length"])
+            if len(content) < header["length"]:
+                return
+            yield header, content
+    except (EOFError, ValueError):
+        return
+
+
+# Reads the frames of an archive whose frames are gzip members of their own, from the current
+# position of `fp` (the archive opened as it is), as (offset of the frame in the file, header, content)
+def _read_frame_members(fp):
+    try:
+        while True:
+            offset = fp.tell()
+            decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            data = []
+            while not decompressor.eof:
+                chunk = fp.read(READ_SIZE)
+                if not chunk:
+                    # (The end of the archive, or an incomplete frame)
+                    return
+                data.append(decompressor.decompress(chunk))
+            # The start of the next frame was read too
+            fp.seek(-len(decompressor.unused_data), 1)
+            line, _, content = b"".join(data).partition(b"\n")
+            header = json.loads(line)
+            if len(content) < header["length"]:
+                return
+            yield offset, header, content
+    except (zlib.error, ValueError):
+        return
+
+
+class OAIArchiveWriter:
+    def __init__(self, path, source, harvest_start, harvest_from):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "xb")
+        self._write(
+            {
+                "source": source,
+                "harvest_start": str(harvest_start),
+                "harvest_from": harvest_from,
+                "frame_members": True,
+            },
+            b"",
+        )
+
+    def _write(self, header, content):
+        header["length"] = len(content)
+        # (Compressed before taking the lock, so that concurrent chains don't wait for each other)
+        member = gzip.compress(json.dumps(header).encode("utf-8") + b"\n" + content, compresslevel=COMPRESS_LEVEL)
+        with self._lock:
+            self._file.write(member)
+
+    # Returns a function archiving the pages of one chain: call it with the OAI parameters and
+    # the HTTP response of each page
+    def chain(self, source_set, window):
+        chain = _chain_key(source_set, window)
+
+        def archive(params, http_response):
+            self._write(
+                {"chain": chain, "params": params, "encoding": getattr(http_response, "encoding", None)},
+                http_response.content,
+            )
+
+        return archive
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class OAIArchiveReader:
+    def __init__(self, path):
+        self.path = path
+        self._chains = {}
+        # The offsets of each chain's frames, if the frames are gzip members of their own
+        self._offsets = None
+        with gzip.open(path, "rb") as fp:
+            header, _ = next(_read_frames(fp), ({}, b""))
+        if "source" not in header:
+            raise ValueError(f"{path} is not an OAI-PMH archive")
+        self.source = header["source"]
+        self.harvest_start = header["harvest_start"]
+        self.harvest_from = header["harvest_from"]
+        if header.get("frame_members"):
+            self._offsets = defaultdict(list)
+            with open(path, "rb") as fp:
+                frames = _read_frame_members(fp)
+                next(frames, None)
+                for offset, header, _ in frames:
+                    self._add_chain(header["chain"])
+                    self._offsets[header["chain"]].append(offset)
+        else:
+            with gzip.open(path, "rb") as fp:
+                frames = _read_frames(fp)
+                next(frames, None)
+                for header, _ in frames:
+                    self._add_chain(header["chain"])
+
+    def _add_chain(self, chain):
+        if chain not in self._chains:
+            source_set, window = json.loads(chain)
+            self._chains[chain] = (source_set, tuple(window))
+
+    # The archived sets, in the order they were harvested
+    @property
+    def sets(self):
+        sets = []
+        for source_set, _ in self._chains.values():
+            if source_set not in sets:
+                sets.append(source_set)
+        return sets
+
+    # The archived datestamp windows of a set, as (from, until) pairs
+    def windows(self, source_set):
+        return [window for chain_set, window in self._chains.values() if chain_set == source_set]
+
+    # The pages of a chain, as (params, encoding, content), in the order they were received
+    def pages(self, source_set, window):
+        chain = _chain_key(source_set, window)
+        if self._offsets is None:
+            with gzip.open(self.path, "rb") as fp:
+                for header, content in _read_frames(fp):
+                    if header.get("chain") == chain:
+                        yield header["params"], header["encoding"], content
+            return
+        with open(self.path, "rb") as fp:
+            for offset in self._offsets.get(chain, []):
+                fp.seek(offset)
+                for _, header, content in islice(_read_frame_members(fp), 1):
+                    yield header["params"], header["encoding"], content
+
+
+class ArchiveExhausted(Exception):
+    pass
+
+
+class _ArchivedResponse:
+    # The parts of a requests.Response that sickle.OAIResponse uses
+    def __init__(self, content, encoding):
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+class ArchivingSickle(sickle.Sickle):
+    # archive: function called with the OAI parameters and HTTP response of each page
+    # (see OAIArchiveWriter.chain)
+    def __init__(self, endpoint, archive, **kwargs):
+        super().__init__(endpoint, **kwargs)
+        self.archive = archive
+
+    def harvest(self, **kwargs):
+        response = super().harvest(**kwargs)
+        self.archive(kwargs, response.http_response)
+        return response
+
+
+class ReplaySickle(sickle.Sickle):
+    # pages: iterator over the archived pages to return instead of requesting them from the server
+    # (see OAIArchiveReader.pages)
+    def __init__(self, endpoint, pages, **kwargs):
+        super().__init__(endpoint, **kwargs)
+        self.pages = pages
+
+    def harvest(self, **kwargs):
+        page = next(self.pages, None)
+        if page is None:
+            raise ArchiveExhausted(f"No more archived pages for {self.endpoint} (requested {kwargs})")
+        params, encoding, content = page
+        return OAIResponse(_ArchivedResponse(content, encoding), params=params)
@@ -0,0 +1,109 @@
+from pipeline.swepublog import logger as log
+from pipeline.util import ENRICHING_AUDITORS_CODES
+
+# The validation, enrichment and normalization status of each field of a converted record (see
+# validate.get_record_info) and the results of its audit events are stored packed, in one
+# converted_flags row per record:
+# - validation, enrichment, normalization: FIELD_BITS bits per field, in FLAG_FIELDS order: 0 if
+#   the record doesn't have the field, otherwise the status + 1
+# - audit: one bit per audit code, in AUDIT_CODES order, set if the record has the event
+# - audit_true, audit_false: the same bits, set if the event's result is true (1) or false (0)
+# Filtering or counting records by a flag is then a matter of masking a column, see field_status
+# and audit_result.
+#
+# The positions are part of the storage format: only ever append to these.
+FLAG_FIELDS = (
+    "URI",
+    "DOI",
+    "ISI",
+    "ORCID",
+    "PersonID",
+    "publication_year",
+    "creator_count",
+    "ISBN",
+    "ISSN",
+    "free_text",
+    "SSIF",
+)
+AUDIT_CODES = (
+    "set_publication_level",
+    "creator_count_note_exists",
+    "creator_count_check",
+    "contributor_duplicate_check",
+    "SSIF_comprehensive_check",
+    "ISSN_missing_check",
+    "expand_research_subjects",
+    *ENRICHING_AUDITORS_CODES,
+)
+FIELD_BITS = 2
+FIELD_STATUS_COLUMNS = ("validation", "enrichment", "normalization")
+# (mask, value) that no column matches, for flags we don't know
+NO_MATCH = (0, 1)
+
+_field_positions = {field: i for i, field in enumerate(FLAG_FIELDS)}
+_audit_positions = {code: i for i, code in enumerate(AUDIT_CODES)}
+_warned = set()
+
+
+def _position(positions, name):
+    if name not in positions:
+        if name not in _warned:
+            _warned.add(name)
+            log.warning(f"No record flag for {name}, not storing it")
+        return None
+    return positions[name]
+
+
+def field_shift(field):
+    position = _position(_field_positions, field)
+    return None if position is None else position * FIELD_BITS
+
+
+def audit_bit(code):
+    position = _position(_audit_positions, code)
+    return None if position is None else 1 << position
+
+
+# The packed (validation, enrichment, normalization, audit, audit_true, audit_false) flags of a
+# record, from its record_info (see validate.get_record_info) and audit events
+def pack_record_flags(record_info, audit_events):
+    validation = enrichment = normalization = 0
+    for field, value in record_info.items():
+        shift = field_shift(field)
+        if shift is None:
+            continue
+        validation |= (int(value["validation_status"]) + 1) << shift
+        enrichment |= (int(value["enrichment_status"]) + 1) << shift
+        normalization |= (int(value["normalization_status"]) + 1) << shift
+
+    audit = audit_true = audit_false = 0
+    for events in audit_events.values():
+        for event in events:
+            bit = audit_bit(event.get("code"))
+            if bit is None:
+                continue
+            audit |= bit
+            result = event.get("result")
+            if result is None:
+                continue
+            if result == 1:
+                audit_true |= bit
+            elif result == 0:
+                audit_false |= bit
+    return validation, enrichment, normalization, audit, audit_true, audit_false
+
+
+# (mask, value) such that `column & mask = value` for the records where `field` has `status`
+# (column being the field's status type: validation, enrichment or normalization)
+def field_status(field, status):
+    shift = field_shift(field)
+    if shift is None:
+        return NO_MATCH
+    return ((1 << FIELD_BITS) - 1) << shift, (int(status) + 1) << shift
+
+
+# (column, mask) such that `column & mask != 0` for the records where the `code` event's result is
+# `result` (true or false)
+def audit_result(code, result):
+    bit = audit_bit(code)
+    return ("audit_true" if result else "audit_false"), (0 if bit is None else bit)
@@ -9,7 +9,10 @@
 """
 import inspect
 import logging
+import threading
 import time
+import weakref
+from urllib.parse import urlsplit
 
 import requests
 from requests.adapters import HTTPAdapter, Retry
@@ -23,6 +26,9 @@ logger = logging.getLogger(__name__)
 
 OAI_NAMESPACE = '{http://www.openarchives.org/OAI/%s/}'
 
+# Responses telling us that the server is overloaded
+THROTTLE_STATUS_CODES = (429, 503)
+
 
 # Map OAI verbs to class representations
 DEFAULT_CLASS_MAP = {
@@ -35,6 +41,102 @@ DEFAULT_CLASS_MAP = {
 }
 
 
+class _HostSlot(object):
+    """A request's slot with the host scheduler.
+
+    The slot is held from sending the request until its body has been read
+    (or the response closed), except while urllib3 waits before retrying
+    (see :class:`_SlotReleasingRetry`): each attempt is reported to the
+    scheduler on its own. The latency reported is the time spent waiting for
+    the server, so neither backoff nor the time the caller takes between the
+    chunks of a streamed body counts.
+    """
+
+    def __init__(self, scheduler, host):
+        self.scheduler = scheduler
+        self.host = host
+        self.held = False
+        self._latency = 0.0
+        self._start = None
+
+    def acquire(self):
+        self.scheduler.acquire(self.host)
+        self.held = True
+        self._latency = 0.0
+        self._start = time.monotonic()
+
+    def release(self, throttled=False):
+        if not self.held:
+            return
+        self._stop()
+        self.held = False
+        self.scheduler.release(self.host, self._latency, throttled)
+
+    def _stop(self):
+        if self._start is not None:
+            self._latency += time.monotonic() - self._start
+            self._start = None
+
+    def hold_until_read(self, response):
+        """Keep the slot until the body of the (streamed) `response` has
+        been read, counting only the time spent reading it."""
+        self._stop()
+        iter_content = response.iter_content
+        close = response.close
+
+        def timed_iter_content(*args, **kwargs):
+            chunks = iter_content(*args, **kwargs)
+            try:
+                while True:
+                    self._start = time.monotonic()
+                    try:
+                        chunk = next(chunks)
+                    except StopIteration:
+                        return
+                    finally:
+                        self._stop()
+                    yield chunk
+            finally:
+                self.release()
+
+        def closing():
+            try:
+                close()
+            finally:
+                self.release()
+
+        response.iter_content = timed_iter_content
+        response.close = closing
+        # (In case the response is dropped without being read)
+        weakref.finalize(response, self.release)
+
+
+class _SlotReleasingRetry(Retry):
+    """Retry giving up the current request's :class:`_HostSlot` (if any)
+    while it waits before trying again, so that backoff neither holds up
+    other requests to the host nor counts as latency."""
+
+    def __init__(self, *args, slots=None, **kwargs):
+        super(_SlotReleasingRetry, self).__init__(*args, **kwargs)
+        # The slot of the request being sent in each thread, as ``slots.current``
+        self.slots = slots if slots is not None else threading.local()
+
+    def new(self, **kw):
+        kw.setdefault('slots', self.slots)
+        return super(_SlotReleasingRetry, self).new(**kw)
+
+    def sleep(self, response=None):
+        slot = getattr(self.slots, 'current', None)
+        if slot is None:
+            return super(_SlotReleasingRetry, self).sleep(response)
+        # Without a response, the attempt failed (e.g. timed out)
+        slot.release(throttled=response is None or response.status in THROTTLE_STATUS_CODES)
+        try:
+            super(_SlotReleasingRetry, self).sleep(response)
+        finally:
+            slot.acquire()
+
+
 class Sickle(object):
     """Client for harvesting OAI interfaces.
 
@@ -75,6 +177,21 @@ class Sickle(object):
                          information is missing, `requests` will fallback to
                          `'ISO-8859-1'`.
     :type encoding:      str
+    :param prefetch: Number of pages :class:`sickle.iterator.PrefetchOAIItemIterator`
+                     may fetch ahead of the page being iterated over (default: 1).
+    :type prefetch: int
+    :param stream: Flag for whether to parse ListRecords/ListIdentifiers
+                   responses incrementally while they are being downloaded,
+                   instead of parsing each complete page into a tree
+                   (see :meth:`sickle.response.OAIResponse.iterparse`).
+    :type stream: bool
+    :param scheduler: Optional object limiting concurrent requests per host.
+                      ``scheduler.acquire(host)`` is called before each
+                      attempt and ``scheduler.release(host, latency,
+                      throttled)`` once its response has been read (or
+                      before waiting to retry), where ``throttled`` tells
+                      whether the server responded with 429/503 or didn't
+                      answer (see :class:`_HostSlot`).
     :param request_args: Arguments to be passed to requests when issuing HTTP
                          requests. Useful examples are `auth=('username', 'password')`
                          for basic auth-protected endpoints or `timeout=<int>`.
@@ -92,6 +209,9 @@ class Sickle(object):
                  retry_backoff_factor=2,
                  class_mapping=None,
                  encoding=None,
+                 prefetch=1,
+                 stream=False,
+                 scheduler=None,
                  **request_args):
 
         self.endpoint = endpoint
@@ -111,12 +231,13 @@ class Sickle(object):
         if default_retry_after is not None:
             logger.warning("default_retry_after is no longer supported, please use retry_backoff_factor instead.")
 
-        retry_adapter = requests.adapters.HTTPAdapter(max_retries=Retry(
+        self._retry = _SlotReleasingRetry(
             total=max_retries,
             backoff_factor=retry_backoff_factor,
             status_forcelist=retry_status_codes or [429, 500, 502, 503, 504],
             allowed_methods=frozenset(['GET', 'POST'])
-        ))
+        )
+        retry_adapter = requests.adapters.HTTPAdapter(max_retries=self._retry)
         self.session = requests.Session()
         self.session.mount('https://', retry_adapter)
         self.session.mount('http://', retry_adapter)
@@ -124,6 +245,11 @@ class Sickle(object):
         self.oai_namespace = OAI_NAMESPACE % self.protocol_version
         self.class_mapping = class_mapping or DEFAULT_CLASS_MAP
         self.encoding = encoding
+        self.prefetch = prefetch
+        self.stream = stream
+        self.scheduler = scheduler
+        if stream:
+            request_args['stream'] = True
         self.request_args = request_args
 
     def harvest(self, **kwargs):  # pragma: no cover
@@ -138,6 +264,32 @@ class Sickle(object):
         return OAIResponse(http_response, params=kwargs)
 
     def _request(self, kwargs):
+        if self.scheduler is None:
+            return self._send(kwargs)
+        slot = _HostSlot(self.scheduler, urlsplit(self.endpoint).netloc.lower())
+        slot.acquire()
+        self._retry.slots.current = slot
+        try:
+            response = self._send(kwargs)
+        except (requests.exceptions.RetryError, requests.exceptions.Timeout):
+            slot.release(throttled=True)
+            raise
+        except requests.exceptions.HTTPError as e:
+            slot.release(throttled=e.response is not None and e.response.status_code in THROTTLE_STATUS_CODES)
+            raise
+        except BaseException:
+            slot.release()
+            raise
+        finally:
+            self._retry.slots.current = None
+        if self.stream:
+            # Only the headers have been read so far
+            slot.hold_until_read(response)
+        else:
+            slot.release()
+        return response
+
+    def _send(self, kwargs):
         if self.http_method == 'GET':
             response = self.session.get(self.endpoint, params=kwargs, **self.request_args)
         else:
@@ -7,6 +7,10 @@
 
     :copyright: Copyright 2015 Mathias Loesch
 """
+import asyncio
+import itertools
+import threading
+
 from lxml import etree
 
 from . import oaiexceptions
@@ -38,6 +42,12 @@ class BaseOAIIterator(object):
     :type ignore_deleted: bool
     :param ignore_broken: Flag for whether to ignore broken records.
     :type ignore_broken: bool
+
+    ``resumption_token`` is the token for the page following the current
+    one, ``page_token`` the token the current page was requested with
+    (:obj:`None` for the first page). Requesting ``page_token`` again
+    returns the current page, which makes it the point to resume from if
+    iteration is interrupted in the middle of the page.
     """
 
     def __init__(self, sickle, params, ignore_deleted=False, ignore_broken=False):
@@ -47,6 +57,7 @@ class BaseOAIIterator(object):
         self.ignore_broken = ignore_broken
         self.verb = self.params.get('verb')
         self.resumption_token = None
+        self.page_token = None
         self._next_response()
 
     def __iter__(self):
@@ -58,10 +69,16 @@ class BaseOAIIterator(object):
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, self.verb)
 
-    def _get_resumption_token(self):
-        """Extract and store the resumptionToken from the last response."""
-        resumption_token_element = self.oai_response.xml.find(
-            './/' + self.sickle.oai_namespace + 'resumptionToken')
+    def _get_resumption_token(self, oai_response=None):
+        """Extract the resumptionToken from a response (by default the last
+        one)."""
+        oai_response = oai_response or self.oai_response
+        return self._make_resumption_token(oai_response.xml.find(
+            './/' + self.sickle.oai_namespace + 'resumptionToken'))
+
+    @staticmethod
+    def _make_resumption_token(resumption_token_element):
+        """Create a ResumptionToken from a resumptionToken element."""
         if resumption_token_element is None:
             return None
         token = resumption_token_element.text
@@ -77,25 +94,41 @@ class BaseOAIIterator(object):
         )
         return resumption_token
 
-    def _next_response(self):
-        """Get the next response from the OAI server."""
-        params = self.params
-        if self.resumption_token:
-            params = {
-                'resumptionToken': self.resumption_token.token,
+    def _next_params(self, resumption_token):
+        """Return the OAI arguments for the request following a response
+        with the given resumptionToken."""
+        if resumption_token:
+            return {
+                'resumptionToken': resumption_token.token,
                 'verb': self.verb
             }
-        self.oai_response = self.sickle.harvest(**params)
-        error = self.oai_response.xml.find(
+        return self.params
+
+    def _raise_for_error(self, oai_response):
+        """Raise the OAI exception matching an error in the response, if
+        there is one."""
+        error = oai_response.xml.find(
             './/' + self.sickle.oai_namespace + 'error')
         if error is not None:
-            code = error.attrib.get('code', 'UNKNOWN')
-            description = error.text or ''
-            try:
-                raise getattr(
-                    oaiexceptions, code[0].upper() + code[1:])(description)
-            except AttributeError:
-                raise oaiexceptions.OAIError(description)
+            self._raise_error(error)
+
+    @staticmethod
+    def _raise_error(error):
+        """Raise the OAI exception matching an error element."""
+        code = error.attrib.get('code', 'UNKNOWN')
+        description = error.text or ''
+        try:
+            raise getattr(
+                oaiexceptions, code[0].upper() + code[1:])(description)
+        except AttributeError:
+            raise oaiexceptions.OAIError(description)
+
+    def _next_response(self):
+        """Get the next response from the OAI server."""
+        params = self._next_params(self.resumption_token)
+        self.oai_response = self.sickle.harvest(**params)
+        self._raise_for_error(self.oai_response)
+        self.page_token = self.resumption_token
         self.resumption_token = self._get_resumption_token()
 
     def next(self):
@@ -125,6 +158,11 @@ class OAIItemIterator(BaseOAIIterator):
 
     Can be used to conveniently iterate through the records of a repository.
 
+    If ``sickle.stream`` is set, each page is parsed incrementally while it is
+    being downloaded and the items are mapped as soon as they have been read
+    (see :meth:`sickle.response.OAIResponse.iterparse`). An item's XML is
+    then only available until the next item is requested.
+
     :param sickle: The Sickle object that issued the first request.
     :type sickle: :class:`sickle.app.Sickle`
     :param params: The OAI arguments.
@@ -141,10 +179,40 @@ class OAIItemIterator(BaseOAIIterator):
         super(OAIItemIterator, self).__init__(sickle, params, ignore_deleted, ignore_broken)
 
     def _next_response(self):
+        if self.sickle.stream:
+            self._next_streamed_response()
+            return
         super(OAIItemIterator, self)._next_response()
         self._items = self.oai_response.xml.iterfind(
             './/' + self.sickle.oai_namespace + self.element)
 
+    def _next_streamed_response(self):
+        """Get the next response from the OAI server, to be parsed while it
+        is being iterated over."""
+        params = self._next_params(self.resumption_token)
+        self.oai_response = self.sickle.harvest(**params)
+        self.page_token = self.resumption_token
+        self.resumption_token = None
+        self._items = self._iter_streamed_items(self.oai_response)
+        # Read up to the first item, so that an OAI error is raised here just
+        # like for a fully parsed response
+        first = next(self._items, None)
+        if first is not None:
+            self._items = itertools.chain([first], self._items)
+
+    def _iter_streamed_items(self, oai_response):
+        """Yield the item elements of a response as they are parsed, picking
+        up errors and the resumptionToken on the way."""
+        ns = self.sickle.oai_namespace
+        tags = (ns + self.element, ns + 'error', ns + 'resumptionToken')
+        for element in oai_response.iterparse(tags):
+            if element.tag == ns + 'error':
+                self._raise_error(element)
+            elif element.tag == ns + 'resumptionToken':
+                self.resumption_token = self._make_resumption_token(element)
+            else:
+                yield element
+
     def next(self):
         """Return the next record/header/set."""
         while True:
@@ -181,3 +249,142 @@ class OAIItemIterator(BaseOAIIterator):
                 self._next_response()
             else:
                 raise StopIteration
+
+
+class PrefetchOAIItemIterator(OAIItemIterator):
+    """Iterator over OAI records/identifiers/sets that requests the following
+    resumptionToken pages in the background.
+
+    Pages are requested and parsed by an asyncio event loop running in a
+    separate thread, at most ``sickle.prefetch`` pages ahead of the page
+    currently being iterated over. The network round-trip (and parsing) for
+    page N+1 thereby overlaps with the processing of the records on page N.
+    Each request still goes through :meth:`sickle.app.Sickle.harvest`, so
+    retries, timeouts and request arguments work as for
+    :class:`OAIItemIterator`.
+
+    Errors raised while fetching a page are re-raised when iteration reaches
+    that page. With ``sickle.stream`` set, a page is downloaded ahead and
+    only scanned for errors and the resumptionToken; its items are parsed
+    incrementally when iteration reaches it. Call :meth:`close` to stop fetching if the iterator is
+    abandoned before it is exhausted.
+
+    :param sickle: The Sickle object that issued the first request.
+    :type sickle: :class:`sickle.app.Sickle`
+    :param params: The OAI arguments.
+    :type params:  dict
+    :param ignore_deleted: Flag for whether to ignore deleted records.
+    :type ignore_deleted: bool
+    :param ignore_broken: Flag for whether to ignore broken records.
+    :type ignore_broken: bool
+    """
+
+    def __init__(self, sickle, params, ignore_deleted=False, ignore_broken=False):
+        self._prefetch = max(getattr(sickle, 'prefetch', 1), 1)
+        self._loop = None
+        self._thread = None
+        self._producer = None
+        self._closed = False
+        super(PrefetchOAIItemIterator, self).__init__(sickle, params, ignore_deleted, ignore_broken)
+
+    def _start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, args=(self._loop,), daemon=True)
+        self._thread.start()
+        self._pages = self._call(self._make_queues())
+        self._producer = asyncio.run_coroutine_threadsafe(self._produce(), self._loop)
+
+    @staticmethod
+    def _run_loop(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+        # Once stopped, let the cancelled producer finish before closing
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+    def _call(self, coroutine):
+        """Run a coroutine on the background loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _make_queues(self):
+        # Created on the loop they are used with
+        self._slots = asyncio.Semaphore(self._prefetch)
+        return asyncio.Queue()
+
+    async def _produce(self):
+        loop = asyncio.get_running_loop()
+        resumption_token = None
+        try:
+            while True:
+                # Wait until fewer than `prefetch` pages are waiting to be consumed
+                await self._slots.acquire()
+                params = self._next_params(resumption_token)
+                page = await loop.run_in_executor(None, self._fetch_page, params)
+                await self._pages.put(page)
+                resumption_token = page[1]
+                if not (resumption_token and resumption_token.token):
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._pages.put(e)
+
+    def _fetch_page(self, params):
+        """Request and parse one page (runs in the loop's executor)."""
+        oai_response = self.sickle.harvest(**params)
+        if not self.sickle.stream:
+            self._raise_for_error(oai_response)
+            return oai_response, self._get_resumption_token(oai_response)
+        # Read the whole body now; the scan below does not keep any tree
+        oai_response.http_response.content
+        ns = self.sickle.oai_namespace
+        resumption_token = None
+        for element in oai_response.iterparse((ns + 'error', ns + 'resumptionToken')):
+            if element.tag == ns + 'error':
+                self._raise_error(element)
+            resumption_token = self._make_resumption_token(element)
+        return oai_response, resumption_token
+
+    def _next_response(self):
+        """Get the next response from the background fetcher."""
+        if self._closed:
+            raise StopIteration
+        if self._loop is None:
+            self._start()
+        page = self._call(self._pages.get())
+        self._loop.call_soon_threadsafe(self._slots.release)
+        if isinstance(page, Exception):
+            self.close()
+            raise page
+        self.page_token = self.resumption_token
+        self.oai_response, self.resumption_token = page
+        if self.sickle.stream:
+            self._items = self._iter_streamed_items(self.oai_response)
+        else:
+            self._items = self.oai_response.xml.iterfind(
+                './/' + self.sickle.oai_namespace + self.element)
+
+    def next(self):
+        """Return the next record/header/set."""
+        try:
+            return super(PrefetchOAIItemIterator, self).next()
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """Stop fetching pages in the background."""
+        self._closed = True
+        loop, self._loop = self._loop, None
+        if loop is None or loop.is_closed():
+            return
+        self._producer.cancel()
+        loop.call_soon_threadsafe(loop.stop)
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def __del__(self):
+        self.close()
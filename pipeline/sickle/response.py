@@ -6,10 +6,17 @@
     :copyright: Copyright 2015 Mathias Loesch
 """
 
+import codecs
+import re
+
 from lxml import etree
 
 XMLParser = etree.XMLParser(remove_blank_text=True, recover=True, resolve_entities=False)
 
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_DECLARED_ENCODING = re.compile(br'\s*<\?xml[^>]*\sencoding\s*=')
+
 
 class OAIResponse(object):
     """A response from an OAI server.
@@ -25,6 +32,8 @@ class OAIResponse(object):
     def __init__(self, http_response, params):
         self.params = params
         self.http_response = http_response
+        self._xml = None
+        self._parsed = False
 
     @property
     def raw(self):
@@ -33,9 +42,75 @@ class OAIResponse(object):
 
     @property
     def xml(self):
-        """The server's response as parsed XML."""
-        return etree.XML(self.http_response.content,
-                         parser=XMLParser)
+        """The server's response as parsed XML.
+
+        The response is parsed on first access only; later accesses return
+        the same tree.
+        """
+        if not self._parsed:
+            self._xml = etree.XML(self.http_response.content,
+                                  parser=XMLParser)
+            self._parsed = True
+        return self._xml
+
+    def iterparse(self, tags):
+        """Parse the server's response incrementally, yielding the elements
+        with the given tags as soon as their end tag has been read.
+
+        The body is fed to the parser in chunks as it arrives, so a response
+        requested with ``stream=True`` is parsed while it is downloaded.
+        Each element is cleared, together with any preceding siblings, once
+        the next element is requested, so only the current item is kept in
+        memory. Data needed from an element must therefore be extracted
+        before advancing.
+
+        For a streamed response the body can only be read once: :attr:`xml`
+        and :attr:`raw` are not available afterwards.
+
+        :param tags: The (namespaced) tags of the elements to yield.
+        :type tags: iterable
+        """
+        parser = None
+        for chunk in self._iter_content():
+            if not chunk:
+                continue
+            if parser is None:
+                parser = self._pull_parser(tags, chunk)
+            parser.feed(chunk)
+            yield from self._read_events(parser)
+        if parser is not None:
+            parser.close()
+            yield from self._read_events(parser)
+
+    @staticmethod
+    def _pull_parser(tags, first_chunk):
+        # Unlike a complete parse, the push parser leaves the document
+        # encoding unset until the end if the response has no encoding
+        # declaration, which makes lxml serialize non-ASCII characters in
+        # attributes as character references. Use the XML default instead.
+        encoding = None
+        if not (first_chunk.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE))
+                or _DECLARED_ENCODING.match(first_chunk)):
+            encoding = 'UTF-8'
+        return etree.XMLPullParser(events=('end',), tag=tags,
+                                   encoding=encoding,
+                                   remove_blank_text=True, recover=True,
+                                   resolve_entities=False)
+
+    def _iter_content(self):
+        iter_content = getattr(self.http_response, 'iter_content', None)
+        if iter_content is None:
+            return [self.http_response.content]
+        return iter_content(chunk_size=STREAM_CHUNK_SIZE)
+
+    @staticmethod
+    def _read_events(parser):
+        for _, element in parser.read_events():
+            yield element
+            element.clear(keep_tail=True)
+            parent = element.getparent()
+            while element.getprevious() is not None:
+                del parent[0]
 
     def __repr__(self):
         return '<OAIResponse %s>' % self.params.get('verb')
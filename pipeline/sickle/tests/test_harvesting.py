@@ -6,6 +6,7 @@
     :copyright: Copyright 2015 Mathias Loesch
 """
 import os
+import time
 import unittest
 
 from lxml import etree
@@ -14,7 +15,7 @@ import mock
 from .. app import Sickle
 from .. _compat import binary_type, string_types, text_type, to_unicode
 from .. response import OAIResponse
-from .. iterator import OAIResponseIterator
+from .. iterator import OAIResponseIterator, PrefetchOAIItemIterator
 from .. oaiexceptions import BadArgument, CannotDisseminateFormat, \
     IdDoesNotExist, NoSetHierarchy, BadResumptionToken, NoRecordsMatch, \
     OAIError
@@ -71,6 +72,17 @@ def mock_harvest(*args, **kwargs):
         return OAIResponse(response, kwargs)
 
 
+PAGE_TOKENS = [None, None,
+               'ListRecords2.xml', 'ListRecords2.xml',
+               'ListRecords3.xml', 'ListRecords3.xml',
+               'ListRecords4.xml', 'ListRecords4.xml']
+
+
+def page_tokens(records):
+    """Return the page token for each record in a ListRecords iterator."""
+    return [records.page_token and records.page_token.token for _ in records]
+
+
 class TestCase(unittest.TestCase):
 
 
@@ -107,6 +119,13 @@ class TestCase(unittest.TestCase):
         num_records = len([r for r in records])
         assert num_records == 4
 
+    def test_ListRecords_page_token(self):
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc')
+        self.assertEqual(page_tokens(records), PAGE_TOKENS)
+        # Requesting a page token again returns that page and the ones after it
+        resumed = self.sickle.ListRecords(resumptionToken='ListRecords3.xml')
+        self.assertEqual(len([r for r in resumed]), 4)
+
     def test_ListSets(self):
         set_iterator = self.sickle.ListSets()
         sets = [s for s in set_iterator]
@@ -198,6 +217,149 @@ class TestCase(unittest.TestCase):
         self.assertEqual(len(records), 4)
 
 
+class TestCasePrefetch(unittest.TestCase):
+
+    def __init__(self, methodName='runTest'):
+        super(TestCasePrefetch, self).__init__(methodName)
+        self.patch = mock.patch.object(Sickle, 'harvest', mock_harvest)
+
+    def setUp(self):
+        self.patch.start()
+        self.sickle = Sickle('http://localhost',
+                             iterator=PrefetchOAIItemIterator, prefetch=2)
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_ListRecords(self):
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc')
+        identifiers = [r.header.identifier for r in records]
+        expected = [r.header.identifier for r in
+                    Sickle('http://localhost').ListRecords(metadataPrefix='oai_dc')]
+        self.assertEqual(identifiers, expected)
+        self.assertEqual(len(identifiers), 8)
+        self.assertFalse(records._thread.is_alive())
+
+    def test_ListRecords_ignore_deleted(self):
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc',
+                                          ignore_deleted=True)
+        self.assertEqual(len([r for r in records]), 4)
+
+    def test_ListIdentifiers(self):
+        records = self.sickle.ListIdentifiers(metadataPrefix='oai_dc')
+        self.assertEqual(len([r for r in records]), 4)
+
+    def test_ListRecords_page_token(self):
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc')
+        self.assertEqual(page_tokens(records), PAGE_TOKENS)
+
+    def test_prefetch_depth(self):
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc')
+        # The first of four pages is being iterated over; the next two are fetched ahead
+        for _ in range(50):
+            if records._pages.qsize() == 2:
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(records._pages.qsize(), 2)
+        self.assertFalse(records._producer.done())
+        records.close()
+        self.assertFalse(records._thread.is_alive())
+
+    def test_close_stops_iteration(self):
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc')
+        next(records)
+        records.close()
+        self.assertFalse(records._thread.is_alive())
+        # The rest of the current page is still available, but no more pages
+        self.assertEqual(len([r for r in records]), 1)
+
+    def test_badArgument(self):
+        with self.assertRaises(BadArgument):
+            self.sickle.ListRecords(metadataPrefix='oai_dc',
+                                    error='badArgument')
+
+    def test_noRecordsMatch(self):
+        with self.assertRaises(NoRecordsMatch):
+            self.sickle.ListRecords(
+                metadataPrefix='oai_dc', error='noRecordsMatch')
+
+
+class TestCaseStream(unittest.TestCase):
+
+    def __init__(self, methodName='runTest'):
+        super(TestCaseStream, self).__init__(methodName)
+        self.patch = mock.patch.object(Sickle, 'harvest', mock_harvest)
+
+    def setUp(self):
+        self.patch.start()
+        self.sickle = Sickle('http://localhost', stream=True)
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def _expected(self):
+        return [(r.header.identifier, r.header.deleted, r.raw) for r in
+                Sickle('http://localhost').ListRecords(metadataPrefix='oai_dc')]
+
+    def test_ListRecords(self):
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc')
+        # The XML must be read before moving on to the next record
+        self.assertEqual([(r.header.identifier, r.header.deleted, r.raw) for r in records],
+                         self._expected())
+
+    def test_ListRecords_prefetch(self):
+        sickle = Sickle('http://localhost', iterator=PrefetchOAIItemIterator,
+                        prefetch=2, stream=True)
+        records = sickle.ListRecords(metadataPrefix='oai_dc')
+        self.assertEqual([(r.header.identifier, r.header.deleted, r.raw) for r in records],
+                         self._expected())
+        self.assertFalse(records._thread.is_alive())
+
+    def test_ListRecords_page_token(self):
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc')
+        self.assertEqual(page_tokens(records), PAGE_TOKENS)
+
+    def test_ListRecords_clears_previous_records(self):
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc')
+        first = next(records)
+        second = next(records)
+        self.assertEqual(len(first.xml), 0)
+        next(records)
+        self.assertEqual(len(second.xml), 0)
+        self.assertIsNone(first.xml.getparent())
+
+    def test_ListRecords_ignore_deleted(self):
+        records = self.sickle.ListRecords(metadataPrefix='oai_dc',
+                                          ignore_deleted=True)
+        self.assertEqual(len([r for r in records]), 4)
+
+    def test_ListIdentifiers(self):
+        records = self.sickle.ListIdentifiers(metadataPrefix='oai_dc')
+        self.assertEqual(len([r for r in records]), 4)
+
+    def test_iterparse_without_xml_declaration(self):
+        text = (u'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><ListRecords>'
+                u'<record><header><identifier>a</identifier></header>'
+                u'<metadata><title lang="sv" label="Länk">Länk</title></metadata></record>'
+                u'</ListRecords></OAI-PMH>')
+        tag = '{http://www.openarchives.org/OAI/2.0/}record'
+        expected = etree.tounicode(OAIResponse(MockResponse(text), {}).xml.find('.//' + tag))
+        streamed = [etree.tounicode(e) for e in OAIResponse(MockResponse(text), {}).iterparse([tag])]
+        self.assertEqual(streamed, [expected])
+        self.assertIn(u'label="Länk"', streamed[0])
+
+    def test_badArgument(self):
+        with self.assertRaises(BadArgument):
+            self.sickle.ListRecords(metadataPrefix='oai_dc',
+                                    error='badArgument')
+
+    def test_noRecordsMatch(self):
+        with self.assertRaises(NoRecordsMatch):
+            self.sickle.ListRecords(
+                metadataPrefix='oai_dc', error='noRecordsMatch')
+
+
 def mock_get(*args, **kwargs):
     class MockResponseWrongEncoding(object):
         """Mimics a case where the requests library misidentifies the text encoding.
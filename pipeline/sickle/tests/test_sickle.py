@@ -73,3 +73,25 @@ class TestCase(unittest.TestCase):
         assert retries.backoff_factor == 1.1234
         assert retries.status_forcelist == (418,)
         assert retries.allowed_methods == frozenset(['POST', 'GET'])
+
+    def test_scheduler(self):
+        scheduler = Mock()
+        mock_response = Mock(text=u'<xml/>', content='<xml/>', status_code=200, raw=None)
+        sickle = Sickle('http://example.org:8080/oai', scheduler=scheduler)
+        sickle.session.get = Mock(return_value=mock_response)
+        sickle.ListSets()
+        scheduler.acquire.assert_called_once_with('example.org:8080')
+        host, latency, throttled = scheduler.release.call_args[0]
+        self.assertEqual(host, 'example.org:8080')
+        self.assertFalse(throttled)
+
+    def test_scheduler_throttled(self):
+        scheduler = Mock()
+        mock_response = Mock(status_code=503, raw=None)
+        mock_response.raise_for_status = Mock(side_effect=HTTPError(response=mock_response))
+        sickle = Sickle('http://example.org/oai', scheduler=scheduler)
+        sickle.session.get = Mock(return_value=mock_response)
+        with self.assertRaises(HTTPError):
+            sickle.ListRecords()
+        scheduler.acquire.assert_called_once_with('example.org')
+        self.assertTrue(scheduler.release.call_args[0][2])
@@ -1,5 +1,6 @@
 from pipeline.storage import *
 from pipeline.util import Validation, Enrichment, Normalization, ENRICHING_AUDITORS_CODES
+from pipeline.recordflags import AUDIT_CODES, FLAG_FIELDS, audit_bit, field_status
 
 def generate_processing_stats():
     with get_connection() as connection:
@@ -48,84 +49,86 @@ def generate_processing_stats():
                 """,
                 [row["source"], row["date"], row["value"], row["total"]])
 
-        # Auditor stats. Note that a couple of auditors, for historical reasons (though we should
-        # fix this at some point) should actually go into the _enricher_ category for API/stats purposes.
-        for row in cursor.execute("""
+        # Auditor and field stats, from the packed flags (see pipeline.recordflags), counted in one
+        # pass: for each audit code, the number of records with a true and a false result, and for
+        # each field, the number of records with each status. Only codes/fields that some record
+        # in the group has get a row.
+        audit_columns = []
+        for i, code in enumerate(AUDIT_CODES):
+            audit_columns.append(f"""
+                SUM((converted_flags.audit & {audit_bit(code)}) != 0) AS a{i},
+                SUM((converted_flags.audit_true & {audit_bit(code)}) != 0) AS a{i}_true,
+                SUM((converted_flags.audit_false & {audit_bit(code)}) != 0) AS a{i}_false""")
+        field_columns = []
+        for i, field in enumerate(FLAG_FIELDS):
+            mask, _ = field_status(field, Validation.VALID)
+            field_columns.append(f"SUM((converted_flags.validation & {mask}) != 0) AS f{i}")
+            for column, statuses in [
+                ("validation", [Validation.VALID, Validation.INVALID]),
+                ("enrichment", [Enrichment.ENRICHED, Enrichment.UNCHANGED, Enrichment.UNSUCCESSFUL]),
+                ("normalization", [Normalization.UNCHANGED, Normalization.NORMALIZED]),
+            ]:
+                for status in statuses:
+                    mask, value = field_status(field, status)
+                    field_columns.append(
+                        f"SUM((converted_flags.{column} & {mask}) = {value}) AS f{i}_{column[0]}_{str(status)}"
+                    )
+
+        for row in cursor.execute(f"""
             SELECT
-                converted_record_info.audit_code,
                 converted.source,
                 converted.date,
-                SUM(CASE WHEN converted_record_info.audit_result == 1 Then 1 else 0 end) AS result_true,
-                SUM(CASE WHEN converted_record_info.audit_result == 0 Then 1 else 0 end) AS result_false
+                {", ".join(audit_columns + field_columns)}
             FROM
-                converted_record_info
+                converted_flags
             LEFT JOIN
-                converted ON converted_record_info.converted_id=converted.id
+                converted ON converted_flags.converted_id=converted.id
             WHERE
                 converted.deleted = 0
-            AND
-                converted_record_info.field_name IS NULL
             GROUP BY
-                converted.source, converted_record_info.audit_code, converted.date
+                converted.source, converted.date
             """):
-            if row['audit_code'] == 'creator_count_check':
-                valid = row['result_true']
-                invalid = row['result_false']
-            elif row['audit_code'] in ENRICHING_AUDITORS_CODES:
-                valid = row['result_true']
-                invalid = 0
-            else:
-                valid = row['result_false']
-                invalid = row['result_true']
+            # Note that a couple of auditors, for historical reasons (though we should fix this at
+            # some point) should actually go into the _enricher_ category for API/stats purposes.
+            for i, code in enumerate(AUDIT_CODES):
+                if not row[f"a{i}"]:
+                    continue
+                if code == 'creator_count_check':
+                    valid = row[f"a{i}_true"]
+                    invalid = row[f"a{i}_false"]
+                elif code in ENRICHING_AUDITORS_CODES:
+                    valid = row[f"a{i}_true"]
+                    invalid = 0
+                else:
+                    valid = row[f"a{i}_false"]
+                    invalid = row[f"a{i}_true"]
 
-            inner_cursor.execute("""
-                INSERT INTO
-                    stats_audit_events(source, date, label, valid, invalid)
-                VALUES
-                    (?, ?, ?, ?, ?)
-                """,
-                [row['source'], row['date'], row['audit_code'], valid, invalid])
+                inner_cursor.execute("""
+                    INSERT INTO
+                        stats_audit_events(source, date, label, valid, invalid)
+                    VALUES
+                        (?, ?, ?, ?, ?)
+                    """,
+                    [row['source'], row['date'], code, valid, invalid])
 
-        for row in cursor.execute(f"""
-            SELECT
-                converted_record_info.field_name,
-                converted.source,
-                converted.date,
-                SUM(CASE WHEN converted_record_info.validation_status == {int(Validation.VALID)} Then 1 else 0 end) AS v_valid,
-                SUM(CASE WHEN converted_record_info.validation_status == {int(Validation.INVALID)}  Then 1 else 0 end) AS v_invalid,
-
-                SUM(CASE WHEN converted_record_info.enrichment_status == {int(Enrichment.ENRICHED)} Then 1 else 0 end) AS e_enriched,
-                SUM(CASE WHEN converted_record_info.enrichment_status == {int(Enrichment.UNCHANGED)}  Then 1 else 0 end) AS e_unchanged,
-                SUM(CASE WHEN converted_record_info.enrichment_status == {int(Enrichment.UNSUCCESSFUL)}  Then 1 else 0 end) AS e_unsuccessful,
-
-                SUM(CASE WHEN converted_record_info.normalization_status == {int(Normalization.UNCHANGED)} Then 1 else 0 end) AS n_unchanged,
-                SUM(CASE WHEN converted_record_info.normalization_status == {int(Normalization.NORMALIZED)} Then 1 else 0 end) AS n_normalized
-            FROM
-                converted_record_info
-            LEFT JOIN
-                converted ON converted_record_info.converted_id=converted.id
-            WHERE
-                converted.deleted = 0
-            AND
-                converted_record_info.audit_code IS NULL
-            GROUP BY
-                converted.source, converted_record_info.field_name, converted.date
-        """):
-            inner_cursor.execute("""
-                INSERT INTO
-                    stats_field_events(
-                        field_name, source, date,
-                        v_valid, v_invalid,
-                        e_enriched, e_unchanged, e_unsuccessful,
-                        n_unchanged, n_normalized)
-                VALUES
-                    (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, [
-                    row['field_name'], row['source'], row['date'],
-                    row['v_valid'], row['v_invalid'],
-                    row['e_enriched'], row['e_unchanged'], row['e_unsuccessful'],
-                    row['n_unchanged'], row['n_normalized']
-                ])
+            for i, field in enumerate(FLAG_FIELDS):
+                if not row[f"f{i}"]:
+                    continue
+                inner_cursor.execute("""
+                    INSERT INTO
+                        stats_field_events(
+                            field_name, source, date,
+                            v_valid, v_invalid,
+                            e_enriched, e_unchanged, e_unsuccessful,
+                            n_unchanged, n_normalized)
+                    VALUES
+                        (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, [
+                        field, row['source'], row['date'],
+                        row[f"f{i}_v_valid"], row[f"f{i}_v_invalid"],
+                        row[f"f{i}_e_enriched"], row[f"f{i}_e_unchanged"], row[f"f{i}_e_unsuccessful"],
+                        row[f"f{i}_n_unchanged"], row[f"f{i}_n_normalized"]
+                    ])
 
         connection.commit()
 
@@ -1,16 +1,44 @@
 import sqlite3
 import os
+import threading
 import time
+from contextlib import closing
 from enum import Enum
 
 import orjson as json
 
 from pipeline.bibframesource import BibframeSource
+from pipeline.compression import COMPRESSION_DICTIONARY_SCHEMA, compress, register_decompress
+from pipeline.recordflags import AUDIT_CODES, FLAG_FIELDS, audit_bit, field_shift, pack_record_flags
 from pipeline.swepublog import logger as log
+from pipeline.walcheckpointer import background_checkpointing
 
 FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 SQL_SCHEMA_FILE = os.path.join(FILE_PATH, "../resources/schema.sql")
 
+# Checkpoints for resuming interrupted harvests (see harvest.py --resume). Kept apart from the
+# schema file so that the table can be added to databases created before it existed.
+HARVEST_CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS harvest_checkpoint (
+    source TEXT,
+    source_subset TEXT,
+    window_from TEXT, -- datestamp window the set was split into ('' = from the start)
+    window_until TEXT, -- (null = to the end)
+    harvest_start DATETIME, -- of the interrupted harvest
+    harvest_from TEXT, -- OAI-PMH `from` of the interrupted harvest
+    resumption_token TEXT, -- returns the first page not yet completely stored (null = start of set)
+    datestamp TEXT, -- latest datestamp stored, if the set is listed in datestamp order
+    completed INTEGER, -- (fake boolean 1/0)
+    PRIMARY KEY (source, source_subset, window_from)
+)
+"""
+
+# Prepared statements kept per connection (the default is 128)
+CACHED_STATEMENTS = 512
+
+# Number of helper threads SQLite may use when creating the deferred indexes
+INDEX_THREADS = min(os.cpu_count() or 1, 8)
+
 
 def _set_pragmas(cursor):
     cursor.execute("PRAGMA journal_mode=WAL")
@@ -30,15 +58,14 @@ def storage_exists():
     return os.path.exists(get_sqlite_path())
 
 
-def clean_and_init_storage():
-    sqlite_path = get_sqlite_path()
+# defer_indexes=True leaves out the schema's indexes and triggers, for a full harvest into a new
+# database: bulk loading the tables and then creating the indexes (with create_deferred_indexes)
+# is much faster than maintaining them for every row inserted.
+def clean_and_init_storage(defer_indexes=False, sqlite_path=None):
+    sqlite_path = sqlite_path or get_sqlite_path()
+    close_connection(sqlite_path)
 
-    if os.path.exists(sqlite_path):
-        os.remove(sqlite_path)
-    if os.path.exists(f"{sqlite_path}-wal"):
-        os.remove(f"{sqlite_path}-wal")
-    if os.path.exists(f"{sqlite_path}-shm"):
-        os.remove(f"{sqlite_path}-shm")
+    _remove_database(sqlite_path)
     con = sqlite3.connect(sqlite_path)
     cur = con.cursor()
     _set_pragmas(cur)
@@ -46,8 +73,436 @@ def clean_and_init_storage():
     with open(SQL_SCHEMA_FILE, "r") as sql_schema_file:
         sql_script = sql_schema_file.read()
     cur.executescript(sql_script)
+    init_harvest_checkpoints(cur)
+    if defer_indexes:
+        for type_, name, _ in _deferred_schema():
+            cur.execute(f"DROP {type_.upper()} {name}")
 
     con.commit()
+    con.close()
+
+
+def _remove_database(sqlite_path):
+    for path in [sqlite_path, f"{sqlite_path}-wal", f"{sqlite_path}-shm"]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# With --shard-dir (SWEPUB_SHARD_DIR), a full harvest stores each source's records in a database of
+# its own, a shard, with its own writer, instead of all of them going through one writer into the
+# main database. The shards hold what the storage writer writes (originals, converted records and
+# their details, rejections); everything else, and all later phases, use the main database, into
+# which the shards are consolidated (see consolidate_shards) once everything has been harvested.
+# The shards are kept, so that a full harvest of some sources only needs to replace their shards:
+# the main database is consolidated from all shards in the directory. So what the main database
+# knows about a source and its records apart from that, its harvests (see replace_shard) and what's
+# worked out once everything is harvested (see save_to_shard), is kept in its shard too.
+SHARD_SUFFIX = ".sqlite3"
+NEW_SHARD_SUFFIX = ".new"
+
+
+def get_shard_path(shard_dir, source):
+    return os.path.join(shard_dir, f"{source}{SHARD_SUFFIX}")
+
+
+# A source is harvested into a new shard, which replaces the old one once the harvest is done
+def init_new_shard(shard_dir, source):
+    clean_and_init_storage(defer_indexes=True, sqlite_path=get_shard_path(shard_dir, source) + NEW_SHARD_SUFFIX)
+
+
+def connect_new_shard(shard_dir, source):
+    connection = connect(get_shard_path(shard_dir, source) + NEW_SHARD_SUFFIX)
+    # Rejections refer to the harvest, which is only in the main database
+    connection.execute("PRAGMA foreign_keys=OFF")
+    return connection
+
+
+def replace_shard(shard_dir, source):
+    shard_path = get_shard_path(shard_dir, source)
+    # The shard keeps its harvest, which its rejections refer to, and when it last succeeded (for the
+    # next --update), for when it's consolidated into a main database of a later harvest
+    with closing(connect(shard_path + NEW_SHARD_SUFFIX)) as connection:
+        connection.execute("ATTACH DATABASE ? AS harvested", (get_sqlite_path(),))
+        connection.execute(
+            "INSERT INTO main.harvest_history SELECT * FROM harvested.harvest_history WHERE source = ?", (source,)
+        )
+        connection.execute(
+            "INSERT INTO main.last_harvest SELECT * FROM harvested.last_harvest WHERE source = ?", (source,)
+        )
+        connection.commit()
+        connection.execute("DETACH DATABASE harvested")
+    _remove_database(shard_path)
+    os.replace(shard_path + NEW_SHARD_SUFFIX, shard_path)
+
+
+# Keep what's been worked out about the shard's records once everything was harvested (see
+# harvest._add_localid_orcid_to_db and harvest._add_link_between_source_and_enriched) in the shard:
+# the local IDs whose ORCID was found in its records, and which of its records were enriched with
+# data from other records
+def save_to_shard(shard_dir, source):
+    with closing(connect(get_shard_path(shard_dir, source))) as connection:
+        connection.execute("ATTACH DATABASE ? AS harvested", (get_sqlite_path(),))
+        connection.execute("DELETE FROM main.localid_to_orcid")
+        connection.execute(
+            """
+        INSERT INTO
+            main.localid_to_orcid(source_oai_id, cache_key, orcid)
+        SELECT
+            source_oai_id, cache_key, orcid
+        FROM
+            harvested.localid_to_orcid
+        WHERE
+            source_oai_id IN (SELECT oai_id FROM main.original)
+        """
+        )
+        connection.execute("DELETE FROM main.enriched_from_other_record")
+        connection.execute(
+            """
+        INSERT INTO
+            main.enriched_from_other_record(source_oai_id, enriched_oai_id)
+        SELECT
+            source_oai_id, enriched_oai_id
+        FROM
+            harvested.enriched_from_other_record
+        WHERE
+            enriched_oai_id IN (SELECT oai_id FROM main.original)
+        """
+        )
+        connection.commit()
+        connection.execute("DETACH DATABASE harvested")
+
+
+def discard_new_shard(shard_dir, source):
+    _remove_database(get_shard_path(shard_dir, source) + NEW_SHARD_SUFFIX)
+
+
+def get_shard_paths(shard_dir):
+    return sorted(
+        os.path.join(shard_dir, name) for name in os.listdir(shard_dir) if name.endswith(SHARD_SUFFIX)
+    )
+
+
+# Copy the records of the shards into the database of `connection`, as if they had been stored there
+# one shard after another (see store_original and store_converted). Row IDs are only unique within
+# a shard: originals get new IDs above those already copied, and the details of converted records
+# are matched to their records by OAI ID.
+def consolidate_shards(shard_paths, connection):
+    cur = connection.cursor()
+    connection.commit()
+    for shard_path in shard_paths:
+        cur.execute("ATTACH DATABASE ? AS shard", (shard_path,))
+        try:
+            offset = cur.execute("SELECT coalesce(max(id), 0) FROM main.original").fetchone()[0]
+            cur.execute(
+                """
+            INSERT INTO
+                main.original(id, source, source_subset, data, accepted, oai_id, content_hash)
+            SELECT
+                id + ?, source, source_subset, data, accepted, oai_id, content_hash
+            FROM
+                shard.original
+            WHERE
+                true
+            ON CONFLICT(oai_id) DO NOTHING
+            """,
+                (offset,),
+            )
+            # Records whose original wasn't copied (as another shard had one with the same OAI ID)
+            # are skipped, like store_original skips them
+            cur.execute(
+                """
+            INSERT INTO
+                main.converted(data, original_id, oai_id, date, source, is_open_access, has_ssif_1, classification_level, events, modified)
+            SELECT
+                c.data, c.original_id + ?, c.oai_id, c.date, c.source, c.is_open_access, c.has_ssif_1, c.classification_level, c.events, c.modified
+            FROM
+                shard.converted c
+            JOIN
+                main.original o ON o.id = c.original_id + ?
+            WHERE
+                c.deleted = 0
+            ON CONFLICT(oai_id) DO UPDATE SET
+                data = excluded.data, original_id = excluded.original_id, oai_id = excluded.oai_id, date = excluded.date, source = excluded.source, is_open_access = excluded.is_open_access, has_ssif_1 = excluded.has_ssif_1, classification_level = excluded.classification_level, events = excluded.events, deleted = 0, should_be_reprocessed = 0
+            """,
+                (offset, offset),
+            )
+            cur.execute(
+                """
+            INSERT INTO
+                main.converted(data, original_id, oai_id, date, source, is_open_access, has_ssif_1, classification_level, events, deleted, modified)
+            SELECT
+                null, o.id, c.oai_id, c.date, c.source, c.is_open_access, c.has_ssif_1, c.classification_level, c.events, 1, c.modified
+            FROM
+                shard.converted c
+            LEFT JOIN
+                main.original o ON o.id = c.original_id + ?
+            WHERE
+                c.deleted = 1
+            ON CONFLICT(oai_id) DO UPDATE SET
+                oai_id = excluded.oai_id, data = null, deleted = 1, modified = excluded.modified
+            """,
+                (offset,),
+            )
+            # The shard's converted records (c) and the main database's (m), by the details' converted_id
+            converted_ids = """
+                shard.converted c ON c.id = d.converted_id
+            JOIN
+                main.converted m ON m.oai_id = c.oai_id AND m.original_id = c.original_id + ?
+            """
+            cur.execute(
+                f"""
+            INSERT INTO
+                main.converted_ssif_1(converted_id, value)
+            SELECT m.id, d.value FROM shard.converted_ssif_1 d JOIN {converted_ids}
+            """,
+                (offset,),
+            )
+            cur.execute(
+                f"""
+            INSERT OR REPLACE INTO
+                main.converted_flags(converted_id, source, date, validation, enrichment, normalization, audit, audit_true, audit_false)
+            SELECT
+                m.id, d.source, d.date, d.validation, d.enrichment, d.normalization, d.audit, d.audit_true, d.audit_false
+            FROM
+                shard.converted_flags d JOIN {converted_ids}
+            """,
+                (offset,),
+            )
+            cur.execute(
+                f"""
+            INSERT INTO
+                main.clusteringidentifiers(identifier, converted_id)
+            SELECT d.identifier, m.id FROM shard.clusteringidentifiers d JOIN {converted_ids}
+            """,
+                (offset,),
+            )
+            # A shard kept from an earlier harvest (see harvest._replace_shards) has rejections from a
+            # harvest the main database doesn't know about yet
+            cur.execute("INSERT OR IGNORE INTO main.harvest_history SELECT * FROM shard.harvest_history")
+            cur.execute(
+                """
+            INSERT INTO
+                main.rejected(harvest_id, oai_id, rejection_cause)
+            SELECT
+                harvest_id, oai_id, rejection_cause
+            FROM
+                shard.rejected
+            WHERE
+                harvest_id IN (SELECT id FROM main.harvest_history)
+            ORDER BY
+                id
+            """
+            )
+            if cur.execute("SELECT 1 FROM shard.sqlite_master WHERE name = 'compression_dictionary'").fetchone():
+                cur.execute(COMPRESSION_DICTIONARY_SCHEMA)
+                cur.execute("INSERT OR IGNORE INTO main.compression_dictionary SELECT * FROM shard.compression_dictionary")
+            # What the main database knew about the shard's source and records, for a shard kept from
+            # an earlier harvest (as in the main database, the first local ID/ORCID pair kept wins)
+            cur.execute(
+                "INSERT INTO main.last_harvest SELECT * FROM shard.last_harvest WHERE true ON CONFLICT(source) DO NOTHING"
+            )
+            cur.execute(
+                """
+            INSERT INTO
+                main.localid_to_orcid(source_oai_id, cache_key, orcid)
+            SELECT
+                source_oai_id, cache_key, orcid
+            FROM
+                shard.localid_to_orcid
+            WHERE
+                true
+            ON CONFLICT(cache_key) DO NOTHING
+            """
+            )
+            cur.execute(
+                """
+            INSERT INTO
+                main.enriched_from_other_record(source_oai_id, enriched_oai_id)
+            SELECT
+                source_oai_id, enriched_oai_id
+            FROM
+                shard.enriched_from_other_record
+            """
+            )
+            connection.commit()
+        finally:
+            connection.rollback()
+            cur.execute("DETACH DATABASE shard")
+
+
+# The tables, indexes and triggers of the schema, as (type, name, sql), in schema order. Read from a
+# scratch database so that schema.sql remains the one definition of the schema.
+def _schema_objects():
+    with closing(sqlite3.connect(":memory:")) as con:
+        with open(SQL_SCHEMA_FILE, "r") as sql_schema_file:
+            con.executescript(sql_schema_file.read())
+        # Automatic indexes (for UNIQUE constraints etc.) have no SQL and are always there
+        return con.execute("SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY rowid").fetchall()
+
+
+# The indexes and triggers of the schema
+def _deferred_schema():
+    return [(type_, name, sql) for type_, name, sql in _schema_objects() if type_ in ("index", "trigger")]
+
+
+# Create the indexes and triggers left out by clean_and_init_storage(defer_indexes=True). Does
+# nothing for those that exist, so it's also safe for a database whose full harvest was interrupted.
+def create_deferred_indexes(connection):
+    cur = connection.cursor()
+    existing = {name for (name,) in cur.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+    missing = [(type_, name, sql) for type_, name, sql in _deferred_schema() if name not in existing]
+    if not missing:
+        return
+    # Lets SQLite sort with helper threads when creating an index
+    cur.execute(f"PRAGMA threads={INDEX_THREADS}")
+    for type_, name, sql in missing:
+        if type_ == "index":
+            cur.execute(sql)
+    if any(type_ == "trigger" for type_, _, _ in missing):
+        # Without the triggers, a record that was stored and then marked as deleted (see
+        # store_original) kept its details; remove_converted_stuff_on_deleted would have removed them.
+        # (The other tables it cleans up are only filled after the harvest.)
+        for table in ["converted_flags", "converted_ssif_1", "clusteringidentifiers"]:
+            cur.execute(f"DELETE FROM {table} WHERE converted_id IN (SELECT id FROM converted WHERE deleted = 1)")
+        for type_, name, sql in missing:
+            if type_ == "trigger":
+                cur.execute(sql)
+    connection.commit()
+    log.info(f"Created {len(missing)} deferred indexes and triggers")
+
+
+# Databases created before content hashes lack the column
+def init_content_hashes(cursor):
+    if "content_hash" not in [row[1] for row in cursor.execute("PRAGMA table_info(original)")]:
+        cursor.execute("ALTER TABLE original ADD COLUMN content_hash TEXT")
+
+
+# Databases created before the packed record flags (see pipeline.recordflags) have a
+# converted_record_info table instead, with a row per field status and audit event; the flags are
+# packed from those. The trigger cleaning up after deleted records is recreated, and the new index
+# created, by create_deferred_indexes.
+def init_converted_flags(cursor):
+    tables = [row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    if "converted_flags" in tables:
+        return
+    for type_, name, sql in _schema_objects():
+        if type_ == "table" and name == "converted_flags":
+            cursor.execute(sql)
+    if "converted_record_info" not in tables:
+        return
+
+    def field_flags(column):
+        return " + ".join(
+            f"SUM(CASE WHEN field_name = '{field}' THEN ({column}_status + 1) << {field_shift(field)} ELSE 0 END)"
+            for field in FLAG_FIELDS
+        )
+
+    # An audit code occurs once per record, but just in case: DISTINCT, as the bit values are the same
+    def audit_flags(condition):
+        return "SUM(DISTINCT CASE " + " ".join(
+            f"WHEN audit_code = '{code}'{condition} THEN {audit_bit(code)}" for code in AUDIT_CODES
+        ) + " ELSE 0 END)"
+
+    cursor.execute(
+        f"""
+        INSERT INTO converted_flags(
+            converted_id, source, date, validation, enrichment, normalization, audit, audit_true, audit_false
+        )
+        SELECT
+            converted_id, MAX(source), MAX(date),
+            {field_flags("validation")},
+            {field_flags("enrichment")},
+            {field_flags("normalization")},
+            {audit_flags("")},
+            {audit_flags(" AND audit_result = 1")},
+            {audit_flags(" AND audit_result = 0")}
+        FROM
+            converted_record_info
+        GROUP BY
+            converted_id
+        """
+    )
+    cursor.execute("DROP TABLE converted_record_info")
+    cursor.execute("DROP TRIGGER IF EXISTS remove_converted_stuff_on_deleted")
+
+
+# The stored content hashes (see pipeline.oai.Record.content_hash) of those of the records that
+# have been harvested from `source` before, and accepted, as {oai_id: content_hash}. (Rejected ones
+# are handled again, which is cheap, so that each harvest counts, and keeps, its rejections.)
+def get_content_hashes(oai_ids, source, cursor):
+    oai_ids = list(oai_ids)
+    if not oai_ids:
+        return {}
+    return dict(
+        cursor.execute(
+            f"SELECT oai_id, content_hash FROM original WHERE source = ? AND accepted AND oai_id IN ({', '.join('?' * len(oai_ids))})",
+            [source, *oai_ids],
+        )
+    )
+
+
+def init_harvest_checkpoints(cursor):
+    cursor.execute(HARVEST_CHECKPOINT_SCHEMA)
+
+
+def save_harvest_checkpoint(
+    source,
+    source_subset,
+    window_from,
+    window_until,
+    harvest_start,
+    harvest_from,
+    resumption_token,
+    datestamp,
+    completed,
+    connection,
+):
+    connection.execute(
+        """
+    INSERT INTO
+        harvest_checkpoint(
+            source, source_subset, window_from, window_until, harvest_start, harvest_from, resumption_token, datestamp, completed
+        )
+    VALUES
+        (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(source, source_subset, window_from) DO UPDATE SET
+        window_until = excluded.window_until,
+        harvest_start = excluded.harvest_start,
+        harvest_from = excluded.harvest_from,
+        resumption_token = excluded.resumption_token,
+        datestamp = excluded.datestamp,
+        completed = excluded.completed
+    """,
+        (
+            source,
+            source_subset,
+            window_from or "",
+            window_until,
+            harvest_start,
+            harvest_from,
+            resumption_token,
+            datestamp,
+            int(completed),
+        ),
+    )
+    connection.commit()
+
+
+# Returns the checkpoints of a source by subset, each a list ordered by window
+def get_harvest_checkpoints(source, connection):
+    cur = connection.cursor()
+    cur.row_factory = dict_factory
+    checkpoints = {}
+    for row in cur.execute(
+        "SELECT * FROM harvest_checkpoint WHERE source = ? ORDER BY source_subset, window_from", (source,)
+    ):
+        row["window_from"] = row["window_from"] or None
+        checkpoints.setdefault(row["source_subset"], []).append(row)
+    return checkpoints
+
+
+def delete_harvest_checkpoints(source, connection):
+    connection.execute("DELETE FROM harvest_checkpoint WHERE source = ?", (source,))
 
 
 def store_original(
@@ -61,7 +516,10 @@ def store_original(
     incremental,
     min_level_errors,
     harvest_id,
+    commit=True,
+    content_hash=None,
 ):
+    # commit=False leaves the transaction open, for writing many records in one transaction
     cur = connection.cursor()
     deleted_from_db = False
     if incremental:
@@ -93,7 +551,8 @@ def store_original(
             )
 
     if deleted:
-        connection.commit()
+        if commit:
+            connection.commit()
         return None, deleted_from_db
 
     if not accepted:
@@ -103,39 +562,124 @@ def store_original(
         )
 
     # It *shouldn't* happen that an OAI ID occurs twice in the same dataset, but it can happen...
-    original_rowid = cur.execute(
+    cur.execute(
         """
     INSERT INTO
-        original(source, source_subset, data, accepted, oai_id)
+        original(source, source_subset, data, accepted, oai_id, content_hash)
     VALUES
-        (?, ?, ?, ?, ?)
+        (?, ?, ?, ?, ?, ?)
     ON CONFLICT(oai_id) DO NOTHING
     """,
-        (source, source_subset, original, accepted, oai_id),
-    ).lastrowid
+        (source, source_subset, compress("xml", original), accepted, oai_id, content_hash),
+    )
+    # When nothing is inserted, lastrowid is that of the connection's previous insert
+    original_rowid = cur.lastrowid if cur.rowcount == 1 else None
 
     # ...and in the rare case that it does happen, we skip this record
     if not original_rowid:
-        connection.commit()
+        if commit:
+            connection.commit()
         return None, False
 
-    connection.commit()
+    if commit:
+        connection.commit()
     return original_rowid, deleted_from_db
 
 
+# Deleted records aren't always reported by sources, so for those we compare their current list
+# of OAI IDs to what we have. The IDs are collected into a temporary table, private to the
+# connection (and kept in memory, see _set_pragmas), so that the comparison can be one statement.
+def load_harvested_ids(oai_ids, connection):
+    connection.execute("CREATE TEMP TABLE IF NOT EXISTS harvested_ids (oai_id TEXT PRIMARY KEY)")
+    connection.execute("DELETE FROM temp.harvested_ids")
+    connection.executemany(
+        "INSERT OR IGNORE INTO temp.harvested_ids(oai_id) VALUES (?)", ((oai_id,) for oai_id in oai_ids)
+    )
+
+
+# Delete the records from `source` that weren't among the loaded IDs. Returns the number of
+# deleted records; the caller commits.
+def delete_records_not_harvested(source, connection):
+    return connection.execute(
+        """
+    DELETE FROM
+        original
+    WHERE
+        source = ?
+        AND NOT EXISTS (SELECT 1 FROM temp.harvested_ids WHERE harvested_ids.oai_id = original.oai_id)
+    """,
+        (source,),
+    ).rowcount
+
+
+def drop_harvested_ids(connection):
+    connection.execute("DROP TABLE IF EXISTS temp.harvested_ids")
+
+
 def serialize(obj):
     if isinstance(obj, Enum):
         return str(obj)
     return obj.__dict__
 
 
-def store_converted(original_rowid, converted, audit_events, field_events, record_info, connection, clear_record_info=False, original_converted_id=None):
+# Rows for the tables with details about converted records (SSIF codes, field/audit flags and
+# clustering identifiers). They're inserted with one executemany per table, for one record or, to
+# save more statements, for all records stored in a transaction (see store_converted).
+class ConvertedDetailRows:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ssif_1 = []
+        self.flags = []
+        self.identifiers = []
+        # The records the rows are for
+        self.oai_ids = set()
+
+    def __len__(self):
+        return len(self.ssif_1) + len(self.flags) + len(self.identifiers)
+
+    def extend(self, other):
+        self.ssif_1.extend(other.ssif_1)
+        self.flags.extend(other.flags)
+        self.identifiers.extend(other.identifiers)
+        self.oai_ids.update(other.oai_ids)
+
+    def write(self, connection):
+        cur = connection.cursor()
+        cur.executemany(
+            """
+        INSERT INTO converted_ssif_1(converted_id, value) VALUES(?, ?)
+        """,
+            self.ssif_1,
+        )
+        cur.executemany(
+            """
+        INSERT OR REPLACE INTO converted_flags(
+            converted_id, source, date, validation, enrichment, normalization, audit, audit_true, audit_false
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            self.flags,
+        )
+        cur.executemany(
+            """
+        INSERT INTO clusteringidentifiers(identifier, converted_id) VALUES (?, ?)
+        """,
+            self.identifiers,
+        )
+        self.clear()
+
+
+# detail_rows: if given (a ConvertedDetailRows), the record's detail rows are added to it instead of
+# being written, to be written together with those of other records. They must be written before
+# anything else is stored for a record they contain (its old details are deleted when it is).
+def store_converted(original_rowid, converted, audit_events, field_events, record_info, connection, clear_record_info=False, original_converted_id=None, commit=True, detail_rows=None):
     try:
         cur = connection.cursor()
-        # If a we're reprocessing a record, clear its converted_record_info data, otherwise that data
-        # will be duplicated and the processing stats will be wrong
+        # If a we're reprocessing a record, clear its converted_flags data, otherwise stale flags
+        # could remain and the processing stats will be wrong
         if clear_record_info and original_converted_id:
-            cur.execute("DELETE FROM converted_record_info WHERE converted_id = ?", [original_converted_id])
+            cur.execute("DELETE FROM converted_flags WHERE converted_id = ?", [original_converted_id])
 
         doc = BibframeSource(converted)
         converted_events = {"audit_events": audit_events, "field_events": field_events}
@@ -150,7 +694,7 @@ def store_converted(original_rowid, converted, audit_events, field_events, recor
             data = excluded.data, original_id = excluded.original_id, oai_id = excluded.oai_id, date = excluded.date, source = excluded.source, is_open_access = excluded.is_open_access, has_ssif_1 = excluded.has_ssif_1, classification_level = excluded.classification_level, events = excluded.events, deleted = 0, should_be_reprocessed = 0
         """,
             (
-                json.dumps(converted),
+                compress("json", json.dumps(converted)),
                 original_rowid,
                 doc.record_id,
                 doc.publication_just_the_year,
@@ -158,7 +702,7 @@ def store_converted(original_rowid, converted, audit_events, field_events, recor
                 doc.open_access,
                 (len(doc.ssif_1_codes) > 0),
                 doc.level,
-                json.dumps(converted_events, default=serialize) #default=lambda o: o.__dict__),
+                compress("events", json.dumps(converted_events, default=serialize)), #default=lambda o: o.__dict__),
             ),
         )
 
@@ -167,47 +711,14 @@ def store_converted(original_rowid, converted, audit_events, field_events, recor
             "SELECT id FROM converted WHERE oai_id = ?", [doc.record_id]
         ).fetchone()[0]
 
-        for ssif_1 in doc.ssif_1_codes:
-            cur.execute(
-                """
-            INSERT INTO converted_ssif_1(converted_id, value) VALUES(?, ?)
-            """,
-                (converted_rowid, ssif_1,)
-            )
+        rows = ConvertedDetailRows()
+        rows.oai_ids.add(doc.record_id)
+        source = doc.source_org_master
+        date = doc.publication_just_the_year
 
-        for field, value in record_info.items():
-            cur.execute(
-                """
-            INSERT INTO converted_record_info(
-                converted_id, source, date, field_name, validation_status, enrichment_status, normalization_status
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-                (
-                    converted_rowid,
-                    doc.source_org_master,
-                    doc.publication_just_the_year,
-                    field,
-                    int(value["validation_status"]),
-                    int(value["enrichment_status"]),
-                    int(value["normalization_status"]),
-                ),
-            )
+        rows.ssif_1 = [(converted_rowid, ssif_1) for ssif_1 in doc.ssif_1_codes]
 
-        for name, events in audit_events.items():
-            for event in events:
-                cur.execute(
-                    """
-                INSERT INTO converted_record_info(converted_id, source, date, audit_code, audit_result, audit_name) VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                    (
-                        converted_rowid,
-                        doc.source_org_master,
-                        doc.publication_just_the_year,
-                        event.get("code", None),
-                        event.get("result", None),
-                        name
-                    ),
-                )
+        rows.flags = [(converted_rowid, source, date, *pack_record_flags(record_info, audit_events))]
 
         identifiers = []
 
@@ -238,29 +749,72 @@ def store_converted(original_rowid, converted, audit_events, field_events, recor
                 degraded = "".join([c for c in ending if c in vowels]).lower()
                 identifiers.append(degraded)
 
-        for identifier in identifiers:
-            if len(identifier) > 4:
-                cur.execute(
-                    """
-                INSERT INTO clusteringidentifiers(identifier, converted_id) VALUES (?, ?)
-                """,
-                    (identifier, converted_rowid),
-                )
+        rows.identifiers = [(identifier, converted_rowid) for identifier in identifiers if len(identifier) > 4]
 
-        connection.commit()
+        if detail_rows is not None:
+            detail_rows.extend(rows)
+        else:
+            rows.write(connection)
+
+        if commit:
+            connection.commit()
         return converted_rowid
     except Exception as e:
         log.warning(f"Failed saving converted record for original_rowid {original_rowid} ({doc.record_id})")
         raise e
 
 
-def get_connection():
-    connection = sqlite3.connect(get_sqlite_path())
+# A new connection to the database, for when the one get_connection returns can't be shared, e.g.
+# for long transactions
+def connect(sqlite_path=None):
+    sqlite_path = sqlite_path or get_sqlite_path()
+    connection = sqlite3.connect(sqlite_path, cached_statements=CACHED_STATEMENTS)
     cursor = connection.cursor()
     _set_pragmas(cursor)
+    if background_checkpointing(sqlite_path):
+        # See pipeline.walcheckpointer
+        cursor.execute("PRAGMA wal_autocheckpoint=0")
+    # Compressed columns (see pipeline.compression) are read with decompress()
+    register_decompress(connection, sqlite_path)
     return connection
 
 
+# get_connection keeps one connection per database for each process and thread (a connection can't
+# be used by another thread, nor by a forked process), so that the same prepared statements are
+# reused instead of connecting and setting the pragmas again. Use it with `with`, which commits (or
+# rolls back) but doesn't close it, and don't leave a transaction open.
+_connections = threading.local()
+
+
+def _process_connections():
+    if getattr(_connections, "pid", None) != os.getpid():
+        # Connections inherited from the parent process must be neither used nor closed here (see
+        # https://www.sqlite.org/howtocorrupt.html#_carrying_an_open_database_connection_across_a_fork_),
+        # so they're just kept
+        _inherited_connections.extend(getattr(_connections, "by_path", {}).values())
+        _connections.pid = os.getpid()
+        _connections.by_path = {}
+    return _connections.by_path
+
+
+_inherited_connections = []
+
+
+def get_connection():
+    sqlite_path = get_sqlite_path()
+    connections = _process_connections()
+    if sqlite_path not in connections:
+        connections[sqlite_path] = connect(sqlite_path)
+    return connections[sqlite_path]
+
+
+# Close this thread's connection to the database (e.g. before the file is replaced)
+def close_connection(sqlite_path=None):
+    connection = _process_connections().pop(sqlite_path or get_sqlite_path(), None)
+    if connection is not None:
+        connection.close()
+
+
 def dict_factory(cursor, row):
     d = {}
     for idx, col in enumerate(cursor.description):
@@ -1,3 +1,7 @@
+from io import StringIO
+
+from lxml import etree
+
 from pipeline.validate import _minimum_level_checker
 
 MODS = """
@@ -32,6 +36,12 @@ def test_min_level_with_empty_publication():
     assert error_codes == expected_errors
 
 
+def test_min_level_with_parsed_xml():
+    data = MODS("")
+    errors = _minimum_level_checker(etree.parse(StringIO(data)))
+    assert [error.text for error in errors.getroot()] == _get_error_names(data)
+
+
 def test_empty_mods():
     data = """
       <record xmlns="http://www.openarchives.org/OAI/2.0/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
@@ -1,6 +1,8 @@
 import re
+from io import StringIO
+
 import pytest
-from lxml.etree import LxmlError, XMLSyntaxError
+from lxml.etree import LxmlError, XMLSyntaxError, parse
 from pipeline.util import SSIF_SCHEME, SSIF_BASE
 
 MODS = """
@@ -550,6 +552,16 @@ def test_parser_handles_invalid_xml(parser):
         parser.parse_mods('next(self.records).raw')
 
 
+def test_parser_accepts_parsed_xml(parser):
+    raw_xml = MODS("""
+      <titleInfo><title>Bamse</title><subTitle>Världens starkaste björn</subTitle></titleInfo>
+      <relatedItem type="host"><titleInfo><title>ISKO</title></titleInfo></relatedItem>
+    """)
+    tree = parse(StringIO(raw_xml))
+    assert parser.parse_mods(tree) == parser.parse_mods(raw_xml)
+    assert parser.parse_mods(tree.getroot()) == parser.parse_mods(raw_xml)
+
+
 def test_host_title_is_extracted(parser):
     raw_xml = MODS("""
       <relatedItem type="host">
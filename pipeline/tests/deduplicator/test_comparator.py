@@ -1,5 +1,8 @@
-from pipeline.deduplicate import is_considered_similar_enough
+import orjson
+
+from pipeline.deduplicate import _check_candidate_groups, is_considered_similar_enough
 from pipeline.publication import Publication
+from pipeline.storage import clean_and_init_storage, get_connection
 from pipeline.util import empty_string
 
 
@@ -228,3 +231,27 @@ def _get_test_data_publication(
         del publication_dict["instanceOf"]["hasTitle"][0]["subtitle"]
 
     return Publication(publication_dict)
+
+
+def test_check_candidate_groups(
+    tmp_path,
+    monkeypatch,
+    master,
+    candidate1_same_title_and_same_doi,
+    candidate2_different_title_and_same_pmid,
+):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    clean_and_init_storage()
+    with get_connection() as con:
+        con.executemany(
+            "INSERT INTO converted(id, oai_id, data) VALUES (?, ?, ?)",
+            [
+                (i, f"oai:test:{i}", orjson.dumps(publication.body))
+                for i, publication in [
+                    (9, master),
+                    (10, candidate1_same_title_and_same_doi),
+                    (11, candidate2_different_title_and_same_pmid),
+                ]
+            ],
+        )
+    assert _check_candidate_groups([["9", "10", "11"]]) == [("9", "10"), ("10", "9")]
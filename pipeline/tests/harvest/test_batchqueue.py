@@ -0,0 +1,176 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue
+
+import pytest
+
+from pipeline import harvest
+from pipeline.batchqueue import BatchQueue, BatchProducer, BatchesLost
+from pipeline.harvestmanager import HarvestManager
+
+
+def _in_thread(target):
+    done = threading.Event()
+
+    def run():
+        target()
+        done.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    return done
+
+
+def test_put_takes_producers_in_turn():
+    queue = BatchQueue(max_in_flight=4, max_queued=1)
+    admitted = []
+    assert queue.put("a") == (0, 1)
+    # Queue full: a asks first, then b and c, and they're let in in that order as the workers take batches
+    threads = []
+    for key in ["a", "b", "c"]:
+        threads.append(_in_thread(lambda key=key: admitted.append((key, queue.put(key)))))
+        time.sleep(0.05)
+    assert admitted == []
+    for _ in range(3):
+        queue.started("?")
+        time.sleep(0.05)
+    assert all(thread.wait(1) for thread in threads)
+    assert admitted == [("a", (1, 2)), ("b", (0, 1)), ("c", (0, 1))]
+
+
+def test_put_blocks_until_done():
+    queue = BatchQueue(max_in_flight=1, max_queued=4)
+    assert queue.put("a") == (0, 1)
+    queue.started("a")
+    put_done = _in_thread(lambda: queue.put("a"))
+    assert not put_done.wait(0.1)
+    # Other producers are not affected
+    assert queue.put("b") == (0, 1)
+    queue.done("a", 0)
+    assert put_done.wait(1)
+
+
+def test_join_waits_for_processing():
+    queue = BatchQueue(max_in_flight=2, max_queued=2)
+    queue.put("a")
+    queue.put("b")
+    joined = _in_thread(lambda: queue.join("a"))
+    queue.started("a")
+    assert not joined.wait(0.1)
+    queue.done("a", 0)
+    assert joined.wait(1)
+    queue.join("never-used")
+
+
+def test_fail_releases_waiting_producers():
+    queue = BatchQueue(max_in_flight=1, max_queued=4)
+    queue.put("a")
+    queue.put("b")
+    raised = []
+
+    def wait(call):
+        try:
+            call()
+        except BatchesLost as e:
+            raised.append(str(e))
+
+    put_failed = _in_thread(lambda: wait(lambda: queue.put("a")))
+    join_failed = _in_thread(lambda: wait(lambda: queue.join("b")))
+    assert not put_failed.wait(0.1)
+    queue.fail("worker died")
+    assert put_failed.wait(1) and join_failed.wait(1)
+    assert raised == ["worker died", "worker died"]
+    with pytest.raises(BatchesLost):
+        queue.put("c")
+    # Batches that were done after all don't matter
+    queue.done("a", 0)
+
+
+def test_lose_fails_only_its_producer():
+    queue = BatchQueue(max_in_flight=4, max_queued=4)
+    for key in ["a", "a", "b"]:
+        queue.put(key)
+    queue.lose("a", 0, "not stored")
+    queue.done("a", 1)
+    # The lost batch is never completed
+    assert queue.completed("a") == 0
+    with pytest.raises(BatchesLost, match="not stored"):
+        queue.put("a")
+    with pytest.raises(BatchesLost, match="not stored"):
+        queue.join("a")
+    queue.done("b", 0)
+    queue.join("b")
+    assert queue.put("b") == (0, 1)
+
+
+def test_producer_summary():
+    queue = BatchQueue(max_in_flight=2, max_queued=2)
+    payloads = Queue()
+    producer = BatchProducer(queue, payloads, "a", 2)
+    producer.put(1)
+    producer.put(2)
+    assert producer.submitted == 2
+    assert producer.max_depth == 2
+    assert producer.average_depth == 1.5
+    for _ in range(2):
+        key, seq, _ = payloads.get()
+        queue.started(key)
+        queue.done(key, seq)
+    producer.join()
+    assert producer.summary().startswith("2 batches, on average 1.5 (max 2) of at most 2 in flight")
+
+
+def test_completed_counts_batches_without_gaps():
+    queue = BatchQueue(max_in_flight=4, max_queued=4)
+    for _ in range(3):
+        queue.put("a")
+    queue.done("a", 1)
+    queue.done("a", 2)
+    assert queue.completed("a") == 0
+    queue.done("a", 0)
+    assert queue.completed("a") == 3
+
+
+def test_producer_checkpoints():
+    queue = BatchQueue(max_in_flight=4, max_queued=4)
+    payloads = Queue()
+    producer = BatchProducer(queue, payloads, "a", 4)
+    producer.put(1, checkpoint="page1")
+    producer.put(2)
+    producer.put(3, checkpoint="page2")
+    assert producer.completed_checkpoint() is None
+    items = [payloads.get() for _ in range(3)]
+    assert [batch for _, _, batch in items] == [1, 2, 3]
+    queue.done("a", items[0][1])
+    assert producer.completed_checkpoint() == "page1"
+    queue.done("a", items[2][1])
+    assert producer.completed_checkpoint() is None
+    queue.done("a", items[1][1])
+    assert producer.completed_checkpoint() == "page2"
+    assert producer.completed_checkpoint() is None
+
+
+def _die(source, batch):
+    os._exit(1)
+
+
+def test_dead_record_worker_fails_the_sources(monkeypatch):
+    manager = HarvestManager()
+    manager.start()
+    try:
+        harvest_cache = {"batch_queue": manager.BatchQueue(2, 2), "batch_payloads": multiprocessing.Queue()}
+        harvest.init(threading.Lock(), harvest_cache, {}, logging.getLogger(), False, Queue())
+        monkeypatch.setattr(harvest, "handle_harvested", _die)
+        producer = BatchProducer(harvest_cache["batch_queue"], harvest_cache["batch_payloads"], "a", 2)
+        initargs = (None, harvest_cache, {}, None, False)
+        with ProcessPoolExecutor(max_workers=1, initializer=harvest.init, initargs=initargs) as executor:
+            executor.submit(harvest.record_worker).add_done_callback(harvest._record_worker_done)
+            producer.put(("a", "", "harvest", []))
+            # Rather than waiting forever for the batch
+            with pytest.raises(BatchesLost):
+                producer.join()
+    finally:
+        manager.shutdown()
@@ -0,0 +1,82 @@
+import orjson as json
+import pytest
+
+from pipeline import compression
+from pipeline.compression import compress, prepare_compression, reset_compression
+from pipeline.storage import clean_and_init_storage, connect, get_connection
+
+
+@pytest.fixture
+def compressing(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    monkeypatch.setenv("SWEPUB_COMPRESS", "1")
+    monkeypatch.setattr(compression, "TRAINING_SAMPLES", 200)
+    monkeypatch.setattr(compression, "_samples", compression.defaultdict(list))
+    clean_and_init_storage()
+    reset_compression()
+    yield
+    reset_compression()
+
+
+def _doc(i):
+    return json.dumps({"@id": f"https://example.org/{i}", "title": f"Publication number {i}", "year": 2000 + i % 20})
+
+
+def test_not_compressed_by_default(monkeypatch):
+    monkeypatch.delenv("SWEPUB_COMPRESS", raising=False)
+    assert compress("json", _doc(1)) == _doc(1)
+
+
+def test_compressed_after_training(compressing):
+    with get_connection() as con:
+        prepare_compression(con)
+        # Stored as they are until there are enough samples to train a dictionary on
+        untrained = [compress("json", _doc(i)) for i in range(200)]
+        assert untrained == [_doc(i) for i in range(200)]
+        prepare_compression(con)
+        assert con.execute("SELECT kind FROM compression_dictionary").fetchall() == [("json",)]
+
+        compressed = compress("json", _doc(1000))
+        assert compressed.startswith(compression.ZSTD_MAGIC)
+        assert len(compressed) < len(_doc(1000))
+
+        con.executemany("INSERT INTO finalized(oai_id, data) VALUES (?, ?)", [("a", untrained[0]), ("b", compressed)])
+        con.commit()
+
+    with get_connection() as con:
+        rows = con.execute("SELECT oai_id, decompress(data) FROM finalized ORDER BY oai_id").fetchall()
+        assert [(oai_id, json.loads(data)) for oai_id, data in rows] == [
+            ("a", json.loads(_doc(0))),
+            ("b", json.loads(_doc(1000))),
+        ]
+        assert con.execute("SELECT decompress(NULL), decompress('<xml/>')").fetchone() == (None, "<xml/>")
+
+
+def test_rolled_back_dictionary_is_not_used(compressing):
+    with get_connection() as con:
+        for i in range(200):
+            compress("xml", f"<record><id>{i}</id></record>")
+        prepare_compression(con)
+        con.rollback()
+        reset_compression()
+
+        prepare_compression(con)
+        assert compress("xml", "<record/>") == "<record/>"
+
+
+def test_dictionaries_are_saved_to_each_database(compressing, tmp_path):
+    other_path = str(tmp_path / "other.sqlite3")
+    clean_and_init_storage(sqlite_path=other_path)
+    with get_connection() as con:
+        for i in range(200):
+            compress("json", _doc(i))
+        prepare_compression(con)
+        con.commit()
+    compressed = compress("json", _doc(1000))
+
+    with connect(other_path) as con:
+        # Written to with the dictionary the process already has
+        prepare_compression(con)
+        con.execute("INSERT INTO finalized(oai_id, data) VALUES ('a', ?)", (compressed,))
+        con.commit()
+        assert json.loads(con.execute("SELECT decompress(data) FROM finalized").fetchone()[0]) == json.loads(_doc(1000))
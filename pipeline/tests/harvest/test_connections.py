@@ -0,0 +1,50 @@
+import multiprocessing
+import threading
+
+from pipeline.storage import clean_and_init_storage, connect, get_connection
+
+
+def _connection_id(queue):
+    queue.put(id(get_connection()))
+
+
+def test_connection_is_reused(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    clean_and_init_storage()
+    connection = get_connection()
+    with get_connection() as con:
+        assert con is connection
+        con.execute("INSERT INTO last_harvest(source, last_successful_harvest) VALUES ('a', '2020-01-01')")
+    # `with` committed it
+    assert connect().execute("SELECT source FROM last_harvest").fetchall() == [("a",)]
+
+    # Each database has its own
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "other.sqlite3"))
+    clean_and_init_storage()
+    assert get_connection() is not connection
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    assert get_connection() is connection
+
+    # A new database file gets a new connection
+    clean_and_init_storage()
+    assert get_connection() is not connection
+    assert not get_connection().execute("SELECT * FROM last_harvest").fetchall()
+
+
+def test_connection_per_thread_and_process(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    clean_and_init_storage()
+    connection = get_connection()
+
+    in_thread = []
+    thread = threading.Thread(target=lambda: in_thread.append(get_connection()))
+    thread.start()
+    thread.join()
+    assert in_thread[0] is not connection
+
+    queue = multiprocessing.get_context("fork").Queue()
+    process = multiprocessing.get_context("fork").Process(target=_connection_id, args=(queue,))
+    process.start()
+    child_connection_id = queue.get(timeout=10)
+    process.join()
+    assert child_connection_id != id(connection)
@@ -0,0 +1,34 @@
+from pipeline.oai import Record
+from pipeline.storage import clean_and_init_storage, get_connection, get_content_hashes, init_content_hashes
+
+RECORD = """<record xmlns="http://www.openarchives.org/OAI/2.0/">
+<header><identifier>oai:a:1</identifier><datestamp>{datestamp}</datestamp><setSpec>{set}</setSpec></header>
+<metadata><mods xmlns="http://www.loc.gov/mods/v3"><titleInfo><title>{title}</title></titleInfo></mods></metadata>
+</record>"""
+
+
+def _hash(datestamp="2020-01-01", set="a", title="Title"):
+    return Record("oai:a:1", False, RECORD.format(datestamp=datestamp, set=set, title=title)).content_hash
+
+
+def test_content_hash_ignores_header():
+    assert _hash() == _hash(datestamp="2021-02-02", set="b")
+    assert _hash() != _hash(title="Other title")
+
+
+def test_get_content_hashes(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    clean_and_init_storage()
+    with get_connection() as con:
+        # Adding the column again is a no-op
+        init_content_hashes(con.cursor())
+        con.executemany(
+            "INSERT INTO original(source, source_subset, oai_id, accepted, data, content_hash) VALUES (?, '', ?, ?, '', ?)",
+            [("a", "oai:a:1", 1, "hash1"), ("a", "oai:a:2", 1, None), ("b", "oai:b:1", 1, "hash2"), ("a", "oai:a:4", 0, "hash4")],
+        )
+        # Rejected records are handled again (and counted as rejected in each harvest)
+        assert get_content_hashes(["oai:a:1", "oai:a:2", "oai:a:3", "oai:a:4", "oai:b:1"], "a", con.cursor()) == {
+            "oai:a:1": "hash1",
+            "oai:a:2": None,
+        }
+        assert get_content_hashes([], "a", con.cursor()) == {}
@@ -0,0 +1,20 @@
+from datetime import date
+
+from pipeline.oai import date_windows
+
+
+def test_date_windows():
+    assert date_windows(date(2000, 1, 1), date(2000, 1, 30), 3) == [
+        (None, "2000-01-10"),
+        ("2000-01-11", "2000-01-20"),
+        ("2000-01-21", None),
+    ]
+
+
+def test_single_date_window():
+    assert date_windows(date(2000, 1, 1), date(2020, 1, 1), 1) == [(None, None)]
+
+
+def test_no_more_date_windows_than_days():
+    assert date_windows(date(2000, 1, 1), date(2000, 1, 2), 5) == [(None, "2000-01-01"), ("2000-01-02", None)]
+    assert date_windows(date(2000, 1, 1), date(2000, 1, 1), 5) == [(None, None)]
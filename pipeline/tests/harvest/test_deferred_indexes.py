@@ -0,0 +1,32 @@
+from pipeline.storage import clean_and_init_storage, create_deferred_indexes, get_connection
+
+
+def _schema(con, type_):
+    return {name for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type = ? AND sql IS NOT NULL", (type_,))}
+
+
+def test_deferred_indexes(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "full.sqlite3"))
+    clean_and_init_storage()
+    with get_connection() as con:
+        indexes, triggers = _schema(con, "index"), _schema(con, "trigger")
+    assert "idx_converted_source" in indexes
+    assert triggers == {"set_deleted_on_converted", "remove_converted_stuff_on_deleted"}
+
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "deferred.sqlite3"))
+    clean_and_init_storage(defer_indexes=True)
+    with get_connection() as con:
+        assert not _schema(con, "index") and not _schema(con, "trigger")
+        # Stored, and then marked as deleted, while there were no triggers
+        con.execute("INSERT INTO converted(id, oai_id, data) VALUES (1, 'oai:a:1', '{}'), (2, 'oai:a:2', '{}')")
+        con.execute("INSERT INTO converted_ssif_1(converted_id, value) VALUES (1, '101'), (2, '102')")
+        con.execute("UPDATE converted SET deleted = 1 WHERE id = 1")
+        con.commit()
+
+        create_deferred_indexes(con)
+        assert _schema(con, "index") == indexes
+        assert _schema(con, "trigger") == triggers
+        assert con.execute("SELECT converted_id FROM converted_ssif_1").fetchall() == [(2,)]
+
+        # Nothing left to do
+        create_deferred_indexes(con)
@@ -0,0 +1,157 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from pipeline.hostscheduler import HostScheduler, interleave_by_host, MIN_LIMIT
+from pipeline.sickle import Sickle
+
+
+def _source(code, url):
+    return {"code": code, "sets": [{"url": url}]}
+
+
+def test_interleave_by_host():
+    sources = [
+        _source("a", "https://diva.example/oai"),
+        _source("b", "https://diva.example/oai"),
+        _source("c", "https://diva.example/oai"),
+        _source("d", "https://other.example/oai"),
+        _source("e", "https://third.example/oai"),
+        _source("f", "https://other.example/oai"),
+    ]
+    assert [s["code"] for s in interleave_by_host(sources)] == ["a", "d", "e", "b", "f", "c"]
+
+
+def test_limit_increases_additively():
+    scheduler = HostScheduler(initial_limit=2, max_limit=4)
+    for _ in range(10):
+        scheduler.acquire("host")
+        scheduler.release("host", 0.1)
+    assert scheduler.limits() == {"host": 4}
+
+
+def test_limit_decreases_when_throttled():
+    scheduler = HostScheduler(initial_limit=8, max_limit=8)
+    scheduler.acquire("host")
+    scheduler.release("host", 10)
+    scheduler.acquire("host")
+    scheduler.release("host", 10, throttled=True)
+    assert scheduler.limits() == {"host": 4}
+    # Within the same round trip, so part of the same congestion event
+    scheduler.acquire("host")
+    scheduler.release("host", 10, throttled=True)
+    assert scheduler.limits() == {"host": 4}
+
+
+def test_limit_decreases_on_slow_response():
+    scheduler = HostScheduler(initial_limit=4, max_limit=4)
+    scheduler.acquire("host")
+    scheduler.release("host", 0.01)
+    time.sleep(0.02)
+    scheduler.acquire("host")
+    scheduler.release("host", 1.0)
+    assert scheduler.limits() == {"host": 2}
+
+
+def test_limit_never_below_minimum():
+    scheduler = HostScheduler(initial_limit=1)
+    for _ in range(5):
+        scheduler.acquire("host")
+        scheduler.release("host", 0, throttled=True)
+    assert scheduler.limits() == {"host": MIN_LIMIT}
+
+
+def test_acquire_waits_for_free_slot():
+    scheduler = HostScheduler(initial_limit=1, max_limit=1)
+    scheduler.acquire("host")
+    # Other hosts are not affected
+    scheduler.acquire("other")
+
+    acquired = threading.Event()
+
+    def acquire():
+        scheduler.acquire("host")
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert not acquired.wait(0.1)
+    scheduler.release("host", 0.1)
+    assert acquired.wait(1)
+    thread.join()
+
+
+class _RecordingScheduler:
+    def __init__(self):
+        self.calls = []
+
+    def acquire(self, host):
+        self.calls.append(("acquire", host))
+
+    def release(self, host, latency, throttled=False):
+        self.calls.append(("release", round(latency, 1), throttled))
+
+
+class _OAIHandler(BaseHTTPRequestHandler):
+    # Responses still to be sent before answering with a page, as (status, headers)
+    refusals = []
+
+    def do_GET(self):
+        if self.refusals:
+            status, headers = self.refusals.pop(0)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><Identify/></OAI-PMH>'
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def oai_server():
+    server = HTTPServer(("127.0.0.1", 0), _OAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/oai"
+    _OAIHandler.refusals = []
+    server.shutdown()
+    server.server_close()
+
+
+def test_streamed_response_holds_slot_until_read(oai_server):
+    scheduler = _RecordingScheduler()
+    client = Sickle(oai_server, stream=True, scheduler=scheduler)
+    response = client._request({"verb": "Identify"})
+    # Only the headers have been read
+    assert [call[0] for call in scheduler.calls] == ["acquire"]
+    time.sleep(0.2)
+    assert b"Identify" in response.content
+    assert scheduler.calls[1] == ("release", 0.0, False)
+    # Released once
+    response.close()
+    assert len(scheduler.calls) == 2
+
+
+def test_slot_is_given_up_while_waiting_to_retry(oai_server):
+    _OAIHandler.refusals = [(429, {"Retry-After": "1"})]
+    scheduler = _RecordingScheduler()
+    client = Sickle(oai_server, max_retries=2, scheduler=scheduler)
+    client._request({"verb": "Identify"})
+    host = scheduler.calls[0][1]
+    # The second attempt's latency doesn't include the wait
+    assert scheduler.calls == [
+        ("acquire", host),
+        ("release", 0.0, True),
+        ("acquire", host),
+        ("release", 0.0, False),
+    ]
@@ -0,0 +1,68 @@
+import orjson as json
+
+from pipeline import idcache
+from pipeline.idcache import get_id_cache, prepare_id_cache
+from pipeline.validators.shared import remote_verification
+
+
+def test_id_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_ID_CACHE", str(tmp_path / "id_cache.sqlite3"))
+    monkeypatch.setattr(idcache, "ID_CACHE_WRITE_BATCH", 3)
+    id_cache = get_id_cache()
+    assert get_id_cache() is id_cache
+    id_cache.put("DOI", "10.1000/ABC", True)
+    id_cache.put("ISSN", "03785955", False)
+    # Normalized
+    assert id_cache.get("DOI", "10.1000/abc") is True
+    assert id_cache.get("ISSN", "0378-5955") is False
+    assert id_cache.get("DOI", "10.1000/other") is None
+
+    # Written once there's enough of it
+    other_cache = idcache.IdCache(id_cache.path)
+    assert other_cache.get("DOI", "10.1000/abc") is None
+    id_cache.put("DOI", "10.1000/def", True)
+    assert other_cache.get("DOI", "10.1000/abc") is True
+    assert other_cache.get("ISSN", "0378-5955") is False
+
+    # Not found is remembered for a shorter time
+    monkeypatch.setattr(idcache, "ID_CACHE_INVALID_TTL", -1)
+    assert other_cache.get("DOI", "10.1000/abc") is True
+    assert other_cache.get("ISSN", "0378-5955") is None
+    prepare_id_cache()
+    assert other_cache._get_connection().execute("SELECT id FROM verified_id ORDER BY id").fetchall() == [
+        ("10.1000/abc",),
+        ("10.1000/def",),
+    ]
+
+
+def test_populated_from_json_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_ID_CACHE", str(tmp_path / "cache" / "id_cache.sqlite3"))
+    json_file = tmp_path / "id_cache.json"
+    json_file.write_bytes(json.dumps({"doi": {"10.1000/ABC": 1}, "issn": {"03785955": 1}}))
+    prepare_id_cache(str(json_file))
+    assert get_id_cache().get("DOI", "10.1000/abc") is True
+    assert get_id_cache().get("ISSN", "0378-5955") is True
+
+    # Only the first time
+    json_file.write_bytes(json.dumps({"doi": {"10.1000/other": 1}, "issn": {}}))
+    prepare_id_cache(str(json_file))
+    assert get_id_cache().get("DOI", "10.1000/other") is None
+
+
+class Session:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def get(self, url, **kwargs):
+        if self.status_code is None:
+            raise TimeoutError()
+        return self
+
+
+def test_remote_verification_outcomes(monkeypatch):
+    monkeypatch.delenv("SWEPUB_SKIP_REMOTE", raising=False)
+    # Only found and not found are to be remembered, not what we couldn't tell
+    for status_code, expected in [(200, True), (404, False), (429, None), (503, None), (None, None)]:
+        assert remote_verification("https://example.com/", Session(status_code)) is expected
+    monkeypatch.setenv("SWEPUB_SKIP_REMOTE", "1")
+    assert remote_verification("https://example.com/", Session(200)) is None
@@ -0,0 +1,71 @@
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from pipeline import harvest
+from pipeline.harvestmanager import HarvestManager
+from pipeline.learnedstore import LearnedStore, new_learned, take_learned
+
+
+def test_take_learned():
+    harvest_cache = {"doab": {"x": "y"}, **new_learned()}
+    assert take_learned(harvest_cache) == {}
+    harvest_cache["localid_without_orcid"]["key"] = ["oai:a"]
+    localid_without_orcid = harvest_cache["localid_without_orcid"]
+    assert take_learned(harvest_cache) == {"localid_without_orcid": {"key": ["oai:a"]}}
+    # What's taken is no longer there to be added to
+    assert harvest_cache == {"doab": {"x": "y"}, **new_learned()}
+    assert harvest_cache["localid_without_orcid"] is not localid_without_orcid
+
+
+def test_merge():
+    store = LearnedStore()
+    store.merge(
+        {
+            "localid_to_orcid": {"key": {"orcid": "first", "oai_id": "oai:a"}},
+            "localid_without_orcid": {"other": ["oai:b"]},
+            "enriched_from_other_record": {"oai:c": ["oai:a"]},
+        }
+    )
+    store.merge(
+        {
+            "localid_to_orcid": {"key": {"orcid": "second", "oai_id": "oai:d"}},
+            "localid_without_orcid": {"other": ["oai:e"], "third": ["oai:f"]},
+            "enriched_from_other_record": {"oai:c": ["oai:a", "oai:d"]},
+        }
+    )
+    assert store.learned() == {
+        # The first one seen wins
+        "localid_to_orcid": {"key": {"orcid": "first", "oai_id": "oai:a"}},
+        "localid_without_orcid": {"other": ["oai:b", "oai:e"], "third": ["oai:f"]},
+        "enriched_from_other_record": {"oai:c": ["oai:a", "oai:d"]},
+    }
+    # (A copy)
+    store.learned()["localid_to_orcid"].clear()
+    assert store.learned()["localid_to_orcid"]
+
+
+def _learn(n):
+    harvest.harvest_cache["localid_without_orcid"].setdefault("key", []).append(f"oai:{n}")
+    harvest._flush_learned()
+    return harvest.harvest_cache["localid_without_orcid"]
+
+
+def test_flush_learned_from_workers():
+    manager = HarvestManager()
+    manager.start()
+    try:
+        harvest_cache = {"learned": manager.LearnedStore(), **new_learned()}
+        with ProcessPoolExecutor(
+            max_workers=2,
+            initializer=harvest.init,
+            initargs=(threading.Lock(), harvest_cache, {}, logging.getLogger(), False),
+        ) as executor:
+            # Each worker's own dicts are emptied as they're handed over
+            assert list(executor.map(_learn, range(10))) == [{}] * 10
+        learned = harvest_cache["learned"].learned()
+        assert sorted(learned["localid_without_orcid"]["key"]) == sorted(f"oai:{n}" for n in range(10))
+        # Nothing was learned in this process itself
+        assert harvest_cache["localid_without_orcid"] == {}
+    finally:
+        manager.shutdown()
@@ -0,0 +1,124 @@
+import gzip
+import json
+from unittest import mock
+
+import pytest
+
+from pipeline.oai import RecordIterator
+from pipeline.oaiarchive import OAIArchiveReader, OAIArchiveWriter, ArchiveExhausted, _chain_key
+from pipeline.sickle.app import Sickle
+from pipeline.sickle.tests.test_harvesting import mock_harvest
+
+SOURCE_SET = {"url": "http://localhost/oai", "metadata_prefix": "oai_dc", "subset": "test"}
+WINDOW = ("2020-01-01", None)
+
+
+def _no_network(self, **kwargs):
+    raise AssertionError(f"Unexpected request {kwargs}")
+
+
+def _records(harvest=mock_harvest, **kwargs):
+    iterator = RecordIterator("test", SOURCE_SET, WINDOW[0], WINDOW[1], "test", should_transform=False, **kwargs)
+    with mock.patch.object(Sickle, "harvest", lambda self, **params: harvest(**params)):
+        return [(record.oai_id, record.xml, record.page_token) for record in iterator]
+
+
+def _archive(tmp_path):
+    path = tmp_path / "test.oai.gz"
+    writer = OAIArchiveWriter(path, "test", "2021-02-03T04:05:06+00:00", "2020-01-01")
+    records = _records(archive=writer.chain(SOURCE_SET, WINDOW))
+    writer.close()
+    return path, records
+
+
+def test_archived_harvest_replays_without_network(tmp_path):
+    path, records = _archive(tmp_path)
+    reader = OAIArchiveReader(path)
+    assert reader.source == "test"
+    assert reader.harvest_start == "2021-02-03T04:05:06+00:00"
+    assert reader.harvest_from == "2020-01-01"
+    assert reader.sets == [SOURCE_SET]
+    assert reader.windows(SOURCE_SET) == [WINDOW]
+
+    replayed = _records(harvest=_no_network, replay=reader.pages(SOURCE_SET, WINDOW))
+    assert replayed == records
+    assert len(replayed) == 8
+
+
+def test_replay_with_prefetch_and_stream(tmp_path):
+    path, records = _archive(tmp_path)
+    reader = OAIArchiveReader(path)
+    replayed = _records(harvest=_no_network, replay=reader.pages(SOURCE_SET, WINDOW), prefetch=2, stream=True)
+    assert replayed == records
+
+
+def test_chains_are_kept_apart(tmp_path):
+    path = tmp_path / "test.oai.gz"
+    other_set = dict(SOURCE_SET, subset="other")
+    writer = OAIArchiveWriter(path, "test", "2021-02-03", None)
+    first = writer.chain(SOURCE_SET, (None, None))
+    second = writer.chain(other_set, (None, None))
+    # Interleaved, as when sets or windows are harvested at the same time
+    for token in ["ListRecords2.xml", "ListRecords3.xml"]:
+        first({"verb": "ListRecords", "resumptionToken": token}, mock_harvest(resumptionToken=token).http_response)
+        second({"verb": "ListRecords", "resumptionToken": token}, mock_harvest(resumptionToken=token).http_response)
+    writer.close()
+
+    reader = OAIArchiveReader(path)
+    assert reader.sets == [SOURCE_SET, other_set]
+    pages = list(reader.pages(other_set, (None, None)))
+    assert [params["resumptionToken"] for params, _, _ in pages] == ["ListRecords2.xml", "ListRecords3.xml"]
+
+
+def test_chain_is_read_without_the_others(tmp_path):
+    path = tmp_path / "test.oai.gz"
+    other_set = dict(SOURCE_SET, subset="other")
+    writer = OAIArchiveWriter(path, "test", "2021-02-03", None)
+    first = writer.chain(SOURCE_SET, (None, None))
+    second = writer.chain(other_set, (None, None))
+    for token in ["ListRecords2.xml", "ListRecords3.xml"]:
+        first({"verb": "ListRecords", "resumptionToken": token}, mock_harvest(resumptionToken=token).http_response)
+        second({"verb": "ListRecords", "resumptionToken": token}, mock_harvest(resumptionToken=token).http_response)
+    writer.close()
+
+    reader = OAIArchiveReader(path)
+    # Only the chain's own frames are read: the others could just as well be garbage
+    data = bytearray(path.read_bytes())
+    for offset in reader._offsets[_chain_key(other_set, (None, None))]:
+        data[offset + 10 : offset + 100] = b"x" * 90
+    path.write_bytes(bytes(data))
+    pages = list(reader.pages(SOURCE_SET, (None, None)))
+    assert [params["resumptionToken"] for params, _, _ in pages] == ["ListRecords2.xml", "ListRecords3.xml"]
+
+
+def test_archive_in_one_member(tmp_path):
+    # As written before each frame was a gzip member of its own
+    path = tmp_path / "test.oai.gz"
+    content = mock_harvest(resumptionToken="ListRecords2.xml").http_response.content
+    chain = _chain_key(SOURCE_SET, WINDOW)
+    with gzip.open(path, "wb") as fp:
+        for header, frame in [
+            ({"source": "test", "harvest_start": "2021-02-03", "harvest_from": None}, b""),
+            ({"chain": chain, "params": {"verb": "ListRecords"}, "encoding": None}, content),
+        ]:
+            fp.write(json.dumps(dict(header, length=len(frame))).encode("utf-8") + b"\n" + frame)
+
+    reader = OAIArchiveReader(path)
+    assert reader.windows(SOURCE_SET) == [WINDOW]
+    assert list(reader.pages(SOURCE_SET, WINDOW)) == [({"verb": "ListRecords"}, None, content)]
+
+
+def test_truncated_archive(tmp_path):
+    path, records = _archive(tmp_path)
+    data = path.read_bytes()
+    path.write_bytes(data[: len(data) * 2 // 3])
+    reader = OAIArchiveReader(path)
+    with pytest.raises(ArchiveExhausted):
+        _records(harvest=_no_network, replay=reader.pages(SOURCE_SET, WINDOW))
+
+
+def test_not_an_archive(tmp_path):
+    path = tmp_path / "test.oai.gz"
+    path.write_bytes(b"")
+    with pytest.raises(ValueError):
+        OAIArchiveReader(path)
@@ -0,0 +1,29 @@
+from pipeline.storage import (
+    clean_and_init_storage,
+    get_connection,
+    load_harvested_ids,
+    delete_records_not_harvested,
+    drop_harvested_ids,
+)
+
+
+def test_delete_records_not_harvested(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    clean_and_init_storage()
+    with get_connection() as con:
+        con.executemany(
+            "INSERT INTO original(source, source_subset, oai_id, accepted, data) VALUES (?, '', ?, 1, '')",
+            [("a", "oai:a:1"), ("a", "oai:a:2"), ("a", "oai:a:3"), ("b", "oai:b:1")],
+        )
+        con.commit()
+
+        load_harvested_ids(iter(["oai:a:1", "oai:a:3", "oai:a:3", "oai:a:4"]), con)
+        assert delete_records_not_harvested("a", con) == 1
+        con.commit()
+        drop_harvested_ids(con)
+
+        assert [row[0] for row in con.execute("SELECT oai_id FROM original ORDER BY oai_id")] == [
+            "oai:a:1",
+            "oai:a:3",
+            "oai:b:1",
+        ]
@@ -0,0 +1,54 @@
+import logging
+import multiprocessing
+import threading
+from queue import Queue
+
+import pytest
+
+from pipeline import harvest
+from pipeline.batchqueue import BatchesLost, BatchProducer, BatchQueue
+from pipeline.oai import Record
+from pipeline.storage import clean_and_init_storage
+
+HARVEST_ID = "harvest"
+
+
+def _setup(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    monkeypatch.setenv("SWEPUB_ID_CACHE", str(tmp_path / "id_cache.sqlite3"))
+    clean_and_init_storage()
+    harvest_cache = {"batch_queue": BatchQueue(4, 4), "batch_payloads": multiprocessing.Queue(), "remote_slots": {}}
+    storage_queue = Queue()
+    harvest.init(threading.Lock(), harvest_cache, {}, logging.getLogger(), False, storage_queue)
+    return harvest_cache, storage_queue
+
+
+def test_record_that_cannot_be_parsed_only_fails_itself(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+    batch = [
+        Record("oai:a:1", False, "<record><unclosed></record>"),
+        Record("oai:a:2", False, "<record><header/></record>"),
+    ]
+    handled, num_accepted, num_rejected, num_unchanged = harvest.handle_harvested("a", batch)
+    assert [record.oai_id for record, *_ in handled] == ["oai:a:2"]
+    assert (num_accepted, num_rejected, num_unchanged) == (0, 1, 0)
+
+
+def _fail(source, batch):
+    raise ValueError("broken")
+
+
+def test_batch_that_cannot_be_handled_is_lost(tmp_path, monkeypatch):
+    harvest_cache, storage_queue = _setup(tmp_path, monkeypatch)
+    monkeypatch.setattr(harvest, "handle_harvested", _fail)
+    producer = BatchProducer(harvest_cache["batch_queue"], harvest_cache["batch_payloads"], "key", 4)
+    producer.put(("a", "", HARVEST_ID, [Record("oai:a:1", False, "<record/>")]), checkpoint="page1")
+    harvest_cache["batch_payloads"].put(None)
+
+    harvest.record_worker()
+
+    # Nothing is stored, the checkpoint isn't reached, and the source fails
+    assert storage_queue.empty()
+    assert producer.completed_checkpoint() is None
+    with pytest.raises(BatchesLost):
+        producer.join()
@@ -0,0 +1,95 @@
+from pipeline.recordflags import FLAG_FIELDS, audit_result, field_status, pack_record_flags
+from pipeline.storage import clean_and_init_storage, create_deferred_indexes, get_connection, init_converted_flags
+from pipeline.util import Enrichment, Normalization, Validation
+from pipeline.validate import PATHS
+
+RECORD_INFO = {
+    "DOI": {
+        "validation_status": Validation.INVALID,
+        "enrichment_status": Enrichment.UNSUCCESSFUL,
+        "normalization_status": Normalization.UNCHANGED,
+    },
+    "ISSN": {
+        "validation_status": Validation.VALID,
+        "enrichment_status": Enrichment.ENRICHED,
+        "normalization_status": Normalization.NORMALIZED,
+    },
+}
+AUDIT_EVENTS = {
+    "CreatorCountAuditor": [
+        {"code": "creator_count_note_exists", "result": True},
+        {"code": "creator_count_check", "result": False},
+    ],
+    "SwedishListAuditor": [{"code": "set_publication_level", "result": None}],
+    "UnknownAuditor": [{"code": "unknown", "result": True}],
+}
+
+
+def _matches(flags, column, mask, value):
+    return flags[["validation", "enrichment", "normalization"].index(column)] & mask == value
+
+
+def test_all_fields_have_flags():
+    assert set(PATHS) <= set(FLAG_FIELDS)
+
+
+def test_pack_record_flags():
+    flags = pack_record_flags(RECORD_INFO, AUDIT_EVENTS)
+    assert _matches(flags, "validation", *field_status("DOI", Validation.INVALID))
+    assert not _matches(flags, "validation", *field_status("DOI", Validation.VALID))
+    assert _matches(flags, "enrichment", *field_status("ISSN", Enrichment.ENRICHED))
+    assert _matches(flags, "normalization", *field_status("ISSN", Normalization.NORMALIZED))
+    # Not having a field is no status at all
+    for status in Validation:
+        assert not _matches(flags, "validation", *field_status("ISBN", status))
+        assert not _matches(flags, "validation", *field_status("unknown", status))
+
+    audit, audit_true, audit_false = flags[3:]
+    columns = {"audit_true": audit_true, "audit_false": audit_false}
+    for code, result, expected in [
+        ("creator_count_note_exists", 1, True),
+        ("creator_count_note_exists", 0, False),
+        ("creator_count_check", 0, True),
+        ("set_publication_level", 1, False),
+        ("set_publication_level", 0, False),
+        ("unknown", 1, False),
+    ]:
+        column, mask = audit_result(code, result)
+        assert bool(columns[column] & mask) == expected, (code, result)
+    assert audit == audit_true | audit_false | audit_result("set_publication_level", 1)[1]
+
+
+def test_converted_record_info_is_packed(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    clean_and_init_storage()
+    with get_connection() as con:
+        # As in a database from before the packed flags
+        con.execute("DROP TABLE converted_flags")
+        con.execute(
+            """CREATE TABLE converted_record_info (
+            converted_id INTEGER, source TEXT, date INTEGER, field_name TEXT, validation_status INTEGER,
+            enrichment_status INTEGER, normalization_status INTEGER, audit_name TEXT, audit_code TEXT,
+            audit_result INTEGER)"""
+        )
+        con.execute("INSERT INTO converted(id, oai_id, source, date) VALUES (1, 'oai:a:1', 'a', 2020)")
+        con.executemany(
+            "INSERT INTO converted_record_info VALUES (1, 'a', 2020, ?, ?, ?, ?, NULL, NULL, NULL)",
+            [
+                (field, int(info["validation_status"]), int(info["enrichment_status"]), int(info["normalization_status"]))
+                for field, info in RECORD_INFO.items()
+            ],
+        )
+        con.executemany(
+            "INSERT INTO converted_record_info VALUES (1, 'a', 2020, NULL, NULL, NULL, NULL, ?, ?, ?)",
+            [(name, event["code"], event["result"]) for name, events in AUDIT_EVENTS.items() for event in events],
+        )
+
+        init_converted_flags(con.cursor())
+        create_deferred_indexes(con)
+        assert con.execute("SELECT * FROM converted_flags").fetchall() == [
+            (1, "a", 2020, *pack_record_flags(RECORD_INFO, AUDIT_EVENTS))
+        ]
+        assert not con.execute("SELECT name FROM sqlite_master WHERE name = 'converted_record_info'").fetchall()
+        assert "converted_flags" in con.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'remove_converted_stuff_on_deleted'"
+        ).fetchone()[0]
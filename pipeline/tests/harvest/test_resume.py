@@ -0,0 +1,56 @@
+from unittest import mock
+
+from pipeline.oai import RecordIterator
+from pipeline.sickle.app import Sickle
+from pipeline.sickle.tests.test_harvesting import mock_harvest
+
+SOURCE_SET = {"url": "http://localhost/oai", "metadata_prefix": "oai_dc"}
+
+
+def _harvest(requests):
+    def harvest(self, **kwargs):
+        requests.append(kwargs)
+        if kwargs.get("resumptionToken") == "expired":
+            kwargs = dict(kwargs, resumptionToken=None, error="badResumptionToken")
+        return mock_harvest(**kwargs)
+
+    return harvest
+
+
+def _records(requests, **kwargs):
+    iterator = RecordIterator("test", SOURCE_SET, "2020-01-01", None, "test", should_transform=False, **kwargs)
+    with mock.patch.object(Sickle, "harvest", _harvest(requests)):
+        return iterator, [(record.oai_id, record.page_token) for record in iterator]
+
+
+def test_records_know_their_page_token():
+    _, records = _records([])
+    assert [page_token for _, page_token in records] == [
+        None,
+        None,
+        "ListRecords2.xml",
+        "ListRecords2.xml",
+        "ListRecords3.xml",
+        "ListRecords3.xml",
+        "ListRecords4.xml",
+        "ListRecords4.xml",
+    ]
+
+
+def test_resume_from_token():
+    requests = []
+    iterator, records = _records(requests, resumption_token="ListRecords3.xml", fallback_from="2021-01-01")
+    _, all_records = _records([])
+    assert records == all_records[4:]
+    assert requests[0] == {"verb": "ListRecords", "resumptionToken": "ListRecords3.xml"}
+    assert not iterator.token_expired
+
+
+def test_expired_token_falls_back_to_datestamp():
+    requests = []
+    iterator, records = _records(requests, resumption_token="expired", fallback_from="2021-01-01")
+    _, all_records = _records([])
+    assert records == all_records
+    assert iterator.token_expired
+    assert requests[1]["from"] == "2021-01-01"
+    assert "resumptionToken" not in requests[1]
@@ -0,0 +1,148 @@
+from pipeline import harvest
+from pipeline.storage import (
+    clean_and_init_storage,
+    connect_new_shard,
+    consolidate_shards,
+    create_deferred_indexes,
+    get_connection,
+    get_shard_paths,
+    init_new_shard,
+    replace_shard,
+    save_to_shard,
+)
+
+
+def _harvest_into_shard(shard_dir, source, oai_ids, deleted_oai_ids=(), rejected_oai_ids=(), harvested_at=None):
+    with get_connection() as con:
+        con.execute("INSERT INTO harvest_history(id, source) VALUES (?, ?)", (f"harvest-{source}", source))
+        if harvested_at:
+            con.execute("INSERT INTO last_harvest(source, last_successful_harvest) VALUES (?, ?)", (source, harvested_at))
+    init_new_shard(shard_dir, source)
+    con = connect_new_shard(shard_dir, source)
+    for oai_id in oai_ids:
+        original_id = con.execute(
+            "INSERT INTO original(source, data, accepted, oai_id) VALUES (?, '<xml/>', 1, ?)", (source, oai_id)
+        ).lastrowid
+        converted_id = con.execute(
+            "INSERT INTO converted(data, original_id, oai_id, source, date) VALUES ('{}', ?, ?, ?, 2020)",
+            (original_id, oai_id, source),
+        ).lastrowid
+        con.execute("INSERT INTO converted_ssif_1(converted_id, value) VALUES (?, 101)", (converted_id,))
+        con.execute("INSERT INTO clusteringidentifiers(identifier, converted_id) VALUES (?, ?)", (oai_id, converted_id))
+        con.execute(
+            "INSERT INTO converted_flags(converted_id, source, date, validation) VALUES (?, ?, 2020, ?)",
+            (converted_id, source, len(oai_id)),
+        )
+    for oai_id in deleted_oai_ids:
+        con.execute("INSERT INTO converted(oai_id, data, deleted) VALUES (?, null, 1)", (oai_id,))
+    for oai_id in rejected_oai_ids:
+        con.execute(
+            "INSERT INTO rejected(harvest_id, oai_id, rejection_cause) VALUES (?, ?, '[]')", (f"harvest-{source}", oai_id)
+        )
+    con.commit()
+    con.close()
+    replace_shard(shard_dir, source)
+
+
+def _consolidate(shard_dir):
+    with get_connection() as con:
+        consolidate_shards(get_shard_paths(shard_dir), con)
+        create_deferred_indexes(con)
+        details = con.execute(
+            """
+            SELECT c.oai_id, c.source, c.deleted, o.oai_id, s.value, i.identifier, f.validation
+            FROM converted c
+            LEFT JOIN original o ON o.id = c.original_id
+            LEFT JOIN converted_ssif_1 s ON s.converted_id = c.id
+            LEFT JOIN clusteringidentifiers i ON i.converted_id = c.id
+            LEFT JOIN converted_flags f ON f.converted_id = c.id
+            ORDER BY c.oai_id
+            """
+        ).fetchall()
+        rejected = con.execute("SELECT harvest_id, oai_id FROM rejected ORDER BY oai_id").fetchall()
+    return details, rejected
+
+
+def test_consolidate_shards(tmp_path, monkeypatch):
+    shard_dir = tmp_path / "shards"
+    shard_dir.mkdir()
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "main.sqlite3"))
+    clean_and_init_storage(defer_indexes=True)
+    _harvest_into_shard(shard_dir, "a", ["oai:a:1", "oai:a:22", "oai:shared"], rejected_oai_ids=["oai:a:3"])
+    _harvest_into_shard(shard_dir, "b", ["oai:b:333", "oai:shared"], deleted_oai_ids=["oai:b:4"])
+    assert [path.rsplit("/", 1)[1] for path in get_shard_paths(shard_dir)] == ["a.sqlite3", "b.sqlite3"]
+
+    details, rejected = _consolidate(shard_dir)
+    assert details == [
+        ("oai:a:1", "a", 0, "oai:a:1", 101, "oai:a:1", 7),
+        ("oai:a:22", "a", 0, "oai:a:22", 101, "oai:a:22", 8),
+        ("oai:b:333", "b", 0, "oai:b:333", 101, "oai:b:333", 9),
+        ("oai:b:4", None, 1, None, None, None, None),
+        # As when stored in one database: the first one stored (here, the first shard's) is kept
+        ("oai:shared", "a", 0, "oai:shared", 101, "oai:shared", 10),
+    ]
+    assert rejected == [("harvest-a", "oai:a:3")]
+
+    # A later harvest of b alone still has a's records (and rejections) from its shard
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "later.sqlite3"))
+    clean_and_init_storage(defer_indexes=True)
+    _harvest_into_shard(shard_dir, "b", ["oai:b:5"])
+    details, rejected = _consolidate(shard_dir)
+    assert [row[0] for row in details] == ["oai:a:1", "oai:a:22", "oai:b:5", "oai:shared"]
+    assert rejected == [("harvest-a", "oai:a:3")]
+
+
+def test_shards_keep_what_the_main_database_knows(tmp_path, monkeypatch):
+    shard_dir = tmp_path / "shards"
+    shard_dir.mkdir()
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "main.sqlite3"))
+    clean_and_init_storage(defer_indexes=True)
+    _harvest_into_shard(shard_dir, "a", ["oai:a:1", "oai:a:2"], harvested_at="2024-01-01")
+    _harvest_into_shard(shard_dir, "b", ["oai:b:1"], harvested_at="2024-01-02")
+    _consolidate(shard_dir)
+    # What's worked out once everything is harvested
+    with get_connection() as con:
+        con.executemany(
+            "INSERT INTO localid_to_orcid(source_oai_id, cache_key, orcid) VALUES (?, ?, ?)",
+            [("oai:a:1", "key-a", "orcid-a"), ("oai:b:1", "key-b", "orcid-b")],
+        )
+        con.executemany(
+            "INSERT INTO enriched_from_other_record(source_oai_id, enriched_oai_id) VALUES (?, ?)",
+            [("oai:b:1", "oai:a:2"), ("oai:a:1", "oai:b:1")],
+        )
+        con.commit()
+    for source in ["a", "b"]:
+        save_to_shard(shard_dir, source)
+
+    # b is harvested again, a is skipped (and its shard kept)
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "later.sqlite3"))
+    clean_and_init_storage(defer_indexes=True)
+    _harvest_into_shard(shard_dir, "b", ["oai:b:1"], harvested_at="2024-02-01")
+    _consolidate(shard_dir)
+    with get_connection() as con:
+        assert con.execute("SELECT * FROM last_harvest ORDER BY source").fetchall() == [
+            ("a", "2024-01-01"),
+            ("b", "2024-02-01"),
+        ]
+        # b's are worked out again in this harvest
+        assert con.execute("SELECT source_oai_id, cache_key, orcid FROM localid_to_orcid").fetchall() == [
+            ("oai:a:1", "key-a", "orcid-a")
+        ]
+        assert con.execute("SELECT source_oai_id, enriched_oai_id FROM enriched_from_other_record").fetchall() == [
+            ("oai:b:1", "oai:a:2")
+        ]
+
+
+def test_records_of_a_source_go_to_one_writer(monkeypatch):
+    queues = [[], [], []]
+    monkeypatch.setattr(harvest, "storage_queue", queues, raising=False)
+    sources = ["a", "b", "c", "d", "a", "c", "a"]
+    for source in sources:
+        harvest._storage_queue_for(source).append(source)
+    for source in set(sources):
+        assert [queue.count(source) for queue in queues if source in queue] == [sources.count(source)]
+
+    # Without shards, there's just the one
+    queue = object()
+    monkeypatch.setattr(harvest, "storage_queue", queue, raising=False)
+    assert harvest._storage_queue_for("b") is queue
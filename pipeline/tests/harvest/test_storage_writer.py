@@ -0,0 +1,118 @@
+import logging
+import sqlite3
+import threading
+from queue import Queue
+
+import pytest
+
+from pipeline import harvest
+from pipeline.batchqueue import BatchesLost, BatchProducer, BatchQueue
+from pipeline.oai import Record
+from pipeline.storage import ConvertedDetailRows, clean_and_init_storage, get_connection, store_original
+
+HARVEST_ID = "harvest"
+
+
+def _setup(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    clean_and_init_storage()
+    with get_connection() as con:
+        con.execute("INSERT INTO harvest_history(id, source, harvest_start) VALUES (?, 'a', '')", (HARVEST_ID,))
+        con.commit()
+    harvest_cache = {"meta": {HARVEST_ID: [0, 0, 0, 0]}, "batch_queue": BatchQueue(4, 4)}
+    storage_queue = Queue()
+    harvest.init(threading.Lock(), harvest_cache, {}, logging.getLogger(), False, storage_queue)
+    return harvest_cache, storage_queue
+
+
+def _rejected(oai_id):
+    return Record(oai_id, False, f"<record>{oai_id}</record>"), False, ["error"], None, None
+
+
+def test_storage_writer_stores_batches_in_one_go(tmp_path, monkeypatch):
+    harvest_cache, storage_queue = _setup(tmp_path, monkeypatch)
+    batch_queue = harvest_cache["batch_queue"]
+    for handled in [[_rejected("oai:a:1"), _rejected("oai:a:2")], [_rejected("oai:a:1"), _rejected("oai:a:3")]]:
+        seq, _ = batch_queue.put("key")
+        storage_queue.put(("key", seq, "a", "", HARVEST_ID, (handled, 0, len(handled), 1)))
+    storage_queue.put(None)
+
+    harvest.storage_writer(batch_size=1000)
+
+    with get_connection() as con:
+        assert [row[0] for row in con.execute("SELECT oai_id FROM original ORDER BY oai_id")] == [
+            "oai:a:1",
+            "oai:a:2",
+            "oai:a:3",
+        ]
+    assert harvest_cache["meta"][HARVEST_ID] == [0, 4, 0, 2]
+    # The batches are done once they're stored
+    assert batch_queue.completed("key") == 2
+
+
+class _CommitFails:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def commit(self):
+        raise sqlite3.OperationalError("database is locked")
+
+
+def test_batches_not_stored_are_lost(tmp_path, monkeypatch):
+    harvest_cache, _ = _setup(tmp_path, monkeypatch)
+    payloads = Queue()
+    producer = BatchProducer(harvest_cache["batch_queue"], payloads, "key", 4)
+    producer.put([_rejected("oai:a:1")], checkpoint="page1")
+    producer.put([_rejected("oai:a:2")], checkpoint="page2")
+    stored, not_stored = [payloads.get() for _ in range(2)]
+    with get_connection() as con:
+        for (key, seq, handled), connection in [(stored, con), (not_stored, _CommitFails(con))]:
+            harvest._store_handled([(key, seq, "a", "", HARVEST_ID, (handled, 0, 1, 0))], connection)
+        assert [row[0] for row in con.execute("SELECT oai_id FROM original")] == ["oai:a:1"]
+    # Only what was stored is counted, and the checkpoint stays before the batch that wasn't
+    assert harvest_cache["meta"][HARVEST_ID] == [0, 1, 0, 0]
+    assert producer.completed_checkpoint() == "page1"
+    assert producer.completed_checkpoint() is None
+    # The source fails, as it does when a record worker dies
+    with pytest.raises(BatchesLost):
+        producer.put([_rejected("oai:a:3")])
+    with pytest.raises(BatchesLost):
+        producer.join()
+
+
+def test_duplicate_original_in_open_transaction(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    clean_and_init_storage()
+    with get_connection() as con:
+        args = ("a", "", True, con, False, [], HARVEST_ID)
+        rowid, _ = store_original("oai:a:1", False, "<record/>", *args, commit=False)
+        assert rowid
+        assert store_original("oai:a:1", False, "<record/>", *args, commit=False) == (None, False)
+
+
+def test_converted_detail_rows(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_DB", str(tmp_path / "test.sqlite3"))
+    clean_and_init_storage()
+    with get_connection() as con:
+        converted_ids = [
+            con.execute("INSERT INTO converted(oai_id, data) VALUES (?, '{}')", (oai_id,)).lastrowid
+            for oai_id in ["oai:a:1", "oai:a:2"]
+        ]
+        detail_rows = ConvertedDetailRows()
+        for converted_id, oai_id in zip(converted_ids, ["oai:a:1", "oai:a:2"]):
+            rows = ConvertedDetailRows()
+            rows.oai_ids.add(oai_id)
+            rows.ssif_1 = [(converted_id, "101")]
+            rows.flags = [(converted_id, "a", 2020, 8, 4, 4, 1, 1, 0)]
+            rows.identifiers = [("identifier", converted_id)]
+            detail_rows.extend(rows)
+        assert len(detail_rows) == 6
+        assert detail_rows.oai_ids == {"oai:a:1", "oai:a:2"}
+
+        detail_rows.write(con)
+        assert not detail_rows and not detail_rows.oai_ids
+        for table in ["converted_ssif_1", "converted_flags", "clusteringidentifiers"]:
+            assert con.execute(f"SELECT count(*) FROM {table}").fetchone()[0] == 2
@@ -0,0 +1,64 @@
+import os
+
+from pipeline import walcheckpointer
+from pipeline.storage import clean_and_init_storage, connect, get_connection
+from pipeline.walcheckpointer import WalCheckpointer, background_checkpointing
+
+
+def _write(con, n):
+    con.executemany(
+        "INSERT INTO finalized(oai_id, data) VALUES (?, ?)", [(f"oai:test:{n}-{i}", "x" * 1000) for i in range(200)]
+    )
+    con.commit()
+
+
+def test_wal_checkpointer(tmp_path, monkeypatch):
+    sqlite_path = str(tmp_path / "test.sqlite3")
+    monkeypatch.setenv("SWEPUB_DB", sqlite_path)
+    monkeypatch.setattr(walcheckpointer, "WAL_RESTART_SIZE", 64 * 1024)
+    clean_and_init_storage()
+    assert get_connection().execute("PRAGMA wal_autocheckpoint").fetchone() == (1000,)
+
+    checkpointer = WalCheckpointer(sqlite_path)
+    # Not start()ed, so as to run the checks here rather than in the background
+    monkeypatch.setenv("SWEPUB_WAL_CHECKPOINTER", os.path.abspath(sqlite_path))
+    assert background_checkpointing(sqlite_path)
+    con = connect()
+    # The connections leave checkpointing to the checkpointer
+    assert con.execute("PRAGMA wal_autocheckpoint").fetchone() == (0,)
+
+    _write(con, 1)
+    checkpointer._checkpoint_if_written()
+    # Everything was checkpointed, and the WAL was large enough to be restarted
+    assert checkpointer.checkpoints == 2
+    wal_size = os.path.getsize(f"{sqlite_path}-wal")
+    # Nothing written since
+    checkpointer._checkpoint_if_written()
+    assert checkpointer.checkpoints == 2
+
+    # Writing starts over from the beginning of the WAL, rather than appending to it
+    _write(con, 2)
+    assert os.path.getsize(f"{sqlite_path}-wal") < wal_size * 3 // 2
+    checkpointer._checkpoint_if_written()
+    assert checkpointer.checkpoints == 4
+
+    checkpointer.phase_done("testing")
+    assert os.path.getsize(f"{sqlite_path}-wal") == 0
+    assert checkpointer.checkpoints == 0
+    assert con.execute("SELECT count(*) FROM finalized").fetchone() == (400,)
+    con.close()
+
+
+def test_start_and_stop(tmp_path, monkeypatch):
+    sqlite_path = str(tmp_path / "test.sqlite3")
+    monkeypatch.setenv("SWEPUB_DB", sqlite_path)
+    monkeypatch.delenv("SWEPUB_WAL_CHECKPOINTER", raising=False)
+    clean_and_init_storage()
+    checkpointer = WalCheckpointer(sqlite_path)
+    checkpointer.start()
+    try:
+        assert background_checkpointing(sqlite_path)
+        assert not background_checkpointing(str(tmp_path / "other.sqlite3"))
+    finally:
+        checkpointer.stop()
+    assert not background_checkpointing(sqlite_path)
@@ -0,0 +1,98 @@
+import pytest
+from jsonpath_rw_ext import parse
+
+from pipeline.util import FieldMeta, compile_json_path, location_at_path
+from pipeline.validate import PATHS
+
+DOCUMENT = {
+    "identifiedBy": [
+        {"@type": "DOI", "value": "10.1234/a"},
+        {"@type": "URI", "value": "http://example.com"},
+        {"@type": "DOI"},
+        "not a dict",
+        {"@type": "ISBN", "value": ""},
+        {"@type": "ISSN", "value": {"nested": True}},
+    ],
+    "publication": [{"@type": "Publication", "date": 2020}],
+    "instanceOf": {
+        "contribution": [
+            {"agent": {"identifiedBy": [{"@type": "ORCID", "value": "0000-0001"}, {"@type": "Local", "value": "x"}]}},
+            {"agent": {}},
+            {"role": []},
+        ],
+        # A single dict where there's usually a list
+        "hasTitle": {"mainTitle": "Title", "subtitle": "Subtitle"},
+        "hasNote": [{"@type": "CreatorCount", "label": "3"}, {"@type": "Note", "label": "A note"}],
+        "subject": {"@type": "Topic", "prefLabel": "Filtering a dict matches nothing"},
+        "classification": [{"@id": "https://id.kb.se/term/ssif/101"}, {"@id": None}],
+    },
+    "hasSeries": [{"hasTitle": [{"mainTitle": "Series"}], "identifiedBy": [{"@type": "ISSN", "value": "1234-5678"}]}],
+    "isPartOf": [
+        {"hasSeries": {"hasTitle": "a string"}, "identifiedBy": [{"@type": "ISBN", "value": "978"}]},
+        [{"identifiedBy": [{"@type": "ISSN", "value": "in a list in a list"}]}],
+    ],
+}
+
+
+@pytest.mark.parametrize("json_path", [json_path for json_paths in PATHS.values() for json_path in json_paths])
+def test_compiled_path_finds_what_jsonpath_does(json_path):
+    expected = [(str(match.full_path), match.value) for match in parse(json_path).find(DOCUMENT)]
+    found = compile_json_path(json_path)(DOCUMENT)
+    assert [(path, value) for path, value, _ in found] == expected
+    for path, value, location in found:
+        container, key = location[-1]
+        assert container[key] is value
+        assert location_at_path(DOCUMENT, path)[-1] == (container, key)
+    assert compile_json_path(json_path)({}) == []
+
+
+def test_compiled_path():
+    [(path, value, location)] = compile_json_path('identifiedBy[?(@.@type=="DOI")].value')(DOCUMENT)
+    assert (path, value) == ("identifiedBy.[0].value", "10.1234/a")
+    assert location == [(DOCUMENT, "identifiedBy"), (DOCUMENT["identifiedBy"], 0), (DOCUMENT["identifiedBy"][0], "value")]
+    [(path, value, _)] = compile_json_path("instanceOf.hasTitle[*].mainTitle")(DOCUMENT)
+    assert (path, value) == ("instanceOf.hasTitle.[0].mainTitle", "Title")
+
+
+def test_unsupported_path():
+    for json_path in ["identifiedBy[0]", 'identifiedBy[?(@.@type!="DOI")]', "$..value", ""]:
+        with pytest.raises(ValueError):
+            compile_json_path(json_path)
+
+
+def _issn_fields(body):
+    find = compile_json_path('isPartOf.[*].identifiedBy[?(@.@type=="ISSN")].value')
+    return [FieldMeta(path, "ISSN", value, location=location) for path, value, location in find(body)]
+
+
+def test_field_update_and_append_identifier():
+    body = {"isPartOf": [{"identifiedBy": [{"@type": "ISSN", "value": "a"}]}]}
+    [field] = _issn_fields(body)
+    field.update(body, "b")
+    new_field = field.append_identifier(body, 2, type="ISSN", value="c")
+    assert body == {"isPartOf": [{"identifiedBy": [{"@type": "ISSN", "value": "b"}, {"@type": "ISSN", "value": "c"}]}]}
+    assert new_field.path == "isPartOf.[0].identifiedBy.[1].value"
+    new_field.update(body, "d")
+    assert body["isPartOf"][0]["identifiedBy"][1]["value"] == "d"
+    # Without a location, it's looked up from the path
+    field = FieldMeta("isPartOf.[0].identifiedBy.[1].value", "ISSN", "d")
+    assert field.get_parent(body, 3) is body["isPartOf"][0]
+    field.update(body, "e")
+    assert body["isPartOf"][0]["identifiedBy"][1]["value"] == "e"
+
+
+def test_field_remove():
+    body = {
+        "isPartOf": [
+            {"identifiedBy": [{"@type": "ISSN", "value": "a"}, {"@type": "ISSN", "value": "b"}]},
+            {"identifiedBy": [{"@type": "ISSN", "value": "c"}]},
+            {"identifiedBy": [{"@type": "ISSN", "value": "d"}], "hasTitle": []},
+        ]
+    }
+    fields = _issn_fields(body)
+    # Removing a shifts b, and removing c (and the host that it leaves empty) shifts d
+    for i in [0, 2, 3]:
+        fields[i].remove(body, 1)
+    assert body == {"isPartOf": [{"identifiedBy": [{"@type": "ISSN", "value": "b"}]}, {"hasTitle": []}]}
+    fields[1].remove(body, 1)
+    assert body == {"isPartOf": [{"hasTitle": []}]}
@@ -0,0 +1,156 @@
+import threading
+import time
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from pipeline.idcache import get_id_cache
+from pipeline.util import FieldMeta, HostLimitedAdapter, Validation
+from pipeline.validate import verify_remotely
+from pipeline.validators.doi import validate_doi, verify_doi_remotely
+from pipeline.validators.issn import validate_issn
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class Session:
+    # The first `busy` requests for each URL get 429 Too Many Requests, as do all requests for `busy_urls`
+    def __init__(self, found_urls, busy=0, busy_urls=()):
+        self.found_urls = found_urls
+        self.busy = busy
+        self.busy_urls = busy_urls
+        self.urls = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            self.urls.append(url)
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        time.sleep(0.05)
+        with self.lock:
+            self.concurrent -= 1
+            if self.urls.count(url) <= self.busy or url in self.busy_urls:
+                return Response(429)
+        return Response(200 if url in self.found_urls else 404)
+
+
+@pytest.fixture(autouse=True)
+def id_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWEPUB_ID_CACHE", str(tmp_path / "id_cache.sqlite3"))
+    monkeypatch.delenv("SWEPUB_SKIP_REMOTE", raising=False)
+    get_id_cache().put("ISSN", "0378-5955", True)
+    return get_id_cache()
+
+
+def _harvest_cache():
+    return {"doi_static": {"10.1000/static": 1}, "issn_static": {}}
+
+
+def test_verify_remotely(id_cache):
+    bodies = [
+        {"identifiedBy": [{"@type": "DOI", "value": "10.1000/a"}, {"@type": "DOI", "value": "10.1000/static"}]},
+        {"identifiedBy": [{"@type": "DOI", "value": "https://doi.org/10.1000/a"}, {"@type": "DOI", "value": "10.1000/b"}]},
+        {"identifiedBy": [{"@type": "DOI", "value": "not a DOI"}, {"@type": "ISSN", "value": "0378-5955"}]},
+        {"isPartOf": [{"identifiedBy": [{"@type": "ISSN", "value": "2049-3630"}, {"@type": "ISSN", "value": "1234-5678"}]}]},
+    ]
+    session = Session({"https://shortdoi.org/10.1000/a?format=json", "https://api.crossref.org/works/10.1000/b/"})
+    harvest_cache = _harvest_cache()
+    verified = verify_remotely(bodies, session, harvest_cache)
+    # Just the ones that are valid so far and not cached, each once (and an ISSN with a bad checksum isn't)
+    assert verified == {("DOI", "10.1000/a"): True, ("DOI", "10.1000/b"): True, ("ISSN", "2049-3630"): False}
+    assert len(session.urls) == 4
+    assert session.max_concurrent > 1
+
+    # Validating uses what was verified
+    session = Session(set())
+    fields = [FieldMeta(value="10.1000/b"), FieldMeta(value="2049-3630")]
+    validate_doi(fields[0], session, harvest_cache, verified)
+    validate_issn(fields[1], session, harvest_cache, verified)
+    assert [field.validation_status for field in fields] == [Validation.VALID, Validation.INVALID]
+    assert [field.events[-1]["code"] for field in fields] == ["remote", "remote"]
+    # and verifies what wasn't
+    field = FieldMeta(value="10.1000/c")
+    validate_doi(field, session, harvest_cache, verified)
+    assert field.validation_status == Validation.INVALID
+    assert len(session.urls) == 2
+    # remembering all of it
+    id_cache.flush()
+    assert [id_cache.get("DOI", doi) for doi in ["10.1000/B", "10.1000/c"]] == [True, False]
+    assert id_cache.get("ISSN", "20493630") is False
+
+
+def test_nothing_to_verify():
+    session = Session(set())
+    assert verify_remotely([{"identifiedBy": [{"@type": "DOI", "value": "10.1000/static"}]}], session, _harvest_cache()) == {}
+    assert not session.urls
+
+
+def test_too_many_requests_is_verified_again(id_cache):
+    bodies = [{"identifiedBy": [{"@type": "DOI", "value": "10.1000/busy"}]}]
+    session = Session({"https://shortdoi.org/10.1000/busy?format=json"}, busy=1)
+    harvest_cache = _harvest_cache()
+    # (Which doesn't mean it wasn't found, just that we couldn't tell)
+    verified = verify_remotely(bodies, session, harvest_cache)
+    assert verified == {}
+    id_cache.flush()
+    assert id_cache.get("DOI", "10.1000/busy") is None
+
+    field = FieldMeta(value="10.1000/busy")
+    validate_doi(field, session, harvest_cache, verified)
+    assert field.validation_status == Validation.VALID
+    id_cache.flush()
+    assert id_cache.get("DOI", "10.1000/busy") is True
+
+
+def test_doi_not_found_only_if_neither_finds_it():
+    shortdoi = "https://shortdoi.org/10.1000/x?format=json"
+    crossref = "https://api.crossref.org/works/10.1000/x/"
+    assert verify_doi_remotely("10.1000/x", Session({shortdoi})) is True
+    assert verify_doi_remotely("10.1000/x", Session({crossref})) is True
+    assert verify_doi_remotely("10.1000/x", Session({crossref}, busy_urls={shortdoi})) is True
+    assert verify_doi_remotely("10.1000/x", Session(set())) is False
+    # Crossref doesn't know about e.g. DataCite DOIs, so without an answer from shortDOI we can't tell
+    assert verify_doi_remotely("10.1000/x", Session(set(), busy_urls={shortdoi})) is None
+    assert verify_doi_remotely("10.1000/x", Session(set(), busy_urls={crossref})) is None
+
+    # and nothing is remembered
+    field = FieldMeta(value="10.1000/x")
+    validate_doi(field, Session(set(), busy_urls={shortdoi}), _harvest_cache())
+    assert field.validation_status == Validation.INVALID
+    get_id_cache().flush()
+    assert get_id_cache().get("DOI", "10.1000/x") is None
+
+
+def test_host_limited_adapter(monkeypatch):
+    concurrent = {"shortdoi.org": 0, "example.com": 0}
+    max_concurrent = dict(concurrent)
+    lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        host = request.url.split("/")[2]
+        with lock:
+            concurrent[host] += 1
+            max_concurrent[host] = max(max_concurrent[host], concurrent[host])
+        time.sleep(0.05)
+        with lock:
+            concurrent[host] -= 1
+        return Response(200)
+
+    monkeypatch.setattr(HTTPAdapter, "send", send)
+    adapter = HostLimitedAdapter({"shortdoi.org": threading.BoundedSemaphore(2)})
+    threads = [
+        threading.Thread(target=adapter.send, args=(requests.Request("GET", f"https://{host}/x").prepare(),))
+        for host in ["shortdoi.org", "example.com"] * 5
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max_concurrent == {"shortdoi.org": 2, "example.com": 5}
@@ -2,15 +2,15 @@ from aenum import Enum
 from pathlib import Path
 
 from difflib import SequenceMatcher
-from jsonpath_rw import parse
 import re
 import Levenshtein
 import hashlib
 from simplemma.langdetect import lang_detector
 from unidecode import unidecode
 
-from requests.adapters import Retry
+from requests.adapters import HTTPAdapter, Retry
 from random import random
+from urllib.parse import urlparse
 from lxml import etree
 
 from pipeline.swepublog import logger as log
@@ -95,7 +95,7 @@ class Level(Enum):
 
 
 class FieldMeta:
-    def __init__(self, path="", id_type="", value=None, validation_status=Validation.PENDING, normalization_status=Normalization.UNCHANGED, enrichment_status=Enrichment.UNCHANGED):
+    def __init__(self, path="", id_type="", value=None, validation_status=Validation.PENDING, normalization_status=Normalization.UNCHANGED, enrichment_status=Enrichment.UNCHANGED, location=None):
         self.id_type = id_type
         self.path = path
         self.initial_value = value
@@ -104,128 +104,151 @@ class FieldMeta:
         self.enrichment_status = enrichment_status
         self.normalization_status = normalization_status
         self.events = []
+        # (container, key) of each step of the path, from the document down to the value, so that
+        # the value can be changed without looking up the path again; see location_at_path
+        self.location = location
 
     def is_enriched(self):
         return self.enrichment_status == Enrichment.ENRICHED
 
+    def get_location(self, body):
+        if self.location is None:
+            self.location = location_at_path(body, self.path)
+        return self.location
+
+    # What's `levels` steps up from the value, e.g. for "identifiedBy.[0].value" 1 is the
+    # identifier, 2 the identifiedBy list and 3 the record
+    def get_parent(self, body, levels=1):
+        return self.get_location(body)[-levels][0]
+
+    def update(self, body, new_value):
+        container, key = self.get_location(body)[-1]
+        container[key] = new_value
+
+    # Add {"@type": type, "value": value} to the list `levels` steps up from the value, returning
+    # a FieldMeta for the new value
+    def append_identifier(self, body, levels, type, value):
+        location = self.get_location(body)
+        identifiers = location[-levels][0]
+        identifiers.append({"@type": type, "value": value})
+        index = len(identifiers) - 1
+        path = ".".join(self.path.split(".")[:-levels] + [f"[{index}]", "value"])
+        new_location = location[:-levels] + [(identifiers, index), (identifiers[index], "value")]
+        return FieldMeta(path=path, id_type=self.id_type, value=value, location=new_location)
+
+    # Remove the value and clear any (now) empty containing structures for that value.
+    # _additionally_ clean min_prune_levels above it (even it they're not empty).
+    # The containers are found by reference, so removing other fields first (which shifts their
+    # indices in lists) doesn't matter.
+    def remove(self, body, min_prune_level):
+        location = self.get_location(body)
+        container, key = location[-1]
+        del container[key]
+        child = container
+        for prune_level, (container, key) in enumerate(reversed(location[:-1])):
+            if prune_level < min_prune_level or len(child) == 0:
+                if not _remove_child(container, key, child):
+                    # Already removed, together with what it was in
+                    break
+            child = container
+
 
 def chunker(seq, size):
     return (seq[pos:pos + size] for pos in range(0, len(seq), size))
 
 
-def update_at_path(root, path, new_value, cached_paths=None):
-    base_path, key = path.rsplit('.', 1)
-    if cached_paths is not None:
-        found = get_set_compiled_path(base_path, cached_paths).find(root)
-    else:
-        found = parse(base_path).find(root)
-    parent_object = found[0].value
-    #print(f"Replacing {parent_object[key]} with {new_value} at {path}")
-    parent_object[key] = new_value
-
-# Remove the value at path and clear any (now) empty containing structures for that value.
-# _additionally_ clean min_prune_levels above it (even it they're not empty).
-def remove_at_path(root, path, min_prune_level):
-    _steps = path.split('.')
-    steps = []
-    stack = []
+# The location of the value at path (e.g. "isPartOf.[0].identifiedBy.[1].value") in root, as
+# the (container, key) of each step there. As with compile_json_path, a dict (or string or number)
+# where there's an index is taken as a list of one.
+def location_at_path(root, path):
+    location = []
     current = root
-    for step in _steps:
-        if '[' in step:
-            steps.append(int(step[1:-1]))
+    for step in path.split("."):
+        if step.startswith("["):
+            key = int(step[1:-1])
+            if not isinstance(current, list):
+                current = [current]
         else:
-            steps.append(step)
-    #print (f"steps: {steps}")
+            key = step
+        location.append((current, key))
+        current = current[key]
+    return location
+
+
+def _remove_child(container, key, child):
+    # Lists by reference, as removing something before it in the list shifts the index
+    if isinstance(container, list):
+        for i, item in enumerate(container):
+            if item is child:
+                del container[i]
+                return True
+        return False
+    if container.get(key) is child:
+        del container[key]
+        return True
+    return False
 
-    for step in steps:
-        stack.append(current)
-        #print (f"*   Will now access {step} of {current}:")
-        current = current[step]
-    
-    current = stack.pop()
-    key = steps.pop()
-    del current[key]
-
-    prune_level = 0
-    while stack:
-        current = stack.pop()
-        key = steps.pop()
-
-        #print(f" * now considering deleting key {key} from obj: {current} if it is empty")
-        if prune_level < min_prune_level or len(current[key]) == 0:
-            #print(f"   now deleting key {key} from obj: {current}")
-            del current[key]
-        prune_level += 1
-
-def add_sibling_at_path(root, path, type, value, cached_paths):
-    base_path, _, _ = path.rsplit('.', 2)
-    if cached_paths is not None:
-        found = get_set_compiled_path(base_path, cached_paths).find(root)
-    else:
-        found = parse(base_path).find(root)
-    found[0].value.append({"@type": type, "value": value})
-    # Figure out and return the path for the new sibling (surely there is a better
-    # way to do this...)
-    return f"{base_path}.[{len(found[0].value) - 1}].value"
-
-
-def get_at_path(root, path, cached_paths=None):
-    if path == "":
-        return root
-    if cached_paths is not None:
-        found = get_set_compiled_path(path, cached_paths).find(root)[0].value
-    else:
-        found = parse(path).find(root)[0].value
-    return found
 
+# The subset of JSONPath used in validate.PATHS: fields, [*] and filters on a key's value, e.g.
+# 'isPartOf.[*].identifiedBy[?(@.@type=="ISSN")].value'
+JSON_PATH_STEP = re.compile(r'\.?(?:\[\*\]|\[\?\(@\.([^=]+)=="([^"]*)"\)\]|([^.\[\]]+))')
+
+
+def _field_step(name):
+    def step(value, path, location):
+        if isinstance(value, dict) and name in value:
+            yield value[name], f"{path}.{name}" if path else name, location + ((value, name),)
+
+    return step
 
-def append_at_path(root, path, type, new_value, cached_paths=None):
-    if cached_paths is not None:
-        found = get_set_compiled_path(path, cached_paths).find(root)
-    else:
-        found = parse(path).find(root)
-    found[0].value.append({"@type": type, "value": new_value})
-    return f"{path}.[{len(found[0].value) - 1}].value"
-
-
-def get_set_compiled_path(path, cached_paths):
-    compiled_path = cached_paths.get(path)
-    if not compiled_path:
-        compiled_path = parse(path)
-        cached_paths[path] = compiled_path
-    return compiled_path
-
-
-def get_common_json_paths():
-    # Pre-parse the most commonly used JSON paths
-    paths_to_cache = [
-        "hasSeries.[0].identifiedBy.[0]",
-        "identifiedBy.[0]",
-        "identifiedBy.[1]",
-        "instanceOf.hasNote.[0]",
-        "instanceOf.hasNote.[1]",
-        "instanceOf.hasNote.[2]",
-        "instanceOf.hasTitle.[0]",
-        "instanceOf.summary.[0]",
-        "instanceOf.summary.[1]",
-
-    ]
-
-    for i in range(0, 11):
-        paths_to_cache.append(f"instanceOf.contribution.[{i}]")
-        paths_to_cache.append(f"instanceOf.contribution.[{i}].agent")
-        paths_to_cache.append(f"instanceOf.contribution.[{i}].agent.identifiedBy")
-        paths_to_cache.append(f"instanceOf.contribution.[{i}].agent.identifiedBy.[0]")
-        paths_to_cache.append(f"instanceOf.contribution.[{i}].agent.identifiedBy.[1]")
-        paths_to_cache.append(f"isPartOf.[{i}].identifiedBy")
-        paths_to_cache.append(f"isPartOf.[{i}].identifiedBy.[0]")
-        paths_to_cache.append(f"isPartOf.[{i}].identifiedBy.[1]")
-    cached_paths = {}
-
-    for path in paths_to_cache:
-        cached_paths[path] = parse(path)
-
-    return cached_paths
+
+def _every_step(value, path, location):
+    # As in jsonpath_rw, a single dict (or string or number) is taken as a list of one
+    if isinstance(value, (dict, str, int)):
+        yield value, f"{path}.[0]", location + (([value], 0),)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            yield item, f"{path}.[{i}]", location + ((value, i),)
+
+
+def _filter_step(key, expected):
+    def step(value, path, location):
+        if isinstance(value, list):
+            for i, item in enumerate(value):
+                if isinstance(item, dict) and item.get(key) == expected:
+                    yield item, f"{path}.[{i}]", location + ((value, i),)
+
+    return step
+
+
+# Compiles a JSONPath (as above) to a function that, given a document, returns a list of
+# (path, value, location) for what it matches: the path as str(match.full_path) of jsonpath_rw_ext,
+# and the location as location_at_path(document, path) (for FieldMeta). A lot faster than
+# jsonpath_rw_ext's parse(path).find(document).
+def compile_json_path(json_path):
+    steps = []
+    end = 0
+    for match in JSON_PATH_STEP.finditer(json_path):
+        if match.start() != end:
+            break
+        end = match.end()
+        key, expected, field = match.groups()
+        if field:
+            steps.append(_field_step(field))
+        elif key:
+            steps.append(_filter_step(key, expected))
+        else:
+            steps.append(_every_step)
+    if end != len(json_path) or not steps:
+        raise ValueError(f"Unsupported JSON path: {json_path}")
+
+    def find(document):
+        found = [(document, "", ())]
+        for step in steps:
+            found = [child for value, path, location in found for child in step(value, path, location)]
+        return [(path, value, list(location)) for value, path, location in found]
+
+    return find
 
 
 # source: the code from sources.json (e.g. "kth", "uniarts")
@@ -595,6 +618,22 @@ class RandomisedRetry(Retry):
         return random() * super().get_backoff_time()
 
 
+# Limits the number of requests made to a host at the same time, by all processes: `slots` is
+# {host: semaphore}, the semaphores shared by the processes (see harvest._get_harvest_cache).
+# Other hosts aren't limited.
+class HostLimitedAdapter(HTTPAdapter):
+    def __init__(self, slots, **kwargs):
+        self.slots = slots
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        slot = self.slots.get(urlparse(request.url).hostname)
+        if slot is None:
+            return super().send(request, **kwargs)
+        with slot:
+            return super().send(request, **kwargs)
+
+
 def is_autoclassified(term):
     annot = term.get("@annotation", {})
     return annot.get("assigner", {}).get("@id") == SWEPUB_CLASSIFIER_ID
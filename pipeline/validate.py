@@ -1,16 +1,16 @@
 import lxml.etree as et
 from io import StringIO
-from jsonpath_rw_ext import parse
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 from os import path
 
 from pipeline.normalize import *
 
-from pipeline.util import get_at_path, remove_at_path, FieldMeta, Enrichment, Validation, Normalization, SSIF_SCHEME
+from pipeline.util import compile_json_path, FieldMeta, Enrichment, Validation, Normalization, SSIF_SCHEME
 
 from pipeline.validators.datetime import validate_date_time
-from pipeline.validators.doi import validate_doi
-from pipeline.validators.issn import validate_issn
+from pipeline.validators.doi import doi_to_verify, validate_doi, verify_doi_remotely
+from pipeline.validators.issn import issn_to_verify, validate_issn, verify_issn_remotely
 from pipeline.validators.isbn import validate_isbn
 from pipeline.validators.isi import validate_isi
 from pipeline.validators.orcid import validate_orcid
@@ -62,11 +62,20 @@ PATHS = {
     "SSIF": (f"instanceOf.classification[*].@id",),
 }
 
-PRECOMPILED_PATHS = {k: [parse(p) for p in v] for k, v in PATHS.items()}
+PRECOMPILED_PATHS = {k: [compile_json_path(p) for p in v] for k, v in PATHS.items()}
+
+# How many DOIs/ISSNs verify_remotely verifies at the same time (in each process; how many requests
+# are made to each of REMOTE_VERIFICATION_HOSTS at the same time, by all processes, is limited
+# separately, see util.HostLimitedAdapter)
+REMOTE_VERIFICATION_WORKERS = 16
+REMOTE_VERIFICATION_HOSTS = ("shortdoi.org", "api.crossref.org", "portal.issn.org")
 
 
 def _minimum_level_checker(raw_xml):
-    parsed_xml = et.parse(StringIO(raw_xml))
+    if isinstance(raw_xml, str):
+        parsed_xml = et.parse(StringIO(raw_xml))
+    else:
+        parsed_xml = raw_xml
     return MINIMUM_LEVEL_FILTER(parsed_xml)
 
 
@@ -111,7 +120,7 @@ def get_record_info(field_events):
     return stats
 
 
-def validate_stuff(field_events, session, harvest_cache, body, source, cached_paths):
+def validate_stuff(field_events, session, harvest_cache, body, source, verified):
     for id_type in field_events.values():
         for field in id_type.values():
             if field.validation_status != Validation.VALID:
@@ -120,11 +129,11 @@ def validate_stuff(field_events, session, harvest_cache, body, source, cached_pa
                 if field.id_type == "ISI":
                     validate_isi(field)
                 if field.id_type == "ORCID":
-                    validate_orcid(field, body, harvest_cache, source, cached_paths)
+                    validate_orcid(field, body, harvest_cache, source)
                 if field.id_type == "ISSN":
-                    validate_issn(field, session, harvest_cache)
+                    validate_issn(field, session, harvest_cache, verified)
                 if field.id_type == "DOI":
-                    validate_doi(field, session, harvest_cache)
+                    validate_doi(field, session, harvest_cache, verified)
                 if field.id_type == "URI":
                     validate_uri(field)
                 if field.id_type == "publication_year":
@@ -139,26 +148,26 @@ def validate_stuff(field_events, session, harvest_cache, body, source, cached_pa
                     field.validation_status = Validation.VALID  # formerly "AcceptingValidator"
 
 
-def enrich_stuff(body, field_events, cached_paths):
+def enrich_stuff(body, field_events):
     created_fields = {}
     for id_type in field_events.values():
         for field in id_type.values():
             added_stuff = []
             if field.validation_status != Validation.VALID:
                 if field.id_type == "ISBN":
-                    added_stuff = recover_isbn(body, field, cached_paths)
+                    added_stuff = recover_isbn(body, field)
                 if field.id_type == "ISI":
-                    recover_isi(body, field, cached_paths)
+                    recover_isi(body, field)
                 if field.id_type == "ORCID":
-                    recover_orcid(body, field, cached_paths)
+                    recover_orcid(body, field)
                 if field.id_type == "ISSN":
-                    added_stuff = recover_issn(body, field, cached_paths)
+                    added_stuff = recover_issn(body, field)
                 if field.id_type == "DOI":
-                    recover_doi(body, field, cached_paths)
+                    recover_doi(body, field)
                 if field.id_type == "publication_year":
-                    recover_unicode(body, field, cached_paths)
+                    recover_unicode(body, field)
                 if field.id_type == "creator_count":
-                    recover_unicode(body, field, cached_paths)
+                    recover_unicode(body, field)
 
                 if added_stuff:
                     if field.id_type not in created_fields:
@@ -169,13 +178,13 @@ def enrich_stuff(body, field_events, cached_paths):
             field_events[id_type][field.path] = field
 
 
-def enrich_stuff_a_little_more(body, field_events, harvest_cache, source, cached_paths, read_only_cursor):
+def enrich_stuff_a_little_more(body, field_events, harvest_cache, source, read_only_cursor):
     created_fields = {}
     for id_type in field_events.values():
         for field in id_type.values():
             added_stuff = []
             if field.id_type == "PersonID":
-                added_stuff = recover_orcid_from_localid(body, field, harvest_cache, source, cached_paths, read_only_cursor)
+                added_stuff = recover_orcid_from_localid(body, field, harvest_cache, source, read_only_cursor)
 
             if added_stuff:
                 if field.id_type not in created_fields:
@@ -186,41 +195,38 @@ def enrich_stuff_a_little_more(body, field_events, harvest_cache, source, cached
             field_events[id_type][field.path] = field
 
 
-def normalize_stuff(body, field_events, cached_paths):
+def normalize_stuff(body, field_events):
     for id_type in field_events.values():
         for field in id_type.values():
             # Unlike with validations/enrichments we now only look at *valid* fields
             if field.validation_status == Validation.VALID:
                 if field.id_type == "ISBN":
-                    normalize_isbn(body, field, cached_paths)
+                    normalize_isbn(body, field)
                 if field.id_type == "ISI":
-                    normalize_isi(body, field, cached_paths)
+                    normalize_isi(body, field)
                 if field.id_type == "ORCID" or field.id_type == "PersonID":
-                    normalize_orcid(body, field, cached_paths)
+                    normalize_orcid(body, field)
                 if field.id_type == "ISSN":
-                    normalize_issn(body, field, cached_paths)
+                    normalize_issn(body, field)
                 if field.id_type == "DOI":
-                    normalize_doi(body, field, cached_paths)
+                    normalize_doi(body, field)
                 if field.id_type == "free_text":
-                    normalize_free_text(body, field, cached_paths)
+                    normalize_free_text(body, field)
 
 
-def move_incorrectlyIdentifiedBy(body, field_events, cached_paths):
-    pathsToRemove = []
+def move_incorrectlyIdentifiedBy(body, field_events):
+    fieldsToRemove = []
     for id_type in field_events.values():
         for field in id_type.values():
             # For the _invalid_ fields, we (sometimes) want to add them under incorrectlyIdentifiedBy
             if field.validation_status != Validation.VALID and field.id_type in ["DOI", "ISBN", "ISI", "ISSN"]:
 
-                # Schedule the path of the bad value for removal
-                pathsToRemove.append(field.path)
+                # Schedule the bad value for removal
+                fieldsToRemove.append(field)
 
                 # Add it back, as incorrectlyIdentifiedBy
-                parentPath = ".".join(field.path.split(".")[:-3]) # strip away ".identifiedBy.[0].value" (3 items)
-                entityPath = ".".join(field.path.split(".")[:-1]) # strip away ".value" (1 item)
-
-                parent = get_at_path(body, parentPath)
-                incorrectlyIdentifiedByEntity = dict(get_at_path(body, entityPath))
+                parent = field.get_parent(body, 3) # the one with ".identifiedBy.[0].value"
+                incorrectlyIdentifiedByEntity = dict(field.get_parent(body))
 
                 if "incorrectlyIdentifiedBy" not in parent:
                     parent["incorrectlyIdentifiedBy"] = [incorrectlyIdentifiedByEntity]
@@ -239,19 +245,15 @@ def move_incorrectlyIdentifiedBy(body, field_events, cached_paths):
                     )
                 )
 
-    if pathsToRemove:
-
-        # The point of this is that for example ..identifiedBy.[1].. be
-        # removed _before_ ..identifiedBy.[0].. , becuase removing a lower index first,
-        # would displace the higher index and the wrong thing would be deleted.
-        pathsToRemove.sort(reverse=True)
-        for path in pathsToRemove:
-            remove_at_path(body, path, 1)
+    # Removing for example ..identifiedBy.[0].. displaces ..identifiedBy.[1].., but as the fields
+    # know (rather than look up by path) where they are, it can be done in any order.
+    for field in fieldsToRemove:
+        field.remove(body, 1)
 
 
 # The point of this is that invalid ORCIDs often contain other sorts of personal information
 # Which we _do not_ want to have on file, or in the worst case even publicly displayed.
-def censor_invalid_orcids(body, field_events, cached_paths):
+def censor_invalid_orcids(body, field_events):
     for id_type in field_events.values():
         for field in id_type.values():
             if field.validation_status != Validation.VALID and field.id_type == "ORCID":
@@ -265,7 +267,7 @@ def censor_invalid_orcids(body, field_events, cached_paths):
                         result=None,
                     )
                 )
-                update_at_path(body, field.path, "[redacted]", cached_paths)
+                field.update(body, "[redacted]")
 
 
 def get_clean_events(field_events):
@@ -284,30 +286,53 @@ def get_clean_events(field_events):
     return events_only
 
 
-def validate(body, harvest_cache, session, source, cached_paths, read_only_cursor):
+# Verifies the DOIs and ISSNs in a batch of (converted) records that are to be verified remotely
+# (by shortdoi.org/Crossref or portal.issn.org) all at once, each just once and several at a time,
+# instead of one at a time as each record is validated, where a slow response holds up the rest
+# of the batch. Returns {(id_type, value): valid}, for validate. What the enrichers turn up is
+# still verified as the record is validated.
+def verify_remotely(bodies, session, harvest_cache):
+    to_verify = {}
+    for body in bodies:
+        for id_type, value_to_verify, verify in [
+            ("DOI", doi_to_verify, verify_doi_remotely),
+            ("ISSN", issn_to_verify, verify_issn_remotely),
+        ]:
+            for find in PRECOMPILED_PATHS[id_type]:
+                for _, value, _ in find(body):
+                    verify_value = value and value_to_verify(value, harvest_cache)
+                    if verify_value:
+                        to_verify.setdefault((id_type, verify_value), verify)
+    if not to_verify:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(to_verify), REMOTE_VERIFICATION_WORKERS)) as executor:
+        futures = {key: executor.submit(verify, key[1], session) for key, verify in to_verify.items()}
+    # What we couldn't tell (e.g. when the server asked us to slow down) is left for validating to verify again
+    return {key: future.result() for key, future in futures.items() if future.result() is not None}
+
+
+def validate(body, harvest_cache, session, source, read_only_cursor, verified=None):
     field_events = {}
     # For each path, create a FieldMeta object that we'll use during all
     # enrichments/validations/normalizations to keep some necessary state
-    for id_type, jpath in PRECOMPILED_PATHS.items():
-        matches = itertools.chain.from_iterable(jp.find(body) for jp in jpath)
-        for match in matches:
-            if match.value:
+    for id_type, find_paths in PRECOMPILED_PATHS.items():
+        matches = itertools.chain.from_iterable(find(body) for find in find_paths)
+        for match_path, value, location in matches:
+            if value:
                 if not field_events.get(id_type):
                     field_events[id_type] = {}
-                field_events[id_type][str(match.full_path)] = FieldMeta(
-                    str(match.full_path), id_type, match.value
-                )
+                field_events[id_type][match_path] = FieldMeta(match_path, id_type, value, location=location)
 
-    validate_stuff(field_events, session, harvest_cache, body, source, cached_paths)
-    enrich_stuff(body, field_events, cached_paths)
+    validate_stuff(field_events, session, harvest_cache, body, source, verified)
+    enrich_stuff(body, field_events)
     # Second validation pass to see if enrichments made some values valid
-    validate_stuff(field_events, session, harvest_cache, body, source, cached_paths)
-    enrich_stuff_a_little_more(body, field_events, harvest_cache, source, cached_paths, read_only_cursor)
-    normalize_stuff(body, field_events, cached_paths)
+    validate_stuff(field_events, session, harvest_cache, body, source, verified)
+    enrich_stuff_a_little_more(body, field_events, harvest_cache, source, read_only_cursor)
+    normalize_stuff(body, field_events)
     # Beware, after this point all field_event paths must be considered potentially corrupt,
     # as moving things around places them at new paths!
-    move_incorrectlyIdentifiedBy(body, field_events, cached_paths)
-    censor_invalid_orcids(body, field_events, cached_paths)
+    move_incorrectlyIdentifiedBy(body, field_events)
+    censor_invalid_orcids(body, field_events)
 
     record_info = get_record_info(field_events)
     events_only = get_clean_events(field_events)
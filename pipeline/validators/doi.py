@@ -3,6 +3,7 @@ import sys
 
 from urllib.parse import quote
 
+from pipeline.idcache import get_id_cache
 from pipeline.validators.shared import remote_verification
 from pipeline.util import make_event, Validation, Enrichment
 
@@ -77,33 +78,69 @@ def _doi_is_valid_format(doi):
     return True
 
 
-def validate_unicode(doi, session=None, harvest_cache=None):
+def validate_unicode(doi, session=None, harvest_cache=None, verified=None):
     """DOI can incorporate any printable characters from the legal graphic characters of Unicode
     (https://www.doi.org/doi_handbook/2_Numbering.html)."""
     # The translate function removes illegal chars.
     return doi == doi.translate(TRANSLATE_DICT), "unicode", None
 
 
-def validate_format(doi, session=None, harvest_cache=None):
+def validate_format(doi, session=None, harvest_cache=None, verified=None):
     stripped_doi = _strip_doi_http_prefix(doi)
     return _doi_is_valid_format(stripped_doi), "format", stripped_doi
 
 
-def validate_with_remote(doi, session, harvest_cache):
+# Found if either shortDOI or Crossref finds it, not found only if neither does (Crossref doesn't
+# know about e.g. DataCite DOIs, so its not found alone doesn't say much), and None otherwise
+def verify_doi_remotely(doi, session):
+    shortdoi = _validate_with_shortdoi(doi, session)
+    if shortdoi:
+        return True
+    crossref = _validate_with_crossref(doi, session)
+    if crossref:
+        return True
+    if shortdoi is False and crossref is False:
+        return False
+    return None
+
+
+# True/False if it's known (from the static list or pipeline.idcache) whether the DOI is found or
+# not, otherwise None
+def _cached(doi, harvest_cache):
+    if doi in harvest_cache["doi_static"]:
+        return True
+    return get_id_cache().get("DOI", doi)
+
+
+# The DOI to verify remotely for value, if validating it would come to that
+def doi_to_verify(doi, harvest_cache):
+    if not isinstance(doi, str):
+        return None
+    stripped_doi = _strip_doi_http_prefix(doi)
+    if validate_unicode(doi)[0] and _doi_is_valid_format(stripped_doi) and _cached(stripped_doi, harvest_cache) is None:
+        return stripped_doi
+    return None
+
+
+# verified: {("DOI", doi): valid} for DOIs already verified remotely, see validate.verify_remotely
+def validate_with_remote(doi, session, harvest_cache, verified=None):
     stripped_doi = _strip_doi_http_prefix(doi)
-    if harvest_cache["doi_static"].get(stripped_doi, 0) or harvest_cache["doi_new"].get(
-        stripped_doi, 0
-    ):
-        return True, "remote.cache", stripped_doi
-    if not _validate_with_shortdoi(stripped_doi, session) and not _validate_with_crossref(
-        stripped_doi, session
-    ):
+    code = "remote.cache"
+    valid = _cached(stripped_doi, harvest_cache)
+    if valid is None:
+        code = "remote"
+        if verified and ("DOI", stripped_doi) in verified:
+            valid = verified[("DOI", stripped_doi)]
+        else:
+            valid = verify_doi_remotely(stripped_doi, session)
+        if valid is not None:
+            get_id_cache().put("DOI", stripped_doi, valid)
+    if not valid:
         return False, "remote.crossref", stripped_doi
-    harvest_cache["doi_new"][stripped_doi] = 1
-    return True, "remote", stripped_doi
+    return True, code, stripped_doi
 
 
-def validate_doi(field, session, harvest_cache):
+def validate_doi(field, session, harvest_cache, verified=None):
     if field.validation_status == Validation.INVALID and field.enrichment_status in [
         Enrichment.UNCHANGED,
         Enrichment.UNSUCCESSFUL,
@@ -111,7 +148,7 @@ def validate_doi(field, session, harvest_cache):
         return
 
     for validator in [validate_unicode, validate_format, validate_with_remote]:
-        success, code, new_value = validator(field.value, session, harvest_cache)
+        success, code, new_value = validator(field.value, session, harvest_cache, verified)
         if not success:
             field.events.append(
                 make_event(
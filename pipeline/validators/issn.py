@@ -3,13 +3,14 @@ import re
 from stdnum.issn import is_valid
 from stdnum.issn import format as issn_format
 
+from pipeline.idcache import get_id_cache
 from pipeline.validators.shared import remote_verification
 from pipeline.util import make_event, Validation, Enrichment
 
 issn_regex = re.compile("[0-9]{4}-?[0-9]{3}[0-9xX]")
 
 
-def validate_format(issn, session=None, harvest_cache=None):
+def validate_format(issn, session=None, harvest_cache=None, verified=None):
     if issn is not None and isinstance(issn, str):
         hit = issn_regex.fullmatch(issn)
         if hit is None:
@@ -17,32 +18,54 @@ def validate_format(issn, session=None, harvest_cache=None):
         return True, "format"
 
 
-def validate_checksum(issn, session=None, harvest_cache=None):
+def validate_checksum(issn, session=None, harvest_cache=None, verified=None):
     return is_valid(issn), "checksum"
 
 
-def validate_cache_or_remote(issn, session=None, harvest_cache=None):
+def verify_issn_remotely(issn, session):
+    return remote_verification(f"https://portal.issn.org/resource/ISSN/{issn}?format=json", session)
+
+
+# True/False if it's known (from the static list or pipeline.idcache) whether the ISSN is found or
+# not, otherwise None
+def _cached(issn, harvest_cache):
     # Formatting/normalizing the ISSN doesn't change validity, it just helps us avoid cache misses,
     # as the static list of ISSNs should have them correctly formatted.
     formatted_issn = issn_format(issn)
+    if formatted_issn in harvest_cache["issn_static"]:
+        return True
+    return get_id_cache().get("ISSN", formatted_issn)
 
-    if harvest_cache:
-        if harvest_cache["issn_static"].get(formatted_issn, 0) or harvest_cache["issn_new"].get(
-            issn, 0
-        ):
-            return True, "remote.cache"
-
-    if session and not remote_verification(
-        f"https://portal.issn.org/resource/ISSN/{issn}?format=json", session
-    ):
-        return False, "remote"
 
+# The ISSN to verify remotely, if validating it would come to that
+def issn_to_verify(issn, harvest_cache):
+    if isinstance(issn, str) and validate_format(issn)[0] and validate_checksum(issn)[0] and _cached(issn, harvest_cache) is None:
+        return issn
+    return None
+
+
+# verified: {("ISSN", issn): valid} for ISSNs already verified remotely, see validate.verify_remotely
+def validate_cache_or_remote(issn, session=None, harvest_cache=None, verified=None):
     if harvest_cache:
-        harvest_cache["issn_new"][issn] = 1
+        valid = _cached(issn, harvest_cache)
+        if valid is not None:
+            return valid, "remote.cache" if valid else "remote"
+
+    if verified and ("ISSN", issn) in verified:
+        valid = verified[("ISSN", issn)]
+    elif session:
+        valid = verify_issn_remotely(issn, session)
+    else:
+        return True, "remote"
+
+    if harvest_cache and valid is not None:
+        get_id_cache().put("ISSN", issn, valid)
+    if not valid:
+        return False, "remote"
     return True, "remote"
 
 
-def validate_issn(field, session=None, harvest_cache=None):
+def validate_issn(field, session=None, harvest_cache=None, verified=None):
     if field.validation_status == Validation.INVALID and field.enrichment_status in [
         Enrichment.UNCHANGED,
         Enrichment.UNSUCCESSFUL,
@@ -50,7 +73,7 @@ def validate_issn(field, session=None, harvest_cache=None):
         return
 
     for validator in [validate_format, validate_checksum, validate_cache_or_remote]:
-        success, code = validator(field.value, session, harvest_cache)
+        success, code = validator(field.value, session, harvest_cache, verified)
         if not success:
             field.events.append(
                 make_event(event_type="validation", code=code, result="invalid", value=field.value)
@@ -3,7 +3,7 @@ import re
 from stdnum.iso7064.mod_11_2 import is_valid
 
 from pipeline.validators.shared import validate_base_unicode
-from pipeline.util import make_event, Validation, Enrichment, get_at_path, get_localid_cache_key
+from pipeline.util import make_event, Validation, Enrichment, get_localid_cache_key
 
 # flake8: noqa W504
 orcid_regex = re.compile(
@@ -55,7 +55,7 @@ def validate_checksum(orcid):
         return False, "checksum"
 
 
-def validate_orcid(field, body, harvest_cache, source, cached_paths={}):
+def validate_orcid(field, body, harvest_cache, source):
     if field.validation_status == Validation.INVALID and field.enrichment_status in [
         Enrichment.UNCHANGED,
         Enrichment.UNSUCCESSFUL,
@@ -79,8 +79,7 @@ def validate_orcid(field, body, harvest_cache, source, cached_paths={}):
     # At this point we have a valid ORCID. If the same agent also has a local ID, save the
     # local ID->ORCID key->value in the cache so that we can later add ORCID in records where
     # we encounter the same local ID (but no ORCID)
-    parent_path = field.path.rsplit(".", 3)[0]
-    parent_value = get_at_path(body, parent_path, cached_paths)
+    parent_value = field.get_parent(body, 3)
 
     if parent_value.get("@type", '') != "Person":
         return
@@ -96,6 +95,5 @@ def validate_orcid(field, body, harvest_cache, source, cached_paths={}):
                 continue
 
             cache_key = get_localid_cache_key(id_by, person_name, source)
-            if not harvest_cache["localid_to_orcid"].get(cache_key):
-                harvest_cache["localid_to_orcid"][cache_key] = {"orcid": field.value, "oai_id": body["@id"]}
+            harvest_cache["localid_to_orcid"].setdefault(cache_key, {"orcid": field.value, "oai_id": body["@id"]})
             break
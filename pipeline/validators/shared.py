@@ -18,9 +18,11 @@ def _is_valid_uri(url):
     return rfc3987.match(url, "URI") is not None
 
 
+# True if found, False if not and None if we couldn't tell (which is just as falsy, but isn't to
+# be remembered, see pipeline.idcache)
 def remote_verification(url, session):
     if getenv("SWEPUB_SKIP_REMOTE"):
-        return False
+        return None
 
     if not _is_valid_uri(url):
         return False
@@ -30,5 +32,9 @@ def remote_verification(url, session):
     try:
         r = session.get(url, timeout=8, headers={"User-Agent": SWEPUB_USER_AGENT})
     except Exception:  # Timeout, ReadTimeout ?
+        return None
+    if r.status_code == 200:
+        return True
+    if 400 <= r.status_code < 500 and r.status_code != 429:
         return False
-    return r.status_code == 200
+    return None
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from urllib.parse import quote
+
+from pipeline.swepublog import logger as log
+
+# By default SQLite checkpoints the WAL itself, in whichever connection commits when the WAL has
+# grown past 1000 pages, so the storage writer (or whatever is writing) now and then stalls on a
+# checkpoint; and as a checkpoint can't restart the WAL while it's being read, the WAL keeps growing
+# during long phases, which slows down reads. While the pipeline runs, a background thread takes care
+# of it instead (and connections don't checkpoint, see storage.connect):
+# - every WAL_CHECK_INTERVAL seconds in which something has been written, a PASSIVE checkpoint, which
+#   copies what it can to the database without waiting for (or blocking) anyone
+# - once the WAL holds WAL_RESTART_SIZE bytes and all of it has been copied, a RESTART checkpoint,
+#   which waits (at most WAL_RESTART_TIMEOUT seconds) for readers to move on, so that writers start
+#   over from the beginning of the WAL instead of growing it
+# - at the end of each phase, when nothing else is running, a TRUNCATE checkpoint, which also empties
+#   the WAL file
+WAL_CHECK_INTERVAL = 1.0
+WAL_RESTART_SIZE = 64 * 1024 * 1024
+WAL_RESTART_TIMEOUT = 0.1
+WAL_TRUNCATE_TIMEOUT = 60
+
+
+# Whether the database at `sqlite_path` is being checkpointed by a WalCheckpointer (in this or, as it's
+# in the environment, a parent process)
+def background_checkpointing(sqlite_path):
+    return os.getenv("SWEPUB_WAL_CHECKPOINTER") == os.path.abspath(sqlite_path)
+
+
+class WalCheckpointer:
+    def __init__(self, sqlite_path):
+        self.sqlite_path = os.path.abspath(sqlite_path)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_seen = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.checkpoints = 0
+        self.max_latency = 0.0
+
+    # To be started before the processes writing to the database, so that their connections leave
+    # the checkpointing to it
+    def start(self):
+        os.environ["SWEPUB_WAL_CHECKPOINTER"] = self.sqlite_path
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="wal-checkpointer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if os.getenv("SWEPUB_WAL_CHECKPOINTER") == self.sqlite_path:
+            del os.environ["SWEPUB_WAL_CHECKPOINTER"]
+
+    # Empty the WAL once a phase is done, and log how checkpointing went during it
+    def phase_done(self, phase):
+        try:
+            busy, _, _, latency = self._checkpoint("TRUNCATE", WAL_TRUNCATE_TIMEOUT)
+            log.info(
+                f"WAL checkpoint after {phase} {'was blocked' if busy else 'ran'} for {round(latency, 2)} seconds "
+                f"({self.checkpoints} background checkpoints, the longest {round(self.max_latency, 2)} seconds)"
+            )
+        except sqlite3.Error as e:
+            log.warning(f"WAL checkpoint after {phase} failed: {e}")
+        self._reset_stats()
+
+    def _run(self):
+        while not self._stopped.wait(WAL_CHECK_INTERVAL):
+            try:
+                self._checkpoint_if_written()
+            except (OSError, sqlite3.Error) as e:
+                log.debug(f"Background WAL checkpoint failed: {e}")
+
+    def _checkpoint_if_written(self):
+        wal_path = f"{self.sqlite_path}-wal"
+        if not os.path.exists(wal_path):
+            return
+        stat = os.stat(wal_path)
+        if (stat.st_ino, stat.st_size, stat.st_mtime_ns) == self._last_seen:
+            return
+        self._last_seen = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        _, wal_size, checkpointed, latency = self._checkpoint("PASSIVE", 0)
+        self._record(latency)
+        if wal_size >= WAL_RESTART_SIZE and checkpointed == wal_size:
+            busy, _, _, latency = self._checkpoint("RESTART", WAL_RESTART_TIMEOUT)
+            self._record(latency)
+            log.debug(f"WAL restart checkpoint {'was blocked' if busy else 'ran'} for {round(latency, 3)} seconds")
+
+    def _record(self, latency):
+        self.checkpoints += 1
+        self.max_latency = max(self.max_latency, latency)
+
+    def _connect(self, timeout):
+        # (mode=rw: never create the database, should it be in the middle of being replaced)
+        return closing(sqlite3.connect(f"file:{quote(self.sqlite_path)}?mode=rw", uri=True, timeout=timeout))
+
+    # Returns (busy, bytes in the WAL, bytes of it checkpointed, seconds taken)
+    def _checkpoint(self, mode, timeout):
+        with self._lock:
+            t0 = time.monotonic()
+            with self._connect(timeout) as connection:
+                busy, frames, checkpointed = connection.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+                page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+            return busy, frames * page_size, checkpointed * page_size, time.monotonic() - t0
@@ -36,7 +36,8 @@ CREATE TABLE original (
     source_subset TEXT,
     oai_id TEXT UNIQUE, -- NOTE: if you remove UNIQUE for whatever reason, _do_ create an index on oai_id
     accepted INTEGER, -- (fake boolean 1/0)
-    data TEXT
+    data TEXT,
+    content_hash TEXT -- of the record's metadata, see pipeline.oai.Record.content_hash
 );
 CREATE INDEX idx_original_source ON original (source);
 
@@ -51,32 +52,21 @@ CREATE TABLE rejected (
 CREATE INDEX idx_rejected_harvest_id ON rejected(harvest_id);
 
 
--- This table is used to store log entries (validation/normalization errors etc.) for
--- each publication
-CREATE TABLE converted_record_info (
-    converted_id INTEGER,
+-- The validation/enrichment/normalization status of each field of a publication, and its audit
+-- results, packed into one row per publication. See pipeline/recordflags.py for the format.
+CREATE TABLE converted_flags (
+    converted_id INTEGER PRIMARY KEY,
     source TEXT,
     date INTEGER,
-    field_name TEXT,
-    validation_status INTEGER,
-    enrichment_status INTEGER,
-    normalization_status INTEGER,
-    audit_name TEXT,
-    audit_code TEXT,
-    audit_result INTEGER,
+    validation INTEGER,
+    enrichment INTEGER,
+    normalization INTEGER,
+    audit INTEGER,
+    audit_true INTEGER,
+    audit_false INTEGER,
     FOREIGN KEY (converted_id) REFERENCES converted(id) ON DELETE CASCADE
 );
-CREATE INDEX idx_converted_record_info_converted_id ON converted_record_info(converted_id);
-CREATE INDEX idx_converted_record_info_field_name ON converted_record_info(field_name);
-CREATE INDEX idx_converted_record_info_validation_status ON converted_record_info(validation_status);
-CREATE INDEX idx_converted_record_info_enrichment_status ON converted_record_info(enrichment_status);
-CREATE INDEX idx_converted_record_info_normalization_status ON converted_record_info(normalization_status);
-CREATE INDEX idx_converted_record_info_source_field_name ON converted_record_info(source, field_name);
-CREATE INDEX idx_converted_record_info_source_date_field_name ON converted_record_info(source, date, field_name);
-CREATE INDEX idx_converted_record_info_audit_code ON converted_record_info(audit_code);
-CREATE INDEX idx_converted_record_info_source_audit_code ON converted_record_info(source, audit_code);
-CREATE INDEX idx_converted_record_info_source_date_audit_code ON converted_record_info(source, date, audit_code);
-CREATE INDEX idx_converted_record_info_audit_name_audit_result ON converted_record_info(audit_name, audit_result);
+CREATE INDEX idx_converted_flags_source_date ON converted_flags(source, date);
 
 
 -- This table maps pairs of (source OAI ID, cache_key) to a certain ORCID
@@ -358,7 +348,7 @@ BEGIN
             ) AND converted_id != OLD.id
         );
 
-    DELETE FROM converted_record_info WHERE converted_record_info.converted_id = OLD.id;
+    DELETE FROM converted_flags WHERE converted_flags.converted_id = OLD.id;
     DELETE FROM converted_ssif_1 WHERE converted_ssif_1.converted_id = OLD.id;
     DELETE FROM clusteringidentifiers WHERE clusteringidentifiers.converted_id = OLD.id;
     DELETE FROM cluster WHERE cluster.converted_id = OLD.id;
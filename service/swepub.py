@@ -23,7 +23,7 @@ from flask import (
 )
 from flask_cors import CORS
 from lxml.etree import LxmlError
-from pypika import Query, Tables, Parameter, Table, Criterion
+from pypika import Query, Tables, Parameter, Table, Criterion, CustomFunction
 from pypika.terms import BasicCriterion
 from pypika import functions as fn
 from collections import Counter
@@ -34,6 +34,8 @@ from pipeline.convert import ModsParser
 from pipeline.util import Enrichment, Normalization, Validation, ENRICHING_AUDITORS_CODES, SSIF_SCHEME
 from pipeline.legacy_publication import Publication as LegacyPublication
 from pipeline.ldcache import embellish
+from pipeline.compression import register_decompress
+from pipeline.recordflags import audit_result, field_status
 
 from service.utils import bibliometrics
 from service.utils.common import *
@@ -48,6 +50,8 @@ PROJECT_ROOT = MODULE_DIR.parent
 # sqlite DB path defaults to file in parent directory of swepub.py directory if SWEPUB_DB_READONLY not set
 SWEPUB_DB_READONLY = getenv("SWEPUB_DB_READONLY") or str(PROJECT_ROOT / "swepub.sqlite3")
 
+decompress = CustomFunction("decompress", ["value"])
+
 with (PROJECT_ROOT / "resources" / "ssif.jsonld").open() as f:
     SSIF_DATA = json.load(f)
 
@@ -91,6 +95,8 @@ def get_db():
         cursor.execute("PRAGMA cache_size=-64000")  # negative number = kibibytes
         cursor.execute("PRAGMA temp_store=MEMORY")
         cursor.execute("PRAGMA journal_mode=WAL")
+        # Compressed columns (see pipeline.compression) are read with decompress()
+        register_decompress(db, SWEPUB_DB_READONLY)
     return db
 
 
@@ -322,7 +328,7 @@ def bibliometrics_api():
         q_orgs = q_orgs.join(search_org).on(search_org.finalized_id == search_single.finalized_id)
 
     q_total = q.select(fn.Count(search_single.finalized_id).distinct().as_("total"))
-    q = q.select(finalized.data).distinct()
+    q = q.select(decompress(finalized.data).as_("data")).distinct()
     q = q.join(finalized).on(search_single.finalized_id == finalized.id)
     if limit:
         q = q.limit(limit)
@@ -387,7 +393,7 @@ def bibliometrics_get_record(record_id):
         _errors(['Missing parameter: "record_id"'], status_code=400)
 
     cur = get_db().cursor()
-    row = cur.execute("SELECT data FROM finalized WHERE oai_id = ?", [record_id]).fetchone()
+    row = cur.execute("SELECT decompress(data) FROM finalized WHERE oai_id = ?", [record_id]).fetchone()
     if not row:
         _errors(["Not Found"], status_code=404)
     doc = json.loads(row[0])
@@ -728,7 +734,7 @@ def process_get_publication(record_id=None):
 
     cur = get_db().cursor()
     row = cur.execute(
-        "SELECT data, modified FROM converted WHERE oai_id = ? AND deleted = 0", [record_id]
+        "SELECT decompress(data), modified FROM converted WHERE oai_id = ? AND deleted = 0", [record_id]
     ).fetchone()
     if not row:
         _errors(["Not Found"], status_code=404)
@@ -747,7 +753,7 @@ def process_get_original_publication(record_id=None):
         _errors(['Missing parameter: "record_id"'], status_code=400)
 
     cur = get_db().cursor()
-    row = cur.execute("SELECT data FROM original WHERE oai_id = ?", [record_id]).fetchone()
+    row = cur.execute("SELECT decompress(data) FROM original WHERE oai_id = ?", [record_id]).fetchone()
     if not row:
         _errors(["Not Found"], status_code=404)
     return Response(row[0], mimetype="application/xml; charset=utf-8")
@@ -1051,20 +1057,18 @@ def process_get_export(source=None):
     if errors:
         _errors(errors)
 
-    converted, converted_record_info, converted_audit_events = Tables(
-        "converted", "converted_record_info", "converted_audit_events"
-    )
+    converted, converted_flags = Tables("converted", "converted_flags")
     values = []
     q = (
         Query
         .from_(converted)
-        .left_join(converted_record_info).on(converted.id == converted_record_info.converted_id)
-        .where(converted_record_info.source == Parameter("?"))
+        .left_join(converted_flags).on(converted.id == converted_flags.converted_id)
+        .where(converted_flags.source == Parameter("?"))
     )
     values.append(source)
 
     if g.from_yr and g.to_yr:
-        q = q.where((converted_record_info.date >= Parameter("?")) & (converted_record_info.date <= Parameter("?")))
+        q = q.where((converted_flags.date >= Parameter("?")) & (converted_flags.date <= Parameter("?")))
         values.append([g.from_yr, g.to_yr])
 
     # Specified flags should be OR'd together, so we build up a list of criteria and use
@@ -1074,24 +1078,20 @@ def process_get_export(source=None):
         for flag_name, flag_values in flags.items():
             if flag_type in ["validation", "enrichment", "normalization"] and flag_name not in ENRICHING_AUDITORS_CODES:
                 for flag_value in flag_values:
+                    # The field's status is a bit field in the status type's column (see pipeline.recordflags)
                     criteria.append(
-                        (converted_record_info.field_name == Parameter("?"))
-                        & (converted_record_info[f"{flag_type}_status"] == Parameter("?"))
+                        converted_flags[flag_type].bitwiseand(Parameter("?")) == Parameter("?")
                     )
                     if flag_type == "enrichment":
-                        flag_value = int(Enrichment[flag_value.upper()])
+                        flag_value = Enrichment[flag_value.upper()]
                     if flag_type == "normalization":
-                        flag_value = int(Normalization[flag_value.upper()])
+                        flag_value = Normalization[flag_value.upper()]
                     if flag_type == "validation":
-                        flag_value = int(Validation[flag_value.upper()])
+                        flag_value = Validation[flag_value.upper()]
 
-                    values.append([flag_name, flag_value])
+                    values.append(field_status(flag_name, flag_value))
             if flag_type == "audit" or flag_name in ENRICHING_AUDITORS_CODES:
                 for flag_value in flag_values:
-                    criteria.append(
-                        (converted_record_info.audit_code == Parameter("?"))
-                        & (converted_record_info.audit_result == Parameter("?"))
-                    )
                     # TODO: Fix horrible "valid"/"invalid" 0/1 confusion
                     if flag_value == "valid" or (
                         flag_name == "creator_count_check" and flag_value == "invalid"
@@ -1099,7 +1099,9 @@ def process_get_export(source=None):
                         int_flag_value = 0
                     else:
                         int_flag_value = 1
-                    values.append([flag_name, int_flag_value])
+                    column, bit = audit_result(flag_name, int_flag_value)
+                    criteria.append(converted_flags[column].bitwiseand(Parameter("?")) != 0)
+                    values.append(bit)
     q = q.where(Criterion.any(criteria))
 
     q_total = q.select(fn.Count(converted.id).distinct().as_("total"))
@@ -1111,7 +1113,13 @@ def process_get_export(source=None):
 
     q = (
         Query.from_(converted)
-        .select(converted.id, converted.date, converted.data, converted.events, converted.oai_id)
+        .select(
+            converted.id,
+            converted.date,
+            decompress(converted.data).as_("data"),
+            decompress(converted.events).as_("events"),
+            converted.oai_id,
+        )
         .where(converted.id.isin(sub_q))
     )
 